@@ -0,0 +1,138 @@
+# Measure validating and serializing large fatstacks surfaces, with the bytes JSON path against
+# parsing to Python data first, the cached validators against building one per call and the
+# discriminated unions against the plain unions the schema declared before.
+#
+#   python -m benchmarks.fatstacks_validation [items]
+
+import json
+import sys
+import time
+from typing import Callable, Dict, List
+
+from pydantic import TypeAdapter
+
+from fatstacks.schema.action import (
+    Action,
+    NavigateActionBehavior,
+    RequestActionBehavior,
+    ToastActionBehavior,
+)
+from fatstacks.schema.item import (
+    ContentAction,
+    ContentAuto,
+    ContentImage,
+    ContentPrimitive,
+    ContentText,
+    Item,
+)
+from fatstacks.schema.surface import Surface
+from fatstacks.validation import adapter, dump_json, validate
+
+
+# The unions as declared before they were discriminated, without the Type[...] wrapper that kept
+# them from validating documents at all. Pydantic tries every member of these and picks the best match.
+UndiscriminatedContent = ContentAuto | ContentText | ContentImage | ContentAction
+UndiscriminatedBehavior = NavigateActionBehavior | RequestActionBehavior | ToastActionBehavior
+
+
+class UndiscriminatedItem(Item):
+    content: (
+        Dict[str, UndiscriminatedContent | ContentPrimitive]
+        | List[UndiscriminatedContent | ContentPrimitive]
+        | UndiscriminatedContent
+        | ContentPrimitive
+    )
+
+
+class UndiscriminatedAction(Action):
+    behavior: UndiscriminatedBehavior | List[UndiscriminatedBehavior]
+
+
+class UndiscriminatedSurface(Surface):
+    items: List[UndiscriminatedItem]
+    actions: List[UndiscriminatedAction] | None = None
+
+
+def make_surface(item_count: int) -> bytes:
+    """A surface mixing every content shape items can have, and actions with every behavior."""
+    items = []
+    for i in range(item_count):
+        match i % 4:
+            case 0:
+                content = {"type": "text", "text": f"Item {i}", "size": "medium"}
+            case 1:
+                content = {
+                    "title": f"Row {i}",
+                    "price": i * 1.5,
+                    "image": {"type": "image", "url": f"https://example.com/{i}.png"},
+                }
+            case 2:
+                content = [i, "label", {"type": "action", "action": "open"}]
+            case _:
+                content = i
+        items.append(
+            {
+                "id": f"item-{i}",
+                "content": content,
+                "data": {"index": i, "even": i % 2 == 0},
+                "actions": ["open"],
+            }
+        )
+    actions = [
+        {
+            "id": "open",
+            "behavior": [
+                {"type": "request", "endpoint": "/api/open", "payload": {"id": {"fromData": "index"}}},
+                {"type": "navigate", "targetUri": "surface://detail", "queryParams": {"id": "1"}},
+                {"type": "toast", "message": "Opened"},
+            ],
+        }
+    ] * max(1, item_count // 100)
+    surface = {"id": "large", "name": "Large surface", "items": items, "actions": actions}
+    return json.dumps(surface).encode()
+
+
+def timed(label: str, fn: Callable[[], object], repeat: int):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    per_call = (time.perf_counter() - started) / repeat
+    print(f"{label:>36}: {per_call * 1000:8.2f} ms")
+
+
+def main():
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    body = make_surface(item_count)
+    print(f"surface: {item_count} items, {len(body) / 1e6:.1f} MB of JSON")
+
+    repeat = 5
+    surface = validate(Surface, body)
+    timed("validate json.loads + python", lambda: validate(Surface, json.loads(body)), repeat)
+    timed("validate bytes", lambda: validate(Surface, body), repeat)
+    undiscriminated = validate(UndiscriminatedSurface, body)
+    assert undiscriminated.model_dump() == surface.model_dump(), "The schemas disagree on the surface"
+    timed("validate bytes, plain unions", lambda: validate(UndiscriminatedSurface, body), repeat)
+
+    # Batches of small documents, where building the validator dominates
+    batch = b"[" + b",".join([make_surface(10)] * 20) + b"]"
+    timed(
+        "batch, new TypeAdapter per call",
+        lambda: TypeAdapter(List[Surface]).validate_json(batch),
+        repeat,
+    )
+    timed(
+        "batch, cached TypeAdapter",
+        lambda: adapter(List[Surface]).validate_json(batch),
+        repeat,
+    )
+    timed(
+        "dump json.dumps(model_dump())",
+        lambda: json.dumps(surface.model_dump(mode="json")).encode(),
+        repeat,
+    )
+    timed("dump bytes", lambda: dump_json(surface), repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# Compare the JSON and MessagePack encodings of large fatstacks surfaces: size on the wire, raw and
+# gzipped, and the time to encode a validated surface and to decode and validate it again.
+#
+#   python -m benchmarks.fatstacks_wire [items]
+
+import gzip
+import sys
+import time
+from typing import Callable
+
+from benchmarks.fatstacks_validation import make_surface
+from fatstacks.schema.surface import Surface
+from fatstacks.validation import validate
+from fatstacks.wire import JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, decode, encode
+
+
+def timed(fn: Callable[[], object], repeat: int = 5) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    surface = validate(Surface, make_surface(item_count))
+    print(f"surface: {item_count} items")
+
+    print(f"{'':>20} {'bytes':>10} {'gzipped':>10} {'encode':>10} {'decode':>10}")
+    for media_type in (JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE):
+        body = encode(surface, media_type)
+        encode_time = timed(lambda: encode(surface, media_type))
+        decode_time = timed(lambda: decode(Surface, body, media_type))
+        print(
+            f"{media_type:>20} {len(body):>10} {len(gzip.compress(body)):>10} "
+            f"{encode_time * 1000:>8.1f}ms {decode_time * 1000:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
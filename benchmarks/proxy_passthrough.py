@@ -0,0 +1,62 @@
+# Compare the CPU cost of streaming a large gzip response through the proxy decoded
+# (the old aiter_bytes behaviour) against passing the raw bytes through (aiter_raw).
+#
+#   python -m benchmarks.proxy_passthrough [size_mb]
+
+import asyncio
+import gzip
+import json
+import sys
+import time
+
+import httpx
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """Hands out the body in network sized chunks, like a real upstream connection."""
+
+    def __init__(self, body: bytes, chunk_size: int = 64 * 1024):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self):
+        view = memoryview(self.body)
+        for start in range(0, len(view), self.chunk_size):
+            yield bytes(view[start : start + self.chunk_size])
+
+
+def make_body(size_mb: int) -> bytes:
+    row = {"id": 1, "name": "example", "tags": ["a", "b", "c"], "active": True}
+    rows = [dict(row, id=i) for i in range(size_mb * 1024 * 1024 // 64)]
+    return gzip.compress(json.dumps(rows).encode(), compresslevel=6)
+
+
+async def stream_through(body: bytes, raw: bool) -> tuple[float, int]:
+    def handler(_: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+            stream=ChunkedStream(body),
+        )
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        started = time.process_time()
+        sent = 0
+        async with client.stream("GET", "http://upstream/") as response:
+            chunks = response.aiter_raw() if raw else response.aiter_bytes()
+            async for chunk in chunks:
+                sent += len(chunk)
+        return time.process_time() - started, sent
+
+
+async def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    body = make_body(size_mb)
+    print(f"gzip body: {len(body) / 1e6:.1f} MB compressed")
+    for label, raw in (("decode (aiter_bytes)", False), ("raw (aiter_raw)", True)):
+        cpu, sent = await stream_through(body, raw)
+        print(f"{label:>22}: {cpu * 1000:8.1f} ms CPU, {sent / 1e6:8.1f} MB sent")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
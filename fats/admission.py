@@ -0,0 +1,221 @@
+# Per-app admission control for the proxy
+# Limits how many requests may be in flight towards an app's containers at once
+# and how many requests per second it accepts, with a short bounded wait queue
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from math import ceil
+from time import monotonic
+from typing import Dict, Optional
+
+from .models.project_config import ProjectConfig
+
+# Used when an app does not specify its own queue settings
+DEFAULT_QUEUE_SIZE = 32
+QUEUE_TIMEOUT_SECONDS = 2.0
+
+# Weight of the newest sample in the latency moving average
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted to an app right now."""
+
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, ceil(self.retry_after)))
+
+
+@dataclass
+class AdmissionLimits:
+    max_in_flight: Optional[int] = None
+    requests_per_second: Optional[float] = None
+    queue_size: int = DEFAULT_QUEUE_SIZE
+
+    @classmethod
+    def from_project(cls, project: ProjectConfig) -> "AdmissionLimits":
+        return cls(
+            max_in_flight=project.max_in_flight,
+            requests_per_second=project.max_requests_per_second,
+            queue_size=(
+                project.queue_size
+                if project.queue_size is not None
+                else DEFAULT_QUEUE_SIZE
+            ),
+        )
+
+
+class TokenBucket:
+    """A token bucket refilled at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available.
+
+        Returns 0 on success, otherwise the number of seconds until a token will be available.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AppAdmission:
+    """Admission state for a single app (project config)."""
+
+    def __init__(self, limits: AdmissionLimits):
+        self.limits = limits
+        self.bucket: Optional[TokenBucket] = None
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected_rate_limited = 0
+        self.rejected_queue_full = 0
+        self.rejected_queue_timeout = 0
+        self.latency_ewma: Optional[float] = None
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self.update_limits(limits)
+
+    def update_limits(self, limits: AdmissionLimits):
+        rps = limits.requests_per_second
+        if rps is None or rps <= 0:
+            self.bucket = None
+        elif self.bucket is None or self.bucket.rate != rps:
+            # Allow a burst of one second worth of requests
+            self.bucket = TokenBucket(rps, max(1.0, rps))
+        self.limits = limits
+        # A raised concurrency limit may free up slots for queued requests
+        while self._waiters and self._has_free_slot():
+            self._hand_slot_to_next_waiter()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _has_free_slot(self) -> bool:
+        max_in_flight = self.limits.max_in_flight
+        return (
+            max_in_flight is None
+            or max_in_flight <= 0
+            or self.in_flight < max_in_flight
+        )
+
+    def _hand_slot_to_next_waiter(self) -> bool:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+                return True
+        return False
+
+    async def acquire(self):
+        """
+        Wait for permission to send a request upstream. Must be paired with release().
+
+        Raises AdmissionRejected if the app is over its rate limit or the wait queue is full or times out.
+        """
+        if self.bucket is not None:
+            wait = self.bucket.try_acquire()
+            if wait > 0:
+                self.rejected_rate_limited += 1
+                raise AdmissionRejected(429, "Too many requests", wait)
+
+        if not self._waiters and self._has_free_slot():
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.limits.queue_size:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(503, "Application is at capacity", 1)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            # A slot may have been handed to us just as the timeout fired
+            if not (waiter.done() and not waiter.cancelled()):
+                self.rejected_queue_timeout += 1
+                raise AdmissionRejected(503, "Application is at capacity", 1)
+        except asyncio.CancelledError:
+            # We may have been handed a slot right as we were cancelled, give it back
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+
+    def release(self):
+        self.in_flight -= 1
+        if self._has_free_slot():
+            self._hand_slot_to_next_waiter()
+
+    def record_latency(self, seconds: float):
+        """Record the time an upstream took to start responding."""
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (seconds - self.latency_ewma)
+
+    def stats(self) -> Dict[str, int | float | None]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "latency_ewma_seconds": self.latency_ewma,
+            "admitted": self.admitted,
+            "rejected_rate_limited": self.rejected_rate_limited,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_queue_timeout": self.rejected_queue_timeout,
+            "max_in_flight": self.limits.max_in_flight,
+            "requests_per_second": self.limits.requests_per_second,
+            "queue_size": self.limits.queue_size,
+        }
+
+
+# Keyed by "name:version" of the project config
+_admissions: Dict[str, AppAdmission] = {}
+
+
+def get_admission(project: ProjectConfig) -> AppAdmission:
+    """Get the admission state for an app, updating its limits if the config changed."""
+    key = f"{project.name}:{project.version}"
+    limits = AdmissionLimits.from_project(project)
+    admission = _admissions.get(key)
+    if admission is None:
+        admission = _admissions[key] = AppAdmission(limits)
+    elif admission.limits != limits:
+        admission.update_limits(limits)
+    return admission
+
+
+def find_admission(project: ProjectConfig) -> Optional[AppAdmission]:
+    """Get the admission state for an app if it has received any traffic."""
+    return _admissions.get(f"{project.name}:{project.version}")
+
+
+def admission_stats() -> Dict[str, Dict[str, int | float | None]]:
+    return {key: admission.stats() for key, admission in _admissions.items()}
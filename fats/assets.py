@@ -0,0 +1,254 @@
+# Static assets served by the proxy itself
+# Directories an app declares in static_dirs are snapshotted at build time into a content-addressed
+# store under the fats data directory, with a manifest per app version mapping url paths to blobs.
+
+import asyncio
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncGenerator, Dict, List, Optional, Set, Tuple
+
+import aiofiles
+
+from .models.project_config import ProjectConfig
+from .utils import log, warning
+from .utils.sqlite import FATS_DATA_DIR
+
+ASSETS_DIR = FATS_DATA_DIR / "assets"
+BLOBS_DIR = ASSETS_DIR / "blobs"
+MANIFESTS_DIR = ASSETS_DIR / "manifests"
+
+ASSET_CHUNK_SIZE = 256 * 1024
+
+# Names like app.3f2a9c1b.js or chunk-5NQ3VJ6R.css change whenever their content does
+FINGERPRINT_REGEX = re.compile(r"[.-]([0-9a-fA-F]{8,}|[0-9A-Z]{8})\.[^/]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+
+# Files younger than this may belong to a build that has not been recorded yet, so are never pruned
+PRUNE_MIN_AGE_SECONDS = 60 * 60
+
+# Manifests are small and read on every asset request, so they are kept in memory per app version
+_manifests: Dict[str, Optional[Dict[str, "Asset"]]] = {}
+_served = 0
+_served_bytes = 0
+
+
+@dataclass(frozen=True)
+class Asset:
+    sha256: str
+    size: int
+    content_type: str
+
+    @property
+    def path(self) -> Path:
+        return _blob_path(self.sha256)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.sha256}"'
+
+
+def _blob_path(sha256: str) -> Path:
+    return BLOBS_DIR / sha256[:2] / sha256
+
+
+def _manifest_path(name: str, version: str) -> Path:
+    # Image names may contain slashes, so manifests are named by a digest of name:version
+    digest = hashlib.sha256(f"{name}:{version}".encode()).hexdigest()
+    return MANIFESTS_DIR / f"{digest}.json"
+
+
+def parse_static_dirs(value: str) -> List[str]:
+    """
+    Parse the static_dirs option, a comma separated list of `dir` or `dir:/prefix` entries.
+    A bare `dir` is served under `/dir`.
+    """
+    return [entry.strip() for entry in value.split(",") if entry.strip()]
+
+
+def _mounts(static_dirs: List[str]) -> List[Tuple[str, str]]:
+    mounts = []
+    for entry in static_dirs:
+        directory, _, prefix = entry.partition(":")
+        directory = directory.strip().strip("/")
+        prefix = (prefix.strip() if prefix else directory).strip("/")
+        mounts.append((directory, prefix))
+    return mounts
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(ASSET_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store_blob(source: Path, sha256: str):
+    target = _blob_path(sha256)
+    if target.exists():
+        return
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".partial")
+    shutil.copyfile(source, partial)
+    os.replace(partial, target)
+
+
+def _snapshot(source_dir: Path, name: str, version: str, static_dirs: List[str]) -> int:
+    root = source_dir.resolve()
+    manifest: Dict[str, Dict[str, object]] = {}
+    for directory, prefix in _mounts(static_dirs):
+        base = (root / directory).resolve()
+        if not base.is_relative_to(root) or not base.is_dir():
+            warning(f"Static directory {directory} not found in {name}:{version}")
+            continue
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                file_path = Path(dirpath) / filename
+                # Never follow links out of the build context
+                if file_path.is_symlink() or not file_path.is_file():
+                    continue
+                relative = file_path.relative_to(base).as_posix()
+                url_path = f"{prefix}/{relative}" if prefix else relative
+                sha256 = _hash_file(file_path)
+                _store_blob(file_path, sha256)
+                content_type = (
+                    mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                )
+                entry = {
+                    "sha256": sha256,
+                    "size": file_path.stat().st_size,
+                    "content_type": content_type,
+                }
+                manifest[url_path] = entry
+                if filename == "index.html":
+                    # Serve directory urls like /docs/ from their index
+                    manifest[url_path[: -len("index.html")]] = entry
+
+    path = _manifest_path(name, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + ".partial")
+    partial.write_text(json.dumps({"name": name, "version": version, "files": manifest}))
+    os.replace(partial, path)
+    return len(manifest)
+
+
+async def snapshot_static_dirs(source_dir: Path, project_config: ProjectConfig):
+    """Copy an app's static directories into the asset store and write its manifest."""
+    name, version = project_config.name, project_config.version
+    if not project_config.static_dirs:
+        # A previous build of this version may have had assets
+        _manifest_path(name, version).unlink(missing_ok=True)
+    else:
+        count = await asyncio.to_thread(
+            _snapshot, source_dir, name, version, project_config.static_dirs
+        )
+        log(f"Snapshotted {count} static assets for {name}:{version}")
+    invalidate_manifest(project_config)
+
+
+def invalidate_manifest(project: ProjectConfig):
+    _manifests.pop(f"{project.name}:{project.version}", None)
+
+
+def _load_manifest(name: str, version: str) -> Optional[Dict[str, Asset]]:
+    try:
+        raw = json.loads(_manifest_path(name, version).read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        warning(f"Failed to read asset manifest for {name}:{version}: {e}")
+        return None
+    return {url_path: Asset(**entry) for url_path, entry in raw["files"].items()}
+
+
+async def find_asset(project: ProjectConfig, path: str) -> Optional[Asset]:
+    if not project.static_dirs:
+        return None
+    key = f"{project.name}:{project.version}"
+    if key not in _manifests:
+        _manifests[key] = await asyncio.to_thread(
+            _load_manifest, project.name, project.version
+        )
+    manifest = _manifests[key]
+    if manifest is None:
+        return None
+    return manifest.get(path)
+
+
+def asset_headers(asset: Asset, path: str) -> Dict[str, str]:
+    fingerprinted = FINGERPRINT_REGEX.search(path) is not None
+    return {
+        "Content-Type": asset.content_type,
+        "Content-Length": str(asset.size),
+        "ETag": asset.etag,
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL if fingerprinted else DEFAULT_CACHE_CONTROL
+        ),
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+async def read_asset(asset: Asset) -> AsyncGenerator[bytes, None]:
+    global _served, _served_bytes
+    _served += 1
+    async with aiofiles.open(asset.path, "rb") as f:
+        while chunk := await f.read(ASSET_CHUNK_SIZE):
+            _served_bytes += len(chunk)
+            yield chunk
+
+
+def _prune(live_versions: Set[Tuple[str, str]]) -> int:
+    referenced: Set[str] = set()
+    reclaimed = 0
+    cutoff = time.time() - PRUNE_MIN_AGE_SECONDS
+    if MANIFESTS_DIR.exists():
+        for manifest_path in MANIFESTS_DIR.glob("*.json"):
+            try:
+                manifest = json.loads(manifest_path.read_text())
+                version = (manifest["name"], manifest["version"])
+                files = manifest["files"].values()
+            except (OSError, ValueError, KeyError):
+                # We can't tell which blobs this one needs, so leave them all be
+                warning(f"Unreadable asset manifest {manifest_path}, not pruning blobs")
+                return reclaimed
+            stat = manifest_path.stat()
+            if version not in live_versions and stat.st_mtime <= cutoff:
+                reclaimed += stat.st_size
+                manifest_path.unlink(missing_ok=True)
+                continue
+            referenced.update(entry["sha256"] for entry in files)
+
+    if BLOBS_DIR.exists():
+        for blob in BLOBS_DIR.glob("*/*"):
+            stat = blob.stat()
+            if blob.name not in referenced and stat.st_mtime <= cutoff:
+                reclaimed += stat.st_size
+                blob.unlink(missing_ok=True)
+    return reclaimed
+
+
+async def prune_orphaned_assets(projects: List[ProjectConfig]) -> int:
+    """Remove manifests of versions that no longer exist and blobs no manifest refers to."""
+    live_versions = {(p.name, p.version) for p in projects}
+    for key in [k for k in _manifests if tuple(k.split(":", 1)) not in live_versions]:
+        del _manifests[key]
+    return await asyncio.to_thread(_prune, live_versions)
+
+
+def asset_stats() -> Dict[str, int]:
+    return {"served": _served, "served_bytes": _served_bytes}
@@ -0,0 +1,210 @@
+# Adjust the number of replicas of each app based on the load the proxy sees
+# Scales out with create_container_for_app, scales in by draining a replica before removing it
+
+import asyncio
+from dataclasses import dataclass
+from math import ceil
+from time import monotonic
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from .admission import find_admission
+from .hosts import place_replicas
+from .models.project_config import ProjectConfig
+from .models.service_entry import ServiceEntry
+from .models.service_number import get_service_number
+from .proxy import (
+    begin_drain,
+    close_upstream_tunnels,
+    end_drain,
+    invalidate_routes,
+    upstream_in_flight,
+    upstream_tunnels,
+)
+from .runner import create_container_for_app, remove_service_entry
+from .utils import AsyncSessionLocal, log, warning
+
+DEFAULT_TARGET_IN_FLIGHT_PER_REPLICA = 10
+
+# Only scale in when the remaining replicas would be at most this utilized
+SCALE_IN_UTILIZATION = 0.6
+SCALE_OUT_COOLDOWN_SECONDS = 30
+SCALE_IN_COOLDOWN_SECONDS = 180
+DRAIN_TIMEOUT_SECONDS = 60
+# How long clients get to reconnect elsewhere once their tunnels to a draining replica are closed
+TUNNEL_CLOSE_GRACE_SECONDS = 5
+
+# Weight of the newest load sample in the moving average
+LOAD_EWMA_ALPHA = 0.3
+
+
+@dataclass
+class _AppScalingState:
+    load_ewma: float = 0.0
+    last_scale_out: float = 0.0
+    last_scale_in: float = 0.0
+
+
+_states: Dict[int, _AppScalingState] = {}
+
+# Apps with a scaling operation in progress, so ticks don't stack up on slow docker calls
+_busy: set[int] = set()
+
+
+def desired_replicas(
+    app: ProjectConfig,
+    current: int,
+    load: float,
+    latency: Optional[float],
+) -> int:
+    """
+    Work out how many replicas an app should have given its smoothed load (in flight + queued requests)
+    and upstream latency. Scaling in requires the load to be well below the target so we don't flap.
+    """
+    min_replicas = max(1, app.min_replicas)
+    max_replicas = max(min_replicas, app.max_replicas)
+    target = app.target_in_flight_per_replica or DEFAULT_TARGET_IN_FLIGHT_PER_REPLICA
+
+    desired = current
+    wanted = ceil(load / target) if load > 0 else min_replicas
+    if wanted > current:
+        desired = wanted
+    elif app.target_latency is not None and latency is not None:
+        if latency > app.target_latency:
+            desired = current + 1
+
+    if desired == current and current > min_replicas:
+        latency_ok = (
+            app.target_latency is None
+            or latency is None
+            or latency < app.target_latency / 2
+        )
+        if latency_ok and load <= target * (current - 1) * SCALE_IN_UTILIZATION:
+            desired = current - 1
+
+    return min(max_replicas, max(min_replicas, desired))
+
+
+async def _wait_until_idle(entry: ServiceEntry, timeout: float) -> bool:
+    deadline = monotonic() + timeout
+    while upstream_in_flight(entry) + upstream_tunnels(entry) > 0:
+        if monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.5)
+    return True
+
+
+async def drain_and_remove(entry: ServiceEntry):
+    """
+    Stop routing to a replica, give its requests and tunnels time to finish and remove it.
+    Tunnels still open after that are closed asking their clients to reconnect to another replica.
+    """
+    begin_drain(entry)
+    invalidate_routes()
+    try:
+        if not await _wait_until_idle(entry, DRAIN_TIMEOUT_SECONDS):
+            closed = close_upstream_tunnels(entry)
+            if closed:
+                log(f"Closed {closed} tunnels to draining replica {entry.hostname}.")
+            await _wait_until_idle(entry, TUNNEL_CLOSE_GRACE_SECONDS)
+        if upstream_in_flight(entry) > 0:
+            warning(
+                f"Replica {entry.hostname} still has {upstream_in_flight(entry)} requests in flight after draining, removing anyway."
+            )
+        await remove_service_entry(entry)
+    finally:
+        end_drain(entry)
+
+
+async def _scale_app(app: ProjectConfig, entries: List[ServiceEntry]):
+    state = _states.setdefault(app.id, _AppScalingState())
+    admission = find_admission(app)
+    sample = admission.in_flight + admission.queued if admission else 0
+    latency = admission.latency_ewma if admission else None
+    state.load_ewma += LOAD_EWMA_ALPHA * (sample - state.load_ewma)
+
+    current = len(entries)
+    desired = desired_replicas(app, current, state.load_ewma, latency)
+    now = monotonic()
+
+    if desired > current:
+        if now - state.last_scale_out < SCALE_OUT_COOLDOWN_SECONDS:
+            return
+        state.last_scale_out = now
+        log(
+            f"Scaling {app.name}:{app.version} out from {current} to {desired} replicas (load {state.load_ewma:.1f})."
+        )
+        service_number = await get_service_number()
+        placements = await place_replicas(
+            [entry.docker_host for entry in entries], desired - current
+        )
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(
+                    create_container_for_app(app, service_number, docker_host)
+                )
+                for docker_host in placements
+            ]
+        async with AsyncSessionLocal() as session:
+            for task in tasks:
+                session.add(task.result())
+            await session.commit()
+        invalidate_routes()
+
+    elif desired < current:
+        since_last_scale = now - max(state.last_scale_in, state.last_scale_out)
+        if since_last_scale < SCALE_IN_COOLDOWN_SECONDS:
+            return
+        state.last_scale_in = now
+        log(
+            f"Scaling {app.name}:{app.version} in from {current} to {desired} replicas (load {state.load_ewma:.1f})."
+        )
+        # Remove the replicas with the fewest open tunnels first, then the newest
+        victims = sorted(entries, key=lambda e: (-upstream_tunnels(e), e.id))[desired:]
+        async with asyncio.TaskGroup() as tg:
+            for entry in victims:
+                tg.create_task(drain_and_remove(entry))
+
+
+async def _scale_app_once(app: ProjectConfig, entries: List[ServiceEntry]):
+    if app.id in _busy:
+        return
+    _busy.add(app.id)
+    try:
+        await _scale_app(app, entries)
+    except Exception as e:
+        warning(f"Autoscaling {app.name}:{app.version} failed: {e}")
+    finally:
+        _busy.discard(app.id)
+
+
+async def autoscale_applications():
+    """
+    Adjust the replica count of every app that allows more than one replica.
+    """
+    async with AsyncSessionLocal() as session:
+        apps = (
+            (
+                await session.execute(
+                    select(ProjectConfig).where(
+                        ProjectConfig.max_replicas > ProjectConfig.min_replicas
+                    )
+                )
+            )
+            .scalars()
+            .all()
+        )
+        entries = (await session.execute(select(ServiceEntry))).scalars().all()
+
+    entries_by_app: Dict[int, List[ServiceEntry]] = {}
+    for entry in entries:
+        entries_by_app.setdefault(entry.project_config_id, []).append(entry)
+
+    async with asyncio.TaskGroup() as tg:
+        for app in apps:
+            app_entries = entries_by_app.get(app.id, [])
+            if not app_entries:
+                # Nothing running yet, reconciliation will create the minimum
+                continue
+            tg.create_task(_scale_app_once(app, app_entries))
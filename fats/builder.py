@@ -6,16 +6,20 @@
 #   -f /path/to/railpack-plan.json \
 #   /path/to/app/to/build
 
+import asyncio
+import hashlib
 from pathlib import Path
 import tempfile
-from typing import List
+from typing import Dict, List
 from aiofiles import os
 import aiofiles
 import httpx
 import tarfile
 
+from .assets import parse_static_dirs, snapshot_static_dirs
+from .cleanup import BUILD_DIR_PREFIX, IMAGE_LABEL, temporary_path
 from .models.project_config import ProjectConfig
-from .utils import log, run
+from .utils import log, run, warning
 from sys import platform
 import re
 import logging
@@ -33,6 +37,31 @@ DOCKER_NAME_REGEX = re.compile(
 
 GLOBAL_TEMP_DIR = Path(tempfile.mkdtemp(prefix="fats_"))
 
+RAILPACK_VERSION = "v0.15.1"
+# sha256 of railpack-{RAILPACK_VERSION}-{arch}-unknown-linux-musl.tar.gz by arch, to be updated along
+# with RAILPACK_VERSION. FATS_RAILPACK_SHA256 overrides it. Downloads for architectures without a
+# digest are not verified.
+RAILPACK_SHA256: Dict[str, str] = {}
+RAILPACK_COPY_CHUNK_SIZE = 1024 * 1024
+_railpack_lock = asyncio.Lock()
+
+# Numeric options.ini keys that map directly onto ProjectConfig attributes
+INT_OPTIONS = (
+    "max_in_flight",
+    "queue_size",
+    "min_replicas",
+    "max_replicas",
+    "target_in_flight_per_replica",
+)
+FLOAT_OPTIONS = (
+    "max_requests_per_second",
+    "connect_timeout",
+    "first_byte_timeout",
+    "read_timeout",
+    "target_latency",
+)
+BOOL_OPTIONS = ("edge_compression", "coalesce_requests")
+
 
 def validate_docker(name: str, version: str) -> None:
     if not DOCKER_NAME_REGEX.fullmatch(name) or len(name) > 255:
@@ -41,10 +70,29 @@ def validate_docker(name: str, version: str) -> None:
         raise ValueError(f"Invalid docker version: {version}")
 
 
+def _extract_railpack(tarball_path: Path, target_path: Path):
+    # stream the binary out of the tarball, then move it into place atomically
+    partial_path = target_path.with_name(target_path.name + ".partial")
+    with tarfile.open(tarball_path, "r:gz") as tar:
+        railpack_bin = tar.extractfile("railpack")
+        if not railpack_bin:
+            raise FileNotFoundError("railpack binary not found in the tarball.")
+        with open(partial_path, "wb") as f:
+            shutil.copyfileobj(railpack_bin, f, RAILPACK_COPY_CHUNK_SIZE)
+    partial_path.chmod(0o755)
+    sync_os.replace(partial_path, target_path)
+
+
 async def retrieve_railpack_bin() -> Path:
     """
     Retrieve the path to the railpack binary. If not found, download it.
     """
+    # a prefetch at startup and the first build may ask at the same time
+    async with _railpack_lock:
+        return await _retrieve_railpack_bin()
+
+
+async def _retrieve_railpack_bin() -> Path:
     target_path = Path("/usr/local/bin/railpack")
     # check if unix, if not kill
     if platform != "linux":
@@ -67,25 +115,36 @@ async def retrieve_railpack_bin() -> Path:
     else:
         raise EnvironmentError(f"Unsupported architecture: {machine}")
 
-    version_tag = "v0.15.1"
+    expected_digest = (
+        sync_os.getenv("FATS_RAILPACK_SHA256") or RAILPACK_SHA256.get(arch, "")
+    ).strip().lower()
+    if not expected_digest:
+        logger.warning(
+            f"No sha256 is known for railpack {RAILPACK_VERSION} on {arch}, set FATS_RAILPACK_SHA256 to verify the download"
+        )
+
+    version_tag = RAILPACK_VERSION
     url = f"https://github.com/railwayapp/railpack/releases/download/{version_tag}/railpack-{version_tag}-{arch}-unknown-linux-musl.tar.gz"
-    async with httpx.AsyncClient().stream(
-        "GET", url, timeout=30, follow_redirects=True
-    ) as response:
-        response.raise_for_status()
-        tarball_path = GLOBAL_TEMP_DIR / "railpack.tar.gz"
-        async with aiofiles.open(tarball_path, "wb") as out_file:
-            async for chunk in response.aiter_bytes():
-                await out_file.write(chunk)
-
-    # extract tarball
-    with tarfile.open(tarball_path, "r:gz") as tar:
-        railpack_bin = tar.extractfile("railpack")
-        if not railpack_bin:
-            raise FileNotFoundError("railpack binary not found in the tarball.")
-        with open(target_path, "wb") as f:
-            f.write(railpack_bin.read())
-    target_path.chmod(0o755)
+    tarball_path = GLOBAL_TEMP_DIR / "railpack.tar.gz"
+    digest = hashlib.sha256()
+    async with httpx.AsyncClient() as client:
+        async with client.stream(
+            "GET", url, timeout=30, follow_redirects=True
+        ) as response:
+            response.raise_for_status()
+            async with aiofiles.open(tarball_path, "wb") as out_file:
+                async for chunk in response.aiter_bytes():
+                    digest.update(chunk)
+                    await out_file.write(chunk)
+
+    try:
+        if expected_digest and digest.hexdigest() != expected_digest:
+            raise ValueError(
+                f"Railpack checksum mismatch: expected {expected_digest}, got {digest.hexdigest()}"
+            )
+        await asyncio.to_thread(_extract_railpack, tarball_path, target_path)
+    finally:
+        tarball_path.unlink(missing_ok=True)
     return target_path
 
 
@@ -108,6 +167,17 @@ def parse_options_or_else(dir: Path) -> ProjectConfig:
                 if s.strip()
             ]
             options.desired_secrets = secrets_list
+        if "static_dirs" in config["fats"]:
+            options.static_dirs = parse_static_dirs(config["fats"]["static_dirs"])
+        for key in INT_OPTIONS:
+            if key in config["fats"]:
+                setattr(options, key, config["fats"].getint(key))
+        for key in FLOAT_OPTIONS:
+            if key in config["fats"]:
+                setattr(options, key, config["fats"].getfloat(key))
+        for key in BOOL_OPTIONS:
+            if key in config["fats"]:
+                setattr(options, key, config["fats"].getboolean(key))
         # if "fats.service_requests" in config:
         #     # get all service requests
         #     service_requests = ServiceRequests()
@@ -136,8 +206,13 @@ def _determine_correct_buildx_command() -> List[str]:
 
 
 async def build_railpack_from_tarball(tar_path: Path) -> ProjectConfig:
-    temp_dir = Path(tempfile.mkdtemp())
+    build_root = Path(tempfile.mkdtemp(prefix=BUILD_DIR_PREFIX))
+    # the build directory is removed as soon as the build is done
+    async with temporary_path(build_root):
+        return await _build_in_directory(tar_path, build_root)
 
+
+async def _build_in_directory(tar_path: Path, temp_dir: Path) -> ProjectConfig:
     # extract tarball to temp dir
     log(f"Extracting tarball {tar_path} to {temp_dir}")
     with tarfile.open(tar_path, "r:gz") as tar:
@@ -177,6 +252,9 @@ async def build_railpack_from_tarball(tar_path: Path) -> ProjectConfig:
         "BUILDKIT_SYNTAX=ghcr.io/railwayapp/railpack-frontend",
         "--tag",
         tag,
+        # Lets garbage collection tell the images fats built from everything else on the engine
+        "--label",
+        IMAGE_LABEL,
         "--progress=plain",
         "-f",
         str(temp_dir / "railpack-plan.json"),
@@ -187,4 +265,11 @@ async def build_railpack_from_tarball(tar_path: Path) -> ProjectConfig:
     assert docker_proc.returncode == 0, "Docker buildx command failed"
     log("Docker buildx command executed.")
 
+    try:
+        await snapshot_static_dirs(temp_dir, project_config)
+    except OSError as e:
+        # The app can still serve its own static files
+        warning(f"Failed to snapshot static assets for {tag}: {e}")
+        project_config.static_dirs = []
+
     return project_config
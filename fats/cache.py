@@ -0,0 +1,324 @@
+# Shared HTTP response cache for the proxy
+# Responses are cached per app version according to their Cache-Control headers, in a memory tier
+# with LRU eviction by size and an optional disk tier under the fats data directory
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from .models.project_config import ProjectConfig
+from .utils import warning
+from .utils.sqlite import FATS_DATA_DIR
+
+CACHE_MEMORY_BYTES = int(os.getenv("FATS_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+CACHE_DISK_BYTES = int(os.getenv("FATS_CACHE_DISK_MB", "0")) * 1024 * 1024
+CACHE_DIR = FATS_DATA_DIR / "cache"
+
+# Larger responses are streamed through without being cached
+MAX_ENTRY_BYTES = 8 * 1024 * 1024
+
+CACHEABLE_STATUSES = {200, 203, 300, 301, 308, 404, 410}
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    if not value:
+        return directives
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    if value is None or not value.strip().isdigit():
+        return None
+    return int(value)
+
+
+def _lower_keys(headers: Mapping[str, str]) -> Dict[str, str]:
+    return {key.lower(): value for key, value in headers.items()}
+
+
+def normalize_accept_encoding(value: str) -> str:
+    """The codings an Accept-Encoding header accepts, sorted, so equivalent headers compare equal."""
+    codings = set()
+    for part in value.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            codings.add(coding)
+    return ",".join(sorted(codings))
+
+
+def _vary_value(name: str, value: str) -> str:
+    return normalize_accept_encoding(value) if name == "accept-encoding" else value
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+    stored_at: float
+    lifetime: float
+    """Seconds after stored_at that the response is fresh for, 0 means it must be revalidated"""
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+
+    def header(self, name: str) -> Optional[str]:
+        name = name.lower()
+        return next((v for k, v in self.headers if k.lower() == name), None)
+
+    def age(self) -> int:
+        return max(0, int(time.time() - self.stored_at))
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.stored_at + self.lifetime
+
+    @property
+    def has_validators(self) -> bool:
+        return self.header("etag") is not None or self.header("last-modified") is not None
+
+    def refreshed(
+        self, headers: Mapping[str, str], lifetime: float
+    ) -> "CachedResponse":
+        """A copy of this entry updated from a 304 Not Modified response."""
+        updates = _lower_keys(headers)
+        merged = [(k, updates.pop(k.lower(), v)) for k, v in self.headers]
+        for key in ("cache-control", "expires", "etag", "last-modified", "date"):
+            if key in updates:
+                merged.append((key, updates[key]))
+        return CachedResponse(
+            status=self.status,
+            headers=merged,
+            body=self.body,
+            stored_at=time.time(),
+            lifetime=lifetime,
+        )
+
+
+def freshness_lifetime(response_headers: Mapping[str, str]) -> Optional[float]:
+    """How long a response may be served from a shared cache, or None if it is not cacheable."""
+    headers = _lower_keys(response_headers)
+    cache_control = parse_cache_control(headers.get("cache-control"))
+    if "no-store" in cache_control or "private" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+    lifetime = _seconds(cache_control.get("s-maxage"))
+    if lifetime is None:
+        lifetime = _seconds(cache_control.get("max-age"))
+    return lifetime
+
+
+def is_storable(
+    method: str,
+    status: int,
+    request_headers: Mapping[str, str],
+    response_headers: Mapping[str, str],
+) -> bool:
+    if method != "GET" or status not in CACHEABLE_STATUSES:
+        return False
+    request = _lower_keys(request_headers)
+    response = _lower_keys(response_headers)
+    if "no-store" in parse_cache_control(request.get("cache-control")):
+        return False
+    if "set-cookie" in response or response.get("vary", "").strip() == "*":
+        return False
+    cache_control = parse_cache_control(response.get("cache-control"))
+    if "authorization" in request and not (
+        "public" in cache_control or "s-maxage" in cache_control
+    ):
+        return False
+    lifetime = freshness_lifetime(response)
+    if lifetime is None:
+        return False
+    # A response that must always be revalidated is only useful with a validator
+    return lifetime > 0 or "etag" in response or "last-modified" in response
+
+
+class ResponseCache:
+    def __init__(self, memory_bytes: int, disk_bytes: int, disk_dir: Path):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.disk_dir = disk_dir
+        self._memory: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._memory_used = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_used = 0
+        # Vary header names for each primary key, needed to build the full key of a request
+        self._vary: Dict[str, Tuple[str, ...]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+        if self.disk_bytes > 0:
+            # Entries are keyed by project config ids, which don't survive a reset, so start clean
+            shutil.rmtree(self.disk_dir, ignore_errors=True)
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def primary_key(project: ProjectConfig, method: str, path: str, query: str) -> str:
+        return f"{project.id}|{project.name}:{project.version}|{method}|/{path}?{query}"
+
+    @staticmethod
+    def _full_key(
+        primary: str, vary: Tuple[str, ...], request_headers: Mapping[str, str]
+    ) -> str:
+        headers = _lower_keys(request_headers)
+        varied = "|".join(
+            f"{name}={_vary_value(name, headers.get(name, ''))}" for name in vary
+        )
+        project_id = primary.split("|", 1)[0]
+        digest = hashlib.sha256(f"{primary}|{varied}".encode()).hexdigest()
+        return f"{project_id}/{digest}"
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key
+
+    async def lookup(
+        self,
+        project: ProjectConfig,
+        path: str,
+        query: str,
+        request_headers: Mapping[str, str],
+    ) -> Optional[CachedResponse]:
+        primary = self.primary_key(project, "GET", path, query)
+        vary = self._vary.get(primary)
+        if vary is None:
+            return None
+        key = self._full_key(primary, vary, request_headers)
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+
+        if key in self._disk:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                self._disk.move_to_end(key)
+                self._store_memory(key, entry)
+                return entry
+            self._forget_disk(key)
+
+        return None
+
+    async def store(
+        self,
+        project: ProjectConfig,
+        path: str,
+        query: str,
+        request_headers: Mapping[str, str],
+        entry: CachedResponse,
+    ):
+        if entry.size > MAX_ENTRY_BYTES:
+            return
+        primary = self.primary_key(project, "GET", path, query)
+        vary_header = entry.header("vary") or ""
+        names = {name.strip().lower() for name in vary_header.split(",") if name.strip()}
+        if entry.header("content-encoding"):
+            # The app picked the encoding from Accept-Encoding whether or not it said so with Vary
+            names.add("accept-encoding")
+        vary = tuple(sorted(names))
+        self._vary[primary] = vary
+        key = self._full_key(primary, vary, request_headers)
+        self._store_memory(key, entry)
+        if self.disk_bytes > 0 and entry.size <= self.disk_bytes:
+            try:
+                await asyncio.to_thread(self._write_disk, key, entry)
+            except OSError as e:
+                warning(f"Failed to write cache entry to disk: {e}")
+                return
+            self._forget_disk(key)
+            self._disk[key] = entry.size
+            self._disk_used += entry.size
+            while self._disk_used > self.disk_bytes and self._disk:
+                evicted, evicted_size = self._disk.popitem(last=False)
+                self._disk_used -= evicted_size
+                self._disk_path(evicted).unlink(missing_ok=True)
+
+    def _store_memory(self, key: str, entry: CachedResponse):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= previous.size
+        if entry.size > self.memory_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_used += entry.size
+        while self._memory_used > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= evicted.size
+
+    def _forget_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_used -= size
+
+    def _write_disk(self, key: str, entry: CachedResponse):
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = asdict(entry)
+        del meta["body"]
+        partial = path.with_suffix(".partial")
+        with open(partial, "wb") as f:
+            f.write(json.dumps(meta).encode() + b"\n")
+            f.write(entry.body)
+        os.replace(partial, path)
+
+    def _read_disk(self, key: str) -> Optional[CachedResponse]:
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        meta["headers"] = [tuple(h) for h in meta["headers"]]
+        return CachedResponse(body=body, **meta)
+
+    async def invalidate_project(self, project_id: int):
+        """Drop every cached response of a project config, e.g. after it was redeployed."""
+        prefix = f"{project_id}|"
+        for primary in [p for p in self._vary if p.startswith(prefix)]:
+            del self._vary[primary]
+        key_prefix = f"{project_id}/"
+        for key in [k for k in self._memory if k.startswith(key_prefix)]:
+            self._memory_used -= self._memory.pop(key).size
+        for key in [k for k in self._disk if k.startswith(key_prefix)]:
+            self._forget_disk(key)
+        if self.disk_bytes > 0:
+            await asyncio.to_thread(
+                shutil.rmtree, self.disk_dir / str(project_id), True
+            )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_used,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_used,
+        }
+
+
+response_cache = ResponseCache(CACHE_MEMORY_BYTES, CACHE_DISK_BYTES, CACHE_DIR)
@@ -0,0 +1,294 @@
+# Garbage collection for everything fats leaves on disk:
+# build workspaces, uploaded tarballs, images of superseded app versions, static assets and docker build cache
+
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Sequence
+
+from sqlalchemy import select
+
+from .assets import prune_orphaned_assets
+from .autoscaler import drain_and_remove
+from .cache import response_cache
+from .gateway import invalidate_gateway_project
+from .hosts import all_hosts, docker_args
+from .models.project_config import ProjectConfig
+from .models.service_entry import ServiceEntry
+from .utils import AsyncSessionLocal, log, run, warning
+from .utils.sqlite import FATS_DATA_DIR
+
+# Prefixes of the temporary files and directories fats creates, so leftovers can be found
+BUILD_DIR_PREFIX = "fats_build_"
+UPLOAD_PREFIX = "fats_upload_"
+
+# Temporary items older than this are assumed to be leftovers from a crashed build or upload
+STALE_TEMP_SECONDS = 60 * 60
+
+# Label on every image fats builds, images without it are never pruned
+IMAGE_LABEL = "fats.managed=true"
+
+# How many versions of each app to keep deployed, older ones are retired and their images removed.
+# 0, the default, keeps every version.
+VERSION_RETENTION = int(os.getenv("FATS_VERSION_RETENTION", "0"))
+
+# Disk budget for the fats data directory and temp space in megabytes, 0 disables it
+DISK_BUDGET_BYTES = int(os.getenv("FATS_DISK_BUDGET_MB", "0")) * 1024 * 1024
+
+# BuildKit's cache can't be labelled, so pruning it affects every build on the engine
+PRUNE_BUILD_CACHE = os.getenv("FATS_PRUNE_BUILD_CACHE", "0") == "1"
+
+_DOCKER_RECLAIMED_REGEX = re.compile(
+    r"Total reclaimed space:\s*([\d.]+)\s*([kKMGT]?B)", re.IGNORECASE
+)
+_UNITS = {"b": 1, "kb": 1000, "mb": 1000**2, "gb": 1000**3, "tb": 1000**4}
+
+# Temporary items currently in use by a build or upload, never collected
+_active_temp_items: set[Path] = set()
+
+
+def path_size(path: Path) -> int:
+    """Size in bytes of a file or everything beneath a directory, without following symlinks."""
+    try:
+        if not path.is_dir() or path.is_symlink():
+            return path.lstat().st_size
+    except FileNotFoundError:
+        return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _remove_path_sync(path: Path) -> int:
+    size = path_size(path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+    return size
+
+
+async def remove_path(path: Path) -> int:
+    """Remove a file or directory tree off the event loop, returning the bytes reclaimed."""
+    return await asyncio.to_thread(_remove_path_sync, path)
+
+
+def protect_temp_path(path: Path):
+    """Keep a temporary file or directory from being collected until it is released."""
+    _active_temp_items.add(path)
+
+
+def release_temp_path(path: Path):
+    _active_temp_items.discard(path)
+
+
+@asynccontextmanager
+async def temporary_path(path: Path) -> AsyncIterator[Path]:
+    """Protect a temporary file or directory from collection while in use, and remove it afterwards."""
+    protect_temp_path(path)
+    try:
+        yield path
+    finally:
+        release_temp_path(path)
+        await remove_path(path)
+
+
+def _temp_items(include_active: bool = False) -> List[Path]:
+    temp_root = Path(tempfile.gettempdir())
+    return [
+        p
+        for p in temp_root.iterdir()
+        if p.name.startswith((BUILD_DIR_PREFIX, UPLOAD_PREFIX))
+        and (include_active or p not in _active_temp_items)
+    ]
+
+
+async def remove_stale_temp_items(max_age: float = STALE_TEMP_SECONDS) -> int:
+    """Remove build directories and uploads left behind by builds that never finished."""
+    reclaimed = 0
+    now = time.time()
+    for item in await asyncio.to_thread(_temp_items):
+        try:
+            age = now - item.lstat().st_mtime
+        except FileNotFoundError:
+            continue
+        if age >= max_age:
+            reclaimed += await remove_path(item)
+    return reclaimed
+
+
+def _parse_docker_reclaimed(output: str) -> int:
+    match = _DOCKER_RECLAIMED_REGEX.search(output)
+    if not match:
+        return 0
+    return int(float(match.group(1)) * _UNITS.get(match.group(2).lower(), 1))
+
+
+async def _docker_prune(*args: str, filters: Sequence[str] = ()) -> int:
+    filter_args = [arg for f in filters for arg in ("--filter", f)]
+    proc = await run("docker", *args, "prune", "-f", *filter_args)
+    await proc.wait()
+    if proc.returncode != 0 or proc.stdout is None:
+        warning(f"docker {' '.join(args)} prune failed")
+        return 0
+    return _parse_docker_reclaimed((await proc.stdout.read()).decode())
+
+
+async def _image_size(tag: str) -> int:
+    proc = await run("docker", "image", "inspect", "--format", "{{.Size}}", tag)
+    await proc.wait()
+    if proc.returncode != 0 or proc.stdout is None:
+        return 0
+    output = (await proc.stdout.read()).decode().strip()
+    return int(output) if output.isdigit() else 0
+
+
+def default_version(versions: List[ProjectConfig]) -> ProjectConfig:
+    """The version requests without a version are routed to, like the proxy picks it."""
+    latest = next((p for p in versions if p.version == "latest"), None)
+    return latest or max(versions, key=lambda p: p.version)
+
+
+def versions_to_retire(
+    versions: List[ProjectConfig], retention: int
+) -> List[ProjectConfig]:
+    """
+    The versions of one app beyond the `retention` most recently deployed ones.
+    :latest and the version unversioned requests go to are always kept.
+    """
+    keep = default_version(versions)
+    candidates = sorted(
+        (p for p in versions if p.version != "latest" and p is not keep),
+        key=lambda p: (p.deployed_at or 0.0, p.id),
+        reverse=True,
+    )
+    # Unlike :latest, a default version that has a version number counts towards the retention
+    kept = retention if keep.version == "latest" else retention - 1
+    return candidates[max(kept, 0) :]
+
+
+async def _version_referenced(project: ProjectConfig) -> bool:
+    """Whether a config or service entry still uses the image of a version."""
+    async with AsyncSessionLocal() as session:
+        config = await session.scalar(
+            select(ProjectConfig.id).where(
+                ProjectConfig.name == project.name,
+                ProjectConfig.version == project.version,
+            )
+        )
+        entry = await session.scalar(
+            select(ServiceEntry.id).where(ServiceEntry.project_config_id == project.id)
+        )
+    return config is not None or entry is not None
+
+
+async def _remove_image(tag: str) -> int:
+    size = await _image_size(tag)
+    proc = await run("docker", "image", "rm", tag)
+    await proc.wait()
+    if proc.returncode != 0:
+        warning(f"Failed to remove image {tag}")
+        return 0
+    # Copies on other engines don't count towards our disk, and may never have been made
+    for host in all_hosts():
+        if not host.is_local:
+            proc = await run("docker", *docker_args(host.name), "image", "rm", tag)
+            await proc.wait()
+    return size
+
+
+async def retire_superseded_versions(retention: int = VERSION_RETENTION) -> int:
+    """
+    Keep only the `retention` most recently deployed versions of each app (plus :latest), if set.
+    Older versions have their containers, service entries and configs removed, and their images
+    once nothing refers to them any more.
+    """
+    if retention <= 0:
+        return 0
+
+    async with AsyncSessionLocal() as session:
+        projects = (await session.execute(select(ProjectConfig))).scalars().all()
+        entries = (await session.execute(select(ServiceEntry))).scalars().all()
+
+    versions_by_name: Dict[str, List[ProjectConfig]] = defaultdict(list)
+    for project in projects:
+        versions_by_name[project.name].append(project)
+
+    reclaimed = 0
+    for versions in versions_by_name.values():
+        for project in versions_to_retire(versions, retention):
+            tag = f"{project.name}:{project.version}"
+            log(f"Retiring superseded version {tag}")
+            # Superseded versions can still have open tunnels, so their replicas are drained
+            async with asyncio.TaskGroup() as tg:
+                for entry in entries:
+                    if entry.project_config_id == project.id:
+                        tg.create_task(drain_and_remove(entry))
+            await response_cache.invalidate_project(project.id)
+            invalidate_gateway_project(project.id)
+            async with AsyncSessionLocal() as session:
+                tracked = await session.get(ProjectConfig, project.id)
+                if tracked is not None:
+                    await session.delete(tracked)
+                    await session.commit()
+
+            # The version may have been uploaded again while its replicas drained
+            if await _version_referenced(project):
+                log(f"Keeping image {tag}, it is still in use")
+                continue
+            reclaimed += await _remove_image(tag)
+    return reclaimed
+
+
+async def disk_usage() -> int:
+    """Bytes used by the fats data directory and fats' temporary files."""
+
+    def _usage() -> int:
+        temp_usage = sum(path_size(p) for p in _temp_items(include_active=True))
+        return path_size(FATS_DATA_DIR) + temp_usage
+
+    return await asyncio.to_thread(_usage)
+
+
+async def collect_garbage():
+    """
+    Remove leftover temporary files, retire superseded versions, prune the dangling images fats built
+    and orphaned assets. If fats is over its disk budget afterwards, also clear all temporary leftovers
+    and, if allowed, the docker build cache.
+    """
+    reclaimed = await remove_stale_temp_items()
+    reclaimed += await retire_superseded_versions()
+    reclaimed += await _docker_prune("image", filters=[f"label={IMAGE_LABEL}"])
+
+    async with AsyncSessionLocal() as session:
+        projects = (await session.execute(select(ProjectConfig))).scalars().all()
+    reclaimed += await prune_orphaned_assets(list(projects))
+
+    if DISK_BUDGET_BYTES > 0:
+        usage = await disk_usage()
+        if usage > DISK_BUDGET_BYTES:
+            log(
+                f"Disk usage {usage} bytes is over the budget of {DISK_BUDGET_BYTES} bytes, cleaning harder."
+            )
+            reclaimed += await remove_stale_temp_items(max_age=0)
+            if PRUNE_BUILD_CACHE:
+                reclaimed += await _docker_prune("builder")
+            usage = await disk_usage()
+            if usage > DISK_BUDGET_BYTES:
+                warning(
+                    f"Disk usage {usage} bytes is still over the budget of {DISK_BUDGET_BYTES} bytes."
+                )
+
+    log(f"Garbage collection reclaimed {reclaimed} bytes.")
+    return reclaimed
@@ -0,0 +1,252 @@
+# Single-flight coalescing of identical GETs
+# Concurrent identical requests to an app share one upstream request, whose response is streamed to
+# every waiter through a bounded buffer. The producer only runs as far ahead as the slowest waiter allows.
+
+import asyncio
+from functools import partial
+from time import monotonic
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+
+from .cache import parse_cache_control
+from .models.project_config import ProjectConfig
+
+# How far the upstream response may run ahead of the slowest waiter
+COALESCE_BUFFER_BYTES = 1024 * 1024
+
+# Waiters holding back a full buffer without reading anything for this long are dropped from the flight
+SUBSCRIBER_STALL_SECONDS = 30
+
+# Request headers that commonly change the response, requests only coalesce when they match
+KEY_HEADERS = ("accept", "accept-encoding", "accept-language")
+
+FlightResult = Tuple[int, Dict[str, str], AsyncGenerator[bytes, None]]
+
+_flights: Dict[str, "Flight"] = {}
+_background_tasks: set[asyncio.Task[Any]] = set()
+_flights_started = 0
+_requests_joined = 0
+
+
+class SubscriberStalled(Exception):
+    """Raised to a waiter that was dropped from its flight for holding everyone else back."""
+
+
+def can_coalesce(method: str, request_headers: Mapping[str, str]) -> bool:
+    """Only anonymous GETs are shared, anything with credentials is sent upstream on its own."""
+    headers = {key.lower(): value for key, value in request_headers.items()}
+    if method != "GET" or "authorization" in headers or "cookie" in headers:
+        return False
+    if "if-none-match" in headers or "if-modified-since" in headers or "range" in headers:
+        return False
+    return "no-store" not in parse_cache_control(headers.get("cache-control"))
+
+
+def is_shareable(response_headers: Mapping[str, str]) -> bool:
+    """Whether a response may be handed to requests other than the one it was fetched for."""
+    headers = {key.lower(): value for key, value in response_headers.items()}
+    if "set-cookie" in headers:
+        return False
+    cache_control = parse_cache_control(headers.get("cache-control"))
+    return "private" not in cache_control and "no-store" not in cache_control
+
+
+def coalescing_key(
+    project: ProjectConfig, path: str, query: str, request_headers: Mapping[str, str]
+) -> str:
+    headers = {key.lower(): value for key, value in request_headers.items()}
+    varied = "|".join(headers.get(name, "") for name in KEY_HEADERS)
+    return f"{project.id}|/{path}?{query}|{varied}"
+
+
+class Flight:
+    """One upstream request and the subscribers sharing its response."""
+
+    def __init__(self, key: str, buffer_bytes: int = COALESCE_BUFFER_BYTES):
+        self.key = key
+        self.buffer_bytes = buffer_bytes
+        self.status: Optional[int] = None
+        self.headers: Dict[str, str] = {}
+        self.ready = asyncio.Event()
+        self._chunks: List[bytes] = []
+        # Absolute index of _chunks[0], chunks before it were read by every subscriber
+        self._base = 0
+        self._buffered = 0
+        self._positions: Dict[int, int] = {}
+        # When each subscriber last read a chunk, joined, or got a chunk to read after reading them all
+        self._progress: Dict[int, float] = {}
+        self._next_subscriber = 0
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._positions)
+
+    def subscribe(self) -> int:
+        assert self._base == 0, "Cannot join a flight that already discarded chunks"
+        subscriber = self._next_subscriber
+        self._next_subscriber += 1
+        self._positions[subscriber] = 0
+        self._progress[subscriber] = monotonic()
+        # Quart drops a response without starting its body if the client went away first, so the
+        # subscription also ends with the task that made it
+        task = asyncio.current_task()
+        if task is not None:
+            task.add_done_callback(partial(self._drop_if_abandoned, subscriber))
+        return subscriber
+
+    def _drop_if_abandoned(self, subscriber: int, _: asyncio.Task):
+        if subscriber in self._positions:
+            task = asyncio.ensure_future(self.unsubscribe(subscriber))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    async def unsubscribe(self, subscriber: int):
+        async with self._changed:
+            self._progress.pop(subscriber, None)
+            if self._positions.pop(subscriber, None) is not None:
+                self._trim()
+                self._changed.notify_all()
+
+    def _trim(self):
+        """Drop chunks every subscriber has read. Must hold the lock."""
+        oldest = min(self._positions.values(), default=self._base + len(self._chunks))
+        dropped = oldest - self._base
+        if dropped <= 0:
+            return
+        self._buffered -= sum(len(chunk) for chunk in self._chunks[:dropped])
+        del self._chunks[:dropped]
+        self._base = oldest
+        # Late arrivals could no longer see the whole response
+        _close_flight(self)
+
+    async def _wait_for_room(self):
+        """
+        Wait for the slowest subscribers to catch up with a full buffer, dropping those that read
+        nothing for SUBSCRIBER_STALL_SECONDS. Must hold the lock.
+        """
+        while self._positions and self._buffered > self.buffer_bytes:
+            oldest = min(self._positions.values())
+            holding_back = [s for s, p in self._positions.items() if p == oldest]
+            stalled_until = (
+                min(self._progress[s] for s in holding_back) + SUBSCRIBER_STALL_SECONDS
+            )
+            remaining = stalled_until - monotonic()
+            if remaining > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for subscriber in holding_back:
+                if self._progress[subscriber] + SUBSCRIBER_STALL_SECONDS <= monotonic():
+                    del self._positions[subscriber]
+                    del self._progress[subscriber]
+            self._trim()
+            self._changed.notify_all()
+
+    def start(self, fetch: Callable[[], Awaitable[FlightResult]]):
+        task = asyncio.create_task(self._produce(fetch))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    async def _produce(self, fetch: Callable[[], Awaitable[FlightResult]]):
+        try:
+            self.status, self.headers, body = await fetch()
+            self.ready.set()
+            try:
+                async for chunk in body:
+                    async with self._changed:
+                        # Subscribers waiting for this chunk only start stalling once it is there
+                        end = self._base + len(self._chunks)
+                        now = monotonic()
+                        for subscriber, position in self._positions.items():
+                            if position == end:
+                                self._progress[subscriber] = now
+                        self._chunks.append(chunk)
+                        self._buffered += len(chunk)
+                        self._changed.notify_all()
+                        # Backpressure, wait for the slowest subscriber to catch up
+                        await self._wait_for_room()
+                        if not self._positions:
+                            break
+            finally:
+                await body.aclose()
+        except Exception as e:
+            self._error = e
+        finally:
+            _close_flight(self)
+            async with self._changed:
+                self._done = True
+                self._changed.notify_all()
+            self.ready.set()
+
+    async def stream(self, subscriber: int) -> AsyncGenerator[bytes, None]:
+        """The response body as seen by one subscriber."""
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: subscriber not in self._positions
+                        or self._positions[subscriber] - self._base
+                        < len(self._chunks)
+                        or self._done
+                    )
+                    if subscriber not in self._positions:
+                        raise SubscriberStalled(
+                            "Dropped from a coalesced request for not reading its response"
+                        )
+                    index = self._positions[subscriber] - self._base
+                    if index >= len(self._chunks):
+                        if self._error is not None:
+                            raise self._error
+                        return
+                    chunk = self._chunks[index]
+                    self._positions[subscriber] += 1
+                    self._progress[subscriber] = monotonic()
+                    self._trim()
+                    self._changed.notify_all()
+                yield chunk
+        finally:
+            await self.unsubscribe(subscriber)
+
+    def raise_for_error(self):
+        if self.status is None:
+            raise self._error or RuntimeError("Coalesced request produced no response")
+
+
+def _close_flight(flight: Flight):
+    if _flights.get(flight.key) is flight:
+        del _flights[flight.key]
+
+
+def join_flight(key: str) -> Tuple[Flight, int, bool]:
+    """Join the in-flight request for a key, or start a new one. Returns (flight, subscriber, is_leader)."""
+    global _flights_started, _requests_joined
+    flight = _flights.get(key)
+    if flight is not None:
+        _requests_joined += 1
+        return flight, flight.subscribe(), False
+    flight = Flight(key)
+    _flights[key] = flight
+    _flights_started += 1
+    return flight, flight.subscribe(), True
+
+
+def coalescing_stats() -> Dict[str, int]:
+    return {
+        "in_flight": len(_flights),
+        "flights_started": _flights_started,
+        "requests_joined": _requests_joined,
+    }
@@ -0,0 +1,153 @@
+# Proxy-side compression for upstream responses that were sent uncompressed, with zstd or gzip
+
+import asyncio
+import os
+import zlib
+from typing import AsyncGenerator, AsyncIterator, Dict, Iterable, Optional, Protocol
+
+import zstandard
+
+EDGE_COMPRESSION_ENABLED = os.getenv("FATS_EDGE_COMPRESSION", "1") != "0"
+
+# Responses known to be smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = 1024
+
+# Chunks at least this large are compressed in a worker thread instead of on the event loop
+OFFLOAD_MIN_CHUNK_SIZE = 64 * 1024
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/xml",
+    "application/xhtml+xml",
+    "image/svg+xml",
+}
+
+
+class _Compressor(Protocol):
+    def compress(self, data: bytes) -> bytes: ...
+
+    def flush(self) -> bytes: ...
+
+
+def supported_encodings() -> list[str]:
+    """Encodings we can produce, in order of preference."""
+    return ["zstd", "gzip"]
+
+
+def negotiate_encoding(
+    accept_encoding: str, available: Optional[Iterable[str]] = None
+) -> Optional[str]:
+    """
+    Pick the best encoding from an Accept-Encoding header, if any. Only the `available` ones are
+    considered, in order of preference, by default every encoding we support.
+    """
+    qualities: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    best: Optional[str] = None
+    best_quality = 0.0
+    for coding in supported_encodings() if available is None else available:
+        quality = qualities.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def is_compressible_type(content_type: str) -> bool:
+    mime = content_type.split(";", 1)[0].strip().lower()
+    if mime == "text/event-stream":
+        # Compressing would buffer events and delay them
+        return False
+    return (
+        mime.startswith("text/")
+        or mime in COMPRESSIBLE_TYPES
+        or mime.endswith(("+json", "+xml"))
+    )
+
+
+def should_compress(method: str, status: int, headers: Dict[str, str]) -> bool:
+    """Whether an upstream response is eligible for edge compression, judging by its headers."""
+    if not EDGE_COMPRESSION_ENABLED or method == "HEAD":
+        return False
+    if status < 200 or status in (204, 206, 304):
+        return False
+    lowered = {key.lower(): value for key, value in headers.items()}
+    if lowered.get("content-encoding", "identity").lower() != "identity":
+        return False
+    if "no-transform" in lowered.get("cache-control", "").lower():
+        return False
+    if not is_compressible_type(lowered.get("content-type", "")):
+        return False
+    content_length = lowered.get("content-length")
+    if content_length is not None and content_length.isdigit():
+        return int(content_length) >= COMPRESSION_MIN_SIZE
+    return True
+
+
+def compressed_headers(headers: Dict[str, str], encoding: str) -> Dict[str, str]:
+    """Adjust response headers for a body we are about to compress."""
+    result: Dict[str, str] = {}
+    vary = None
+    for key, value in headers.items():
+        lowered = key.lower()
+        if lowered in ("content-length", "content-encoding"):
+            continue
+        if lowered == "vary":
+            vary = value
+            continue
+        if lowered == "etag" and not value.startswith("W/"):
+            # The compressed body is a different representation, so a strong ETag no longer holds
+            value = "W/" + value
+        result[key] = value
+    result["Content-Encoding"] = encoding
+    if vary is None:
+        result["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+        result["Vary"] = vary + ", Accept-Encoding"
+    else:
+        result["Vary"] = vary
+    return result
+
+
+def _make_compressor(encoding: str) -> _Compressor:
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+async def compress_stream(
+    chunks: AsyncGenerator[bytes, None], encoding: str
+) -> AsyncIterator[bytes]:
+    """Compress a stream of body chunks, moving large chunks off the event loop."""
+    compressor = _make_compressor(encoding)
+    try:
+        async for chunk in chunks:
+            if len(chunk) >= OFFLOAD_MIN_CHUNK_SIZE:
+                compressed = await asyncio.to_thread(compressor.compress, chunk)
+            else:
+                compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        tail = compressor.flush()
+        if tail:
+            yield tail
+    finally:
+        # Make sure the upstream response is released if the client goes away
+        await chunks.aclose()
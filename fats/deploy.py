@@ -0,0 +1,62 @@
+# Turn an uploaded app tarball into a deployed version
+# Shared by the single request upload and the resumable chunked uploads
+
+import time
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from .builder import build_railpack_from_tarball
+from .cache import response_cache
+from .gateway import invalidate_gateway_project
+from .models.project_config import ProjectConfig
+from .proxy import invalidate_routes
+from .scheduler import request_early_schedule_execution
+from .schedules import create_containers_schedule
+from .utils import AsyncSessionLocal, log
+
+
+async def deploy_tarball(tar_path: Path) -> ProjectConfig:
+    """Build an app from a tarball, record its config and have its containers created."""
+    # call builder to build the railpack from the tar
+    project_config = await build_railpack_from_tarball(tar_path)
+    project_config.deployed_at = time.time()
+
+    # record the existence of the ProjectConfig in persistent sqlite
+    async with AsyncSessionLocal() as session:
+        try:
+            session.add(project_config)
+            await session.commit()
+        except IntegrityError:
+            # Already exists, lets overwrite
+            log(
+                f"ProjectConfig {project_config.name}:{project_config.version} already exists, overwriting..."
+            )
+            await session.rollback()
+            existing = (
+                await session.execute(
+                    select(ProjectConfig).where(
+                        ProjectConfig.name == project_config.name,
+                        ProjectConfig.version == project_config.version,
+                    )
+                )
+            ).scalar_one_or_none()
+            if existing:
+                for column in ProjectConfig.__table__.columns:
+                    if column.key != "id":
+                        setattr(
+                            existing, column.key, getattr(project_config, column.key)
+                        )
+                await session.commit()
+                project_config = existing
+
+    # Responses cached for the previous build of this version are stale now
+    await response_cache.invalidate_project(project_config.id)
+    invalidate_gateway_project(project_config.id)
+    invalidate_routes()
+
+    # Let's kindly ask the scheduler to run an early execution of the container setup
+    request_early_schedule_execution(create_containers_schedule)
+
+    return project_config
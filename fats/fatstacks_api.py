@@ -0,0 +1,125 @@
+# fatstacks schemas and validation for apps and their CI
+#
+#   GET  /mgmt/fatstacks/schema                -> names and ETags of the published schemas
+#   GET  /mgmt/fatstacks/schema/<model>        -> JSON schema of a model, e.g. surface
+#   POST /mgmt/fatstacks/validate/<model>      [document, ...] -> per document errors
+#
+# Schemas are generated and compressed once at startup, requests are served from memory.
+
+import asyncio
+import gzip
+from typing import Any, Dict, List, NamedTuple
+
+from pydantic import ValidationError
+from pydantic_core import from_json
+from quart import Blueprint, Response, request
+
+from fatstacks.registry import SCHEMA_MODELS, build_schemas
+from fatstacks.validation import adapter
+
+from .assets import etag_matches
+from .compression import negotiate_encoding
+
+fatstacks_blueprint = Blueprint("fatstacks", __name__)
+
+SCHEMA_CACHE_CONTROL = "public, max-age=300"
+
+
+class EncodedSchema(NamedTuple):
+    body: bytes
+    etag: str
+
+
+# Every representation of every schema, by model name and then by content encoding
+_schemas: Dict[str, Dict[str, EncodedSchema]] = {}
+
+
+def _encode_schemas() -> Dict[str, Dict[str, EncodedSchema]]:
+    encoded: Dict[str, Dict[str, EncodedSchema]] = {}
+    for name, document in build_schemas().items():
+        encoded[name] = {
+            "identity": EncodedSchema(document.body, f'"{document.digest}"'),
+            # Strong ETags have to differ between representations
+            "gzip": EncodedSchema(
+                gzip.compress(document.body, compresslevel=9, mtime=0),
+                f'"{document.digest}-gzip"',
+            ),
+        }
+    return encoded
+
+
+async def build_fatstacks_schemas() -> int:
+    """Generate and compress every schema, at startup rather than on the first request."""
+    if not _schemas:
+        _schemas.update(await asyncio.to_thread(_encode_schemas))
+    return len(_schemas)
+
+
+@fatstacks_blueprint.get("/schema")
+async def list_schemas():
+    await build_fatstacks_schemas()
+    return {name: encodings["identity"].etag for name, encodings in _schemas.items()}
+
+
+@fatstacks_blueprint.get("/schema/<model>")
+async def get_schema(model: str):
+    await build_fatstacks_schemas()
+    encodings = _schemas.get(model.lower())
+    if encodings is None:
+        return f"Unknown schema {model}", 404
+
+    # Only the encodings made at startup, a client preferring another one still gets those
+    encoding = negotiate_encoding(
+        request.headers.get("Accept-Encoding", ""),
+        [e for e in encodings if e != "identity"],
+    )
+    schema = encodings[encoding or "identity"]
+    headers = {
+        "Content-Type": "application/schema+json",
+        "ETag": schema.etag,
+        "Cache-Control": SCHEMA_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+
+    if etag_matches(request.headers.get("If-None-Match"), schema.etag):
+        return Response(b"", status=304, headers=headers)
+    return Response(schema.body, headers=headers)
+
+
+def _validate_batch(model: str, body: bytes) -> Dict[str, Any]:
+    documents = from_json(body)
+    if not isinstance(documents, list):
+        raise ValueError("Expected a JSON array of documents")
+    schema = adapter(SCHEMA_MODELS[model])
+    results: List[Dict[str, Any]] = []
+    for index, document in enumerate(documents):
+        try:
+            schema.validate_python(document)
+        except ValidationError as e:
+            results.append(
+                {
+                    "index": index,
+                    "errors": e.errors(include_url=False, include_input=False),
+                }
+            )
+    return {
+        "documents": len(documents),
+        "valid": len(documents) - len(results),
+        "invalid": results,
+    }
+
+
+@fatstacks_blueprint.post("/validate/<model>")
+async def validate_documents(model: str):
+    model = model.lower()
+    if model not in SCHEMA_MODELS:
+        return f"Unknown schema {model}", 404
+    body = await request.get_data(as_text=False)
+    try:
+        # Validation is CPU bound, keep it off the event loop the proxy runs on
+        result = await asyncio.to_thread(_validate_batch, model, body)
+    except ValueError as e:
+        return f"Invalid batch: {e}", 400
+    return result, 200 if not result["invalid"] else 422
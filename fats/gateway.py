@@ -0,0 +1,495 @@
+# fatstacks gateway, for apps that are fatstacks providers
+#
+#   GET  /fatstacks/<app>                                              -> the app's App, with rootUrl filled in
+#   GET  /fatstacks/<app>/surfaces/<surface_id>[?since=<revision>]     -> a validated Surface, or a delta
+#   POST /fatstacks/<app>/surfaces/<surface_id>/actions/<action_id>   {"data": {...}, "formData": {...}}
+#
+# Documents are fetched from the app, validated once and kept serialized per app version. They are
+# revalidated with the app using its own ETags, and only validated again when their content changed.
+# Actions run their behaviors in one round trip. Request behaviors are sent to the app from here,
+# navigate and toast behaviors are resolved and returned for the client to perform, in order.
+
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from pydantic import ValidationError
+from quart import Blueprint, Response, request
+
+from fatstacks.actions import behaviors, navigation_uri, request_payload
+from fatstacks.delta import SurfaceHistory
+from fatstacks.schema.action import (
+    Action,
+    NavigateActionBehavior,
+    RequestActionBehavior,
+    ToastActionBehavior,
+)
+from fatstacks.schema.app import App
+from fatstacks.schema.surface import Surface
+from fatstacks.validation import dump_json, validate
+from fatstacks.wire import (
+    JSON_MEDIA_TYPE,
+    MSGPACK_ALIASES,
+    MSGPACK_MEDIA_TYPE,
+    decode,
+    encode,
+    negotiate_media_type,
+    supported_media_types,
+)
+
+from .assets import etag_matches
+from .cache import freshness_lifetime, parse_cache_control
+from .proxy import (
+    AppResponse,
+    ProxyTarget,
+    get_target_from_app_name,
+    prepare_headers_for_proxy,
+    request_app,
+)
+from .utils import warning
+
+gateway_blueprint = Blueprint("gateway", __name__)
+
+# Memory budget for validated documents, the least recently used are dropped first
+GATEWAY_CACHE_BYTES = int(os.getenv("FATS_GATEWAY_CACHE_MB", "32")) * 1024 * 1024
+
+# Revisions of each surface kept to answer ?since= with a delta
+GATEWAY_HISTORY_LENGTH = 4
+
+# Documents larger than this are validated in a worker thread instead of on the event loop
+OFFLOAD_MIN_DOCUMENT_SIZE = 64 * 1024
+
+# Request headers that describe the client's request to us, not ours to the app
+_REPLACED_HEADERS = {
+    "content-length",
+    "content-type",
+    "accept",
+    "if-none-match",
+    "if-modified-since",
+}
+
+DocumentKey = Tuple[int, str, str, str]
+
+
+class GatewayError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@dataclass
+class GatewayDocument:
+    document: App | Surface
+    body: bytes
+    """The validated document, serialized"""
+    etag: str
+    upstream_digest: str
+    """sha256 of the app's response, to skip validating content we have seen"""
+    upstream_validators: Dict[str, str]
+    """Conditional request headers to revalidate with the app"""
+    fetched_at: float
+    lifetime: float
+    history: Optional[SurfaceHistory] = None
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+    """Other representations of the document, made when first asked for"""
+
+    def is_fresh(self) -> bool:
+        return monotonic() - self.fetched_at < self.lifetime
+
+    def encoded_as(self, media_type: str) -> bytes:
+        if media_type == JSON_MEDIA_TYPE:
+            return self.body
+        body = self.encoded.get(media_type)
+        if body is None:
+            body = self.encoded[media_type] = encode(self.document, media_type)
+        return body
+
+
+_documents: OrderedDict[DocumentKey, GatewayDocument] = OrderedDict()
+# Sizes as accounted when stored, histories keep growing afterwards
+_sizes: Dict[DocumentKey, int] = {}
+_used_bytes = 0
+_stats = {"hits": 0, "revalidated": 0, "unchanged": 0, "validated": 0}
+
+
+def _store(key: DocumentKey, entry: GatewayDocument):
+    global _used_bytes
+    _forget(key)
+    # Each revision in the history is about as large as the document
+    size = len(entry.body) * (1 + len(entry.history or ()))
+    if size > GATEWAY_CACHE_BYTES:
+        return
+    _documents[key] = entry
+    _sizes[key] = size
+    _used_bytes += size
+    while _used_bytes > GATEWAY_CACHE_BYTES:
+        _forget(next(iter(_documents)))
+
+
+def _forget(key: DocumentKey):
+    global _used_bytes
+    if _documents.pop(key, None) is not None:
+        _used_bytes -= _sizes.pop(key)
+
+
+def invalidate_gateway_project(project_id: int):
+    """Drop every document of a project config, e.g. after it was redeployed."""
+    for key in [k for k in _documents if k[0] == project_id]:
+        _forget(key)
+
+
+def gateway_stats():
+    return {**_stats, "documents": len(_documents), "bytes": _used_bytes}
+
+
+def _app_headers() -> Dict[str, str]:
+    """The client's headers, e.g. its cookies and authorization, for requests made on its behalf."""
+    headers = {
+        key: value
+        for key, value in prepare_headers_for_proxy(request.headers).items()
+        if key.lower() not in _REPLACED_HEADERS
+    }
+    headers["X-Forwarded-For"] = (
+        request.headers.get("X-Forwarded-For") or request.remote_addr or ""
+    )
+    headers["Accept"] = "application/json"
+    return headers
+
+
+def _decode_body(response: AppResponse) -> Any:
+    content_type = response.headers.get("content-type", "")
+    if "json" in content_type:
+        try:
+            return json.loads(response.body)
+        except ValueError:
+            pass
+    return response.body.decode(errors="replace")
+
+
+def _is_shareable(request_headers: Dict[str, str], response: AppResponse) -> bool:
+    """Whether a document the app sent one client may be served to others."""
+    headers = {key.lower(): value for key, value in response.headers.items()}
+    cache_control = parse_cache_control(headers.get("cache-control"))
+    if "no-store" in cache_control or "private" in cache_control:
+        return False
+    if "set-cookie" in headers:
+        return False
+    vary = {v.strip().lower() for v in headers.get("vary", "").split(",") if v.strip()}
+    if vary - {"accept-encoding"}:
+        return False
+    if "authorization" in {key.lower() for key in request_headers}:
+        return "public" in cache_control or "s-maxage" in cache_control
+    return True
+
+
+def _upstream_validators(response: AppResponse) -> Dict[str, str]:
+    headers = {key.lower(): value for key, value in response.headers.items()}
+    validators = {}
+    if etag := headers.get("etag"):
+        validators["If-None-Match"] = etag
+    if last_modified := headers.get("last-modified"):
+        validators["If-Modified-Since"] = last_modified
+    return validators
+
+
+async def _validate(kind: str, body: bytes) -> App | Surface:
+    schema = Surface if kind == "surface" else App
+    if len(body) >= OFFLOAD_MIN_DOCUMENT_SIZE:
+        return await asyncio.to_thread(validate, schema, body)
+    return validate(schema, body)
+
+
+async def _load_document(
+    target: ProxyTarget, kind: str, document_id: str, query: str = ""
+) -> Tuple[GatewayDocument, str]:
+    """
+    A validated document of the app's current version, and where it came from: HIT, REVALIDATED (the app
+    answered 304), UNCHANGED (the app sent what we already had) or MISS.
+    """
+    key: DocumentKey = (target.project.id, kind, document_id, query)
+    entry = _documents.get(key)
+    if entry is not None and entry.is_fresh():
+        _documents.move_to_end(key)
+        _stats["hits"] += 1
+        return entry, "HIT"
+
+    headers = _app_headers()
+    if entry is not None:
+        headers.update(entry.upstream_validators)
+    path = f"surfaces/{document_id}" if kind == "surface" else ""
+    response = await request_app(target, "GET", path, headers, query=query)
+    if isinstance(response, Response):
+        raise GatewayError(await response.get_data(as_text=True), response.status_code)
+
+    lifetime = freshness_lifetime(response.headers) or 0
+    if entry is not None and response.status == 304:
+        entry.fetched_at, entry.lifetime = monotonic(), lifetime
+        _stats["revalidated"] += 1
+        return entry, "REVALIDATED"
+    if response.status == 404:
+        raise GatewayError(f"{kind.capitalize()} {document_id} not found", 404)
+    if response.status != 200:
+        raise GatewayError(
+            f"Application answered {response.status} for {kind} {document_id}", 502
+        )
+
+    shareable = _is_shareable(headers, response)
+    digest = hashlib.sha256(response.body).hexdigest()
+    if entry is not None and shareable and entry.upstream_digest == digest:
+        entry.fetched_at, entry.lifetime = monotonic(), lifetime
+        entry.upstream_validators = _upstream_validators(response)
+        _stats["unchanged"] += 1
+        return entry, "UNCHANGED"
+
+    try:
+        document = await _validate(kind, response.body)
+    except ValidationError as e:
+        warning(f"Invalid {kind} {document_id} from {target.project.name}: {e}")
+        raise GatewayError(f"Application sent an invalid {kind} {document_id}", 502)
+    _stats["validated"] += 1
+
+    history = None
+    if isinstance(document, Surface):
+        history = (
+            entry.history
+            if entry is not None and entry.history is not None
+            else SurfaceHistory(GATEWAY_HISTORY_LENGTH)
+        )
+        document = history.record(document)
+        etag = f'"{document.revision}"'
+        body = dump_json(document)
+    else:
+        body = dump_json(document)
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    loaded = GatewayDocument(
+        document=document,
+        body=body,
+        etag=etag,
+        upstream_digest=digest,
+        upstream_validators=_upstream_validators(response),
+        fetched_at=monotonic(),
+        lifetime=lifetime,
+        history=history,
+    )
+    if shareable:
+        _store(key, loaded)
+    else:
+        # Meant for this client only
+        _forget(key)
+    return loaded, "MISS"
+
+
+def _representation_etag(etag: str, media_type: str) -> str:
+    # Strong ETags have to differ between representations
+    if media_type == JSON_MEDIA_TYPE:
+        return etag
+    return f'{etag[:-1]}-{media_type.rsplit("/", 1)[-1]}"'
+
+
+def _respond(
+    value: Any,
+    media_type: str,
+    source: str,
+    etag: Optional[str] = None,
+    body: Optional[bytes] = None,
+) -> Response:
+    """Respond with value in the negotiated media type. etag is that of its JSON form, if it has one."""
+    headers = {
+        "Content-Type": media_type,
+        # Clients may keep documents, but revalidating with us is cheap
+        "Cache-Control": "no-cache",
+        "Vary": "Accept",
+        "X-Fats-Gateway": source,
+    }
+    if etag is not None:
+        headers["ETag"] = _representation_etag(etag, media_type)
+        if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+            return Response(b"", status=304, headers=headers)
+    if body is None:
+        body = encode(value, media_type)
+    return Response(body, headers=headers)
+
+
+def _negotiated_media_type() -> Optional[str]:
+    return negotiate_media_type(request.headers.get("Accept"))
+
+
+def _not_acceptable() -> Tuple[str, int]:
+    return f"Can respond with {', '.join(supported_media_types())}", 406
+
+
+@gateway_blueprint.get("/<string:app>")
+async def get_app_document(app: str):
+    media_type = _negotiated_media_type()
+    if media_type is None:
+        return _not_acceptable()
+    target = await get_target_from_app_name(app)
+    if target is None:
+        return "Application not found", 404
+    try:
+        entry, source = await _load_document(target, "app", "")
+    except GatewayError as e:
+        return e.message, e.status
+
+    document = entry.document
+    assert isinstance(document, App)
+    if document.rootUrl is None:
+        scheme = request.headers.get("X-Forwarded-Proto") or request.scheme
+        document = document.model_copy(
+            update={"rootUrl": f"{scheme}://{request.host}/fatstacks/{app}"}
+        )
+    body = dump_json(document)
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    if media_type == JSON_MEDIA_TYPE:
+        return _respond(document, media_type, source, etag, body)
+    return _respond(document, media_type, source, etag)
+
+
+@gateway_blueprint.get("/<string:app>/surfaces/<surface_id>")
+async def get_surface(app: str, surface_id: str):
+    media_type = _negotiated_media_type()
+    if media_type is None:
+        return _not_acceptable()
+    target = await get_target_from_app_name(app)
+    if target is None:
+        return "Application not found", 404
+
+    since = request.args.get("since")
+    # since is ours, the rest (e.g. cursor and pageSize) are the app's
+    query = urlencode(
+        [(k, v) for k, v in request.args.items(multi=True) if k != "since"]
+    )
+    try:
+        entry, source = await _load_document(target, "surface", surface_id, query)
+    except GatewayError as e:
+        return e.message, e.status
+
+    revision = entry.document.revision if isinstance(entry.document, Surface) else None
+    if since is not None and since != revision and entry.history is not None:
+        delta = entry.history.changes_since(since)
+        if delta is not None:
+            return _respond(delta, media_type, source)
+    if since is not None and since == revision:
+        return Response(
+            b"", status=304, headers={"ETag": _representation_etag(entry.etag, media_type)}
+        )
+    return _respond(
+        entry.document, media_type, source, entry.etag, entry.encoded_as(media_type)
+    )
+
+
+def _find_action(surface: Surface, action_id: str) -> Optional[Action]:
+    return next((a for a in surface.actions or [] if a.id == action_id), None)
+
+
+def _is_app_endpoint(endpoint: str) -> bool:
+    # Endpoints on other hosts are left to the client, fats only makes requests to the app itself
+    return not endpoint.startswith(("http://", "https://", "//"))
+
+
+@gateway_blueprint.post("/<string:app>/surfaces/<surface_id>/actions/<action_id>")
+async def run_action(app: str, surface_id: str, action_id: str):
+    media_type = _negotiated_media_type()
+    if media_type is None:
+        return _not_acceptable()
+    target = await get_target_from_app_name(app)
+    if target is None:
+        return "Application not found", 404
+
+    if request.mimetype in MSGPACK_ALIASES:
+        try:
+            options = decode(Dict[str, Any], await request.get_data(), MSGPACK_MEDIA_TYPE)
+        except ValueError:
+            return "Invalid MessagePack body", 400
+    else:
+        options = await request.get_json(silent=True) or {}
+    data = options.get("data") or {}
+    form_data = options.get("formData")
+    if not isinstance(data, dict) or not isinstance(form_data, (dict, type(None))):
+        return "data and formData must be objects", 400
+
+    try:
+        entry, source = await _load_document(target, "surface", surface_id)
+    except GatewayError as e:
+        return e.message, e.status
+    assert isinstance(entry.document, Surface)
+    action = _find_action(entry.document, action_id)
+    if action is None:
+        return f"Action {action_id} not found on surface {surface_id}", 404
+
+    for behavior in behaviors(action):
+        if (
+            isinstance(behavior, RequestActionBehavior)
+            and behavior.formToUse is not None
+            and form_data is None
+        ):
+            return f"Action {action_id} needs the data of form {behavior.formToUse}", 400
+
+    # The client's own headers are the same for every request behavior
+    headers = _app_headers()
+    headers["Content-Type"] = "application/json"
+
+    results: List[Dict[str, Any]] = []
+    completed = True
+    for behavior in behaviors(action):
+        if isinstance(behavior, NavigateActionBehavior):
+            results.append(
+                {"type": "navigate", "uri": navigation_uri(behavior, data)}
+            )
+        elif isinstance(behavior, ToastActionBehavior):
+            results.append({"type": "toast", "message": behavior.message})
+        elif isinstance(behavior, RequestActionBehavior):
+            payload = request_payload(behavior, data, form_data)
+            if not _is_app_endpoint(behavior.endpoint):
+                results.append(
+                    {
+                        "type": "request",
+                        "endpoint": behavior.endpoint,
+                        "executed": False,
+                        "payload": payload,
+                    }
+                )
+                continue
+
+            path, _, query = behavior.endpoint.partition("?")
+            response = await request_app(
+                target, "POST", path, headers, json.dumps(payload).encode(), query
+            )
+            if isinstance(response, Response):
+                results.append(
+                    {
+                        "type": "request",
+                        "endpoint": behavior.endpoint,
+                        "executed": False,
+                        "status": response.status_code,
+                    }
+                )
+                completed = False
+                break
+            results.append(
+                {
+                    "type": "request",
+                    "endpoint": behavior.endpoint,
+                    "executed": True,
+                    "status": response.status,
+                    "body": _decode_body(response),
+                }
+            )
+            if response.status >= 400:
+                # Later behaviors may depend on this one, so stop here like a client would
+                completed = False
+                break
+
+    return _respond(
+        {"actionId": action_id, "completed": completed, "results": results},
+        media_type,
+        source,
+    )
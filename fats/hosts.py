@@ -0,0 +1,240 @@
+# Pool of Docker engines app containers can be placed on
+# The engine behind the mounted socket is always available as "local". More are configured with
+#   FATS_DOCKER_HOSTS="edge1=tcp://10.0.0.5:2375,edge2=unix:///run/edge2.sock@10.0.0.6"
+# where the optional @address is how the proxy reaches containers published on that engine.
+# It is taken from after the last @, so ssh://user@host endpoints always need one.
+# Remote engines must be able to reach the proxy's network, containers on them publish their PORT on that address only.
+
+import asyncio
+import ipaddress
+import os
+import socket
+from collections import Counter
+from dataclasses import dataclass
+from time import monotonic
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from .utils import log, warning
+
+LOCAL_HOST = "local"
+
+# Engine info is refreshed at most this often when placing containers
+HOST_INFO_TTL_SECONDS = 30
+HOST_INFO_TIMEOUT_SECONDS = 2
+
+
+@dataclass(frozen=True)
+class DockerHost:
+    name: str
+    endpoint: Optional[str]
+    """Docker endpoint as passed to `docker -H`, None for the default engine"""
+    address: Optional[str] = None
+    """Address the proxy reaches published ports at, None to use container hostnames on fats_network"""
+
+    @property
+    def is_local(self) -> bool:
+        return self.name == LOCAL_HOST
+
+
+@dataclass
+class HostInfo:
+    cpus: int
+    memory_bytes: int
+    containers_running: int
+    fetched_at: float
+
+
+def parse_docker_hosts(value: str) -> Dict[str, DockerHost]:
+    hosts: Dict[str, DockerHost] = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, endpoint = item.partition("=")
+        name = name.strip()
+        if not (sep and name and endpoint):
+            raise ValueError(f"Invalid FATS_DOCKER_HOSTS entry: {item}")
+        if name == LOCAL_HOST:
+            raise ValueError(f"'{LOCAL_HOST}' is reserved for the default engine")
+        endpoint, sep, address = endpoint.strip().rpartition("@")
+        if not sep:
+            endpoint, address = address, ""
+        if not address:
+            # Containers on a TCP engine are published on the engine's own address
+            address = urlsplit(endpoint).hostname or ""
+        if not address:
+            raise ValueError(
+                f"Docker host {name} needs an @address for the proxy to reach it"
+            )
+        hosts[name] = DockerHost(name=name, endpoint=endpoint, address=address)
+    return hosts
+
+
+_hosts: Dict[str, DockerHost] = {
+    LOCAL_HOST: DockerHost(name=LOCAL_HOST, endpoint=None),
+    **parse_docker_hosts(os.getenv("FATS_DOCKER_HOSTS", "")),
+}
+_host_info: Dict[str, HostInfo] = {}
+
+
+def all_hosts() -> List[DockerHost]:
+    return list(_hosts.values())
+
+
+def get_host(name: str) -> Optional[DockerHost]:
+    return _hosts.get(name)
+
+
+def docker_args(host_name: str) -> List[str]:
+    """Arguments that point the docker CLI at a host, to go right after `docker`."""
+    host = _hosts.get(host_name)
+    if host is None:
+        warning(f"Unknown docker host {host_name}, is it missing from FATS_DOCKER_HOSTS?")
+        return []
+    return ["-H", host.endpoint] if host.endpoint else []
+
+
+def upstream_address(host_name: str, container_name: str) -> str:
+    """Where the proxy reaches a container: its hostname locally, its engine's address remotely."""
+    host = _hosts.get(host_name)
+    if host is None or host.address is None:
+        return container_name
+    return host.address
+
+
+async def publish_address(host_name: str) -> str:
+    """
+    The IP address containers on a remote engine publish their port on, the one the proxy connects to,
+    formatted for `docker run -p`.
+    """
+    host = _hosts[host_name]
+    assert host.address is not None, f"Docker host {host_name} publishes no ports"
+    try:
+        ip = str(ipaddress.ip_address(host.address))
+    except ValueError:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host.address, None, type=socket.SOCK_STREAM
+        )
+        ip = str(infos[0][4][0])
+    return f"[{ip}]" if ":" in ip else ip
+
+
+def _api_url(host: DockerHost):
+    return urlsplit(
+        host.endpoint or os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+    )
+
+
+def _can_ask(host: DockerHost) -> bool:
+    return _api_url(host).scheme in ("unix", "tcp", "http")
+
+
+def _api_client(host: DockerHost) -> Optional[httpx.AsyncClient]:
+    url = _api_url(host)
+    if url.scheme == "unix":
+        transport = httpx.AsyncHTTPTransport(uds=url.path)
+        return httpx.AsyncClient(
+            transport=transport,
+            base_url="http://docker",
+            timeout=HOST_INFO_TIMEOUT_SECONDS,
+        )
+    if url.scheme in ("tcp", "http"):
+        return httpx.AsyncClient(
+            base_url=f"http://{url.netloc}", timeout=HOST_INFO_TIMEOUT_SECONDS
+        )
+    # e.g. ssh://, which only the CLI speaks
+    return None
+
+
+async def fetch_host_info(host: DockerHost) -> Optional[HostInfo]:
+    """CPU, memory and container counts from the engine API, None if the engine can't be asked."""
+    cached = _host_info.get(host.name)
+    if cached is not None and monotonic() - cached.fetched_at < HOST_INFO_TTL_SECONDS:
+        return cached
+
+    client = _api_client(host)
+    if client is None:
+        return None
+    try:
+        async with client:
+            response = await client.get("/info")
+            response.raise_for_status()
+            info = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        warning(f"Failed to get info from docker host {host.name}: {e}")
+        _host_info.pop(host.name, None)
+        return None
+
+    host_info = HostInfo(
+        cpus=int(info.get("NCPU") or 1),
+        memory_bytes=int(info.get("MemTotal") or 0),
+        containers_running=int(info.get("ContainersRunning") or 0),
+        fetched_at=monotonic(),
+    )
+    _host_info[host.name] = host_info
+    return host_info
+
+
+async def place_replicas(existing_hosts: List[str], count: int) -> List[str]:
+    """
+    Choose hosts for `count` new replicas of an app whose replicas already run on `existing_hosts`.
+    Replicas are spread across hosts first, then go to the least loaded host with the most memory to spare.
+    Remote hosts that can't be reached are skipped.
+    """
+    if count <= 0:
+        return []
+    if len(_hosts) == 1:
+        return [LOCAL_HOST] * count
+
+    infos = await asyncio.gather(*(fetch_host_info(host) for host in _hosts.values()))
+    candidates: Dict[str, Optional[HostInfo]] = {
+        host.name: info
+        for host, info in zip(_hosts.values(), infos)
+        # Engines we can't ask (e.g. ssh://) are still used, unreachable ones are not
+        if info is not None or host.is_local or not _can_ask(host)
+    }
+
+    replicas = Counter(h for h in existing_hosts if h in candidates)
+    placed: Counter[str] = Counter()
+
+    def _score(name: str):
+        info = candidates[name]
+        if info is None:
+            # Without numbers a host goes last among equals
+            return (replicas[name], float("inf"), 0.0)
+        running = info.containers_running + placed[name]
+        load = running / max(1, info.cpus)
+        # The engine API has no free memory figure, so use what each container would get
+        return (replicas[name], load, -info.memory_bytes / (running + 1))
+
+    placements = []
+    for _ in range(count):
+        best = min(candidates, key=_score)
+        replicas[best] += 1
+        placed[best] += 1
+        placements.append(best)
+    if any(name != LOCAL_HOST for name in placements):
+        log(f"Placed {count} replicas on {dict(Counter(placements))}")
+    return placements
+
+
+def host_stats() -> Dict[str, Any]:
+    return {
+        host.name: {
+            "endpoint": host.endpoint,
+            "address": host.address,
+            "info": (
+                {
+                    "cpus": info.cpus,
+                    "memory_bytes": info.memory_bytes,
+                    "containers_running": info.containers_running,
+                }
+                if (info := _host_info.get(host.name)) is not None
+                else None
+            ),
+        }
+        for host in _hosts.values()
+    }
@@ -0,0 +1,211 @@
+# Container log collection
+# One `docker logs --follow` reader per service entry container feeds a memory-bounded ring buffer per app,
+# which any number of tail and follow requests read from without touching docker.
+
+import asyncio
+import os
+from collections import deque
+from datetime import datetime
+from typing import AsyncGenerator, Deque, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from .hosts import docker_args
+from .models.service_entry import ServiceEntry
+from .utils import AsyncSessionLocal, debug, log, run, warning
+
+# Memory budget for each app's buffer, the oldest lines are dropped first
+LOG_BUFFER_BYTES = int(os.getenv("FATS_LOG_BUFFER_KB", "1024")) * 1024
+
+# Longer lines are truncated
+MAX_LINE_LENGTH = 16 * 1024
+
+# How much history to read when attaching to a container for the first time
+INITIAL_TAIL_LINES = 200
+
+
+class LogLine(NamedTuple):
+    seq: int
+    time: str
+    container: str
+    stream: str
+    text: str
+
+    @property
+    def size(self) -> int:
+        return len(self.text) + len(self.time) + len(self.container) + 64
+
+    def as_dict(self):
+        return self._asdict()
+
+
+class AppLogBuffer:
+    """Ring buffer of an app's recent log lines, indexed by a sequence number that never repeats."""
+
+    def __init__(self, max_bytes: int = LOG_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self._lines: Deque[LogLine] = deque()
+        self._bytes = 0
+        self._next_seq = 1
+        self._changed = asyncio.Condition()
+
+    @property
+    def first_seq(self) -> int:
+        return self._lines[0].seq if self._lines else self._next_seq
+
+    @property
+    def last_seq(self) -> int:
+        return self._next_seq - 1
+
+    async def append(self, time: str, container: str, stream: str, text: str):
+        async with self._changed:
+            line = LogLine(self._next_seq, time, container, stream, text)
+            self._next_seq += 1
+            self._lines.append(line)
+            self._bytes += line.size
+            while self._bytes > self.max_bytes and len(self._lines) > 1:
+                self._bytes -= self._lines.popleft().size
+            self._changed.notify_all()
+
+    def tail(self, count: int) -> List[LogLine]:
+        if count <= 0:
+            return []
+        start = max(0, len(self._lines) - count)
+        return [self._lines[i] for i in range(start, len(self._lines))]
+
+    def after(self, seq: int) -> List[LogLine]:
+        """Lines with a sequence number greater than seq, found by offset rather than by search."""
+        start = max(0, seq + 1 - self.first_seq)
+        return [self._lines[i] for i in range(start, len(self._lines))]
+
+    async def follow(self, after_seq: int) -> AsyncGenerator[List[LogLine], None]:
+        """Yield batches of new lines as they arrive. Lines dropped before a slow reader got to them are skipped."""
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.last_seq > after_seq)
+                lines = self.after(after_seq)
+                after_seq = self.last_seq
+            if lines:
+                yield lines
+
+    def stats(self):
+        return {
+            "lines": len(self._lines),
+            "bytes": self._bytes,
+            "first_seq": self.first_seq,
+            "last_seq": self.last_seq,
+        }
+
+
+_buffers: Dict[int, AppLogBuffer] = {}
+_readers: Dict[str, asyncio.Task[None]] = {}
+# Timestamp of the last line read from each container, so reattaching does not repeat lines
+_last_timestamps: Dict[str, str] = {}
+
+
+def get_log_buffer(project_config_id: int) -> AppLogBuffer:
+    buffer = _buffers.get(project_config_id)
+    if buffer is None:
+        buffer = _buffers[project_config_id] = AppLogBuffer()
+    return buffer
+
+
+def find_log_buffer(project_config_id: int) -> Optional[AppLogBuffer]:
+    return _buffers.get(project_config_id)
+
+
+def _split_timestamp(line: str) -> tuple[str, str]:
+    # docker logs --timestamps prefixes every line with an RFC 3339 timestamp and a space
+    timestamp, sep, text = line.partition(" ")
+    if sep and timestamp[:4].isdigit() and timestamp.endswith("Z"):
+        return timestamp, text
+    return datetime.now().isoformat() + "Z", line
+
+
+async def _pump(
+    stream: Optional[asyncio.StreamReader],
+    stream_name: str,
+    entry: ServiceEntry,
+    buffer: AppLogBuffer,
+    since: Optional[str],
+):
+    if stream is None:
+        return
+    while True:
+        try:
+            raw = await stream.readline()
+        except ValueError:
+            # Longer than the stream reader's limit, the rest of the line was discarded
+            continue
+        if not raw:
+            return
+        timestamp, text = _split_timestamp(raw.decode(errors="replace").rstrip("\r\n"))
+        if timestamp == since:
+            # --since is inclusive, we already have this line
+            continue
+        _last_timestamps[entry.container_id] = timestamp
+        await buffer.append(
+            timestamp, entry.hostname, stream_name, text[:MAX_LINE_LENGTH]
+        )
+
+
+async def _read_container_logs(entry: ServiceEntry):
+    buffer = get_log_buffer(entry.project_config_id)
+    since = _last_timestamps.get(entry.container_id)
+    history = ["--since", since] if since else ["--tail", str(INITIAL_TAIL_LINES)]
+    proc = await run(
+        "docker",
+        *docker_args(entry.docker_host),
+        "logs",
+        "--follow",
+        "--timestamps",
+        *history,
+        entry.container_id,
+    )
+    try:
+        # docker logs writes the container's stdout and stderr to its own
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_pump(proc.stdout, "stdout", entry, buffer, since))
+            tg.create_task(_pump(proc.stderr, "stderr", entry, buffer, since))
+        await proc.wait()
+        debug(f"Log stream of {entry.hostname} ended with code {proc.returncode}")
+    except Exception as e:
+        warning(f"Failed to read logs of {entry.hostname}: {e}")
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+async def sync_log_readers():
+    """Attach a log reader to every service entry container, and detach from removed ones."""
+    async with AsyncSessionLocal() as session:
+        entries = (await session.execute(select(ServiceEntry))).scalars().all()
+
+    wanted = {entry.container_id: entry for entry in entries}
+    changed = False
+    for container_id in list(_readers):
+        if container_id not in wanted:
+            _readers.pop(container_id).cancel()
+            _last_timestamps.pop(container_id, None)
+            changed = True
+
+    for container_id, entry in wanted.items():
+        reader = _readers.get(container_id)
+        if reader is not None and not reader.done():
+            continue
+        # New containers, and ones whose stream ended (e.g. they were restarted)
+        _readers[container_id] = asyncio.create_task(_read_container_logs(entry))
+        changed = True
+
+    live_projects = {entry.project_config_id for entry in entries}
+    for project_config_id in list(_buffers):
+        if project_config_id not in live_projects:
+            del _buffers[project_config_id]
+
+    if changed:
+        log(f"Following logs of {len(_readers)} containers.")
+
+
+def log_stats():
+    return {str(key): buffer.stats() for key, buffer in _buffers.items()}
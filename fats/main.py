@@ -2,66 +2,121 @@
 # takes repos, auto builds nixpacks
 # runs nixpacks and forwards http requests to them
 
+import asyncio
+import json
 from pathlib import Path
 import tempfile
+from time import monotonic
+from typing import Any, AsyncGenerator, Awaitable, Dict, TypeVar
 from fats.network import connect_self_to_network
-from quart import Quart, request
+from quart import Quart, Response, request
 import aiofiles
-from sqlalchemy.exc import IntegrityError
 
+from fats.admission import admission_stats
+from fats.assets import asset_stats
+from fats.cache import response_cache
+from fats.coalescing import coalescing_stats
+from fats.fatstacks_api import build_fatstacks_schemas, fatstacks_blueprint
+from fats.hosts import host_stats
+from fats.logs import LogLine, find_log_buffer, log_stats
+from fats.profiler import ProfileInProgress, profile
+from fats.cleanup import UPLOAD_PREFIX, temporary_path
 from fats.secrets import upsert_secret
-
-from .scheduler import request_early_schedule_execution, start_scheduler
+from fats.tunnels import TunnelWebsocket, tunnel_stats
+from fats.upstream import upstream_stats
+
+from .scheduler import (
+    mark_schedule_executed,
+    schedule_stats,
+    start_scheduler,
+)
 from .utils.sqlite import create_tables
 
-from .builder import build_railpack_from_tarball
-from .utils import AsyncSessionLocal, log
+from .builder import retrieve_railpack_bin
+from .deploy import deploy_tarball
+from .runner import last_reconcile, setup_application_containers
+from .utils import log, warning
 from .schedules import create_containers_schedule
-from .proxy import proxy_blueprint
+from .proxy import get_target_from_app_name, proxy_blueprint, warm_routes
+from .gateway import gateway_blueprint, gateway_stats
+from .uploads import upload_stats, uploads_blueprint
 
 app = Quart(__name__)
+# Holds back clients whose WebSocket messages are relayed faster than the app reads them
+app.websocket_class = TunnelWebsocket
+
+T = TypeVar("T")
+
+# How long each startup step took, in seconds
+startup_timings: Dict[str, float] = {}
+_background_tasks: set[asyncio.Task[Any]] = set()
+
+
+async def _timed_step(name: str, step: Awaitable[T]) -> T:
+    started = monotonic()
+    try:
+        return await step
+    finally:
+        startup_timings[name] = monotonic() - started
+        log(f"Startup step '{name}' took {startup_timings[name] * 1000:.0f} ms")
+
+
+async def _prefetch_railpack():
+    try:
+        await _timed_step("prefetch railpack", retrieve_railpack_bin())
+    except Exception as e:
+        warning(f"Failed to prefetch railpack, will retry on first build: {e}")
+
+
+async def _reconcile_and_warm_routes():
+    try:
+        await _timed_step("reconcile containers", setup_application_containers())
+        mark_schedule_executed(create_containers_schedule)
+    except Exception as e:
+        warning(f"Startup reconciliation failed, leaving it to the scheduler: {e}")
+    routes = await _timed_step("warm routes", warm_routes())
+    log(f"Warmed {routes} routes")
 
 
 @app.before_serving
 async def startup():
-    await create_tables()
-    await connect_self_to_network()
+    started = monotonic()
+
+    # Railpack is only needed for builds, so fetch it without holding up serving
+    prefetch = asyncio.create_task(_prefetch_railpack())
+    _background_tasks.add(prefetch)
+    prefetch.add_done_callback(_background_tasks.discard)
+
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(_timed_step("create tables", create_tables()))
+        tg.create_task(_timed_step("connect to network", connect_self_to_network()))
+        tg.create_task(_timed_step("build fatstacks schemas", build_fatstacks_schemas()))
+
+    # Make sure containers and routes are ready before the listener accepts traffic
+    await _reconcile_and_warm_routes()
     start_scheduler()
 
+    startup_timings["total"] = monotonic() - started
+    log(f"Startup finished in {startup_timings['total'] * 1000:.0f} ms")
+
 
 @app.post("/mgmt/tar-upload")
 async def handle_tar_upload():
     # stream store the tar to a file
     log("Receiving tar upload...")
-    with tempfile.NamedTemporaryFile(suffix=".tar.gz", delete=False) as temp_tar:
-        async with aiofiles.open(temp_tar.name, "wb") as out_file:
+    with tempfile.NamedTemporaryFile(
+        prefix=UPLOAD_PREFIX, suffix=".tar.gz", delete=False
+    ) as temp_tar:
+        tar_path = Path(temp_tar.name)
+
+    async with temporary_path(tar_path):
+        async with aiofiles.open(tar_path, "wb") as out_file:
             async for chunk in request.body:
                 await out_file.write(chunk)
 
-    log(f"Received tar upload, stored to {temp_tar.name}")
-
-    # call builder to build the railpack from the tar
-    project_config = await build_railpack_from_tarball(Path(temp_tar.name))
+        log(f"Received tar upload, stored to {tar_path}")
 
-    # record the existence of the ProjectConfig in persistent sqlite
-    async with AsyncSessionLocal() as session:
-        try:
-            session.add(project_config)
-            await session.commit()
-        except IntegrityError:
-            # Already exists, lets overwrite
-            log(
-                f"ProjectConfig {project_config.name}:{project_config.version} already exists, overwriting..."
-            )
-            await session.rollback()
-            existing = await session.get(type(project_config), project_config.id)
-            if existing:
-                for attr in vars(project_config):
-                    setattr(existing, attr, getattr(project_config, attr))
-                await session.commit()
-
-    # Let's kindly ask the scheduler to run an early execution of the container setup
-    request_early_schedule_execution(create_containers_schedule)
+        await deploy_tarball(tar_path)
 
     return "Upload received", 200
 
@@ -80,4 +135,110 @@ async def handle_secret(secret_name: str):
     return "Secret uploaded", 200
 
 
+# SSE comment sent to idle log followers so proxies in between keep the connection open
+LOG_HEARTBEAT_SECONDS = 15
+
+
+@app.get("/mgmt/apps/<app_name>/logs")
+async def handle_app_logs(app_name: str):
+    target = await get_target_from_app_name(app_name)
+    buffer = find_log_buffer(target.project.id) if target is not None else None
+    if target is None or buffer is None:
+        return "Application not found", 404
+
+    tail = request.args.get("tail", default=100, type=int)
+    if request.args.get("follow", "0") not in ("1", "true"):
+        lines = buffer.tail(tail)
+        return {
+            "lines": [line.as_dict() for line in lines],
+            "last_seq": buffer.last_seq,
+        }
+
+    # A reconnecting EventSource resumes after the last line it saw
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if last_event_id.isdigit():
+        backlog = buffer.after(int(last_event_id))
+    else:
+        backlog = buffer.tail(tail)
+    # Following starts right after the backlog, lines appended while it is sent are not lost
+    resume_after = backlog[-1].seq if backlog else buffer.last_seq
+
+    async def _events() -> AsyncGenerator[bytes, None]:
+        for line in backlog:
+            yield _log_event(line)
+        updates = buffer.follow(resume_after)
+        next_batch = asyncio.ensure_future(anext(updates))
+        try:
+            while True:
+                done, _ = await asyncio.wait({next_batch}, timeout=LOG_HEARTBEAT_SECONDS)
+                if not done:
+                    yield b": heartbeat\n\n"
+                    continue
+                for line in next_batch.result():
+                    yield _log_event(line)
+                next_batch = asyncio.ensure_future(anext(updates))
+        finally:
+            next_batch.cancel()
+            # The generator can only be closed once the pending read let go of it
+            await asyncio.gather(next_batch, return_exceptions=True)
+            await updates.aclose()
+
+    response = Response(
+        _events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Followers stay connected for as long as they like
+    response.timeout = None
+    return response
+
+
+def _log_event(line: LogLine) -> bytes:
+    return f"id: {line.seq}\ndata: {json.dumps(line.as_dict())}\n\n".encode()
+
+
+@app.get("/mgmt/profile")
+async def handle_profile():
+    seconds = request.args.get("seconds", default=10.0, type=float)
+    interval_ms = request.args.get("interval_ms", default=5.0, type=float)
+    all_threads = request.args.get("threads", "loop") == "all"
+    try:
+        result = await profile(
+            seconds, max(interval_ms, 1.0) / 1000, all_threads=all_threads
+        )
+    except ProfileInProgress as e:
+        return str(e), 409
+    return Response(
+        result.collapsed(),
+        mimetype="text/plain",
+        headers={
+            "X-Fats-Profile-Mode": result.mode,
+            "X-Fats-Profile-Samples": str(result.sample_count),
+            "X-Fats-Profile-Seconds": f"{result.duration:.3f}",
+        },
+    )
+
+
+@app.get("/mgmt/metrics")
+async def handle_metrics():
+    return {
+        "apps": admission_stats(),
+        "upstreams": upstream_stats(),
+        "startup_seconds": startup_timings,
+        "last_reconcile": last_reconcile,
+        "schedules": schedule_stats(),
+        "cache": response_cache.stats(),
+        "coalescing": coalescing_stats(),
+        "assets": asset_stats(),
+        "uploads": upload_stats(),
+        "hosts": host_stats(),
+        "gateway": gateway_stats(),
+        "tunnels": tunnel_stats(),
+        "logs": log_stats(),
+    }
+
+
 app.register_blueprint(proxy_blueprint, url_prefix="/app")
+app.register_blueprint(uploads_blueprint, url_prefix="/mgmt/uploads")
+app.register_blueprint(fatstacks_blueprint, url_prefix="/mgmt/fatstacks")
+app.register_blueprint(gateway_blueprint, url_prefix="/fatstacks")
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from sqlalchemy import JSON, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -11,6 +13,33 @@ class ProjectConfig(Base):
     name: Mapped[str]
     version: Mapped[str]
     id: Mapped[int] = mapped_column(primary_key=True, init=False)
-    desired_secrets: Mapped[json_str_list] = mapped_column(JSON, default=list)
+    desired_secrets: Mapped[json_str_list] = mapped_column(JSON, default_factory=list)
+
+    # Admission control, None means unlimited
+    max_in_flight: Mapped[Optional[int]] = mapped_column(default=None)
+    max_requests_per_second: Mapped[Optional[float]] = mapped_column(default=None)
+    queue_size: Mapped[Optional[int]] = mapped_column(default=None)
+
+    # Upstream timeouts in seconds, None means the proxy default
+    connect_timeout: Mapped[Optional[float]] = mapped_column(default=None)
+    first_byte_timeout: Mapped[Optional[float]] = mapped_column(default=None)
+    read_timeout: Mapped[Optional[float]] = mapped_column(default=None)
+
+    # Autoscaling bounds and targets, replicas are kept at min_replicas when both are equal
+    min_replicas: Mapped[int] = mapped_column(default=1)
+    max_replicas: Mapped[int] = mapped_column(default=1)
+    target_in_flight_per_replica: Mapped[Optional[int]] = mapped_column(default=None)
+    target_latency: Mapped[Optional[float]] = mapped_column(default=None)
+
+    # Whether the proxy may compress responses the app sends uncompressed
+    edge_compression: Mapped[bool] = mapped_column(default=True)
+    # Whether identical concurrent GETs may share a single upstream request
+    coalesce_requests: Mapped[bool] = mapped_column(default=False)
+
+    # Directories of the build context served by the proxy itself, see fats.assets
+    static_dirs: Mapped[json_str_list] = mapped_column(JSON, default_factory=list)
+
+    # When this version was last uploaded, as a unix timestamp
+    deployed_at: Mapped[Optional[float]] = mapped_column(default=None)
 
     __table_args__ = (UniqueConstraint("name", "version", name="uix_name_version"),)
@@ -15,3 +15,5 @@ class ServiceEntry(Base):
     project_config_id: Mapped[int] = mapped_column(
         ForeignKey("project_config.id"), nullable=False
     )
+    # Which engine in fats.hosts the container runs on
+    docker_host: Mapped[str] = mapped_column(default="local")
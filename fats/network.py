@@ -1,19 +1,21 @@
 import re
 from socket import gethostname
+from .hosts import LOCAL_HOST, docker_args
 from .utils import run, log
 
-_does_network_exist_cache = False
+# Docker hosts the network is known to exist on
+_does_network_exist_cache: set[str] = set()
 
 
-async def create_or_get_fats_network() -> str:
+async def create_or_get_fats_network(docker_host: str = LOCAL_HOST) -> str:
     """Creates the FATS Docker network if it doesn't exist, or returns the existing one."""
     network_name = "fats_network"
-    global _does_network_exist_cache
-    if _does_network_exist_cache:
+    if docker_host in _does_network_exist_cache:
         return network_name
     # Check if the network already exists
     proc = await run(
         "docker",
+        *docker_args(docker_host),
         "network",
         "ls",
         "--filter",
@@ -26,14 +28,15 @@ async def create_or_get_fats_network() -> str:
     output = (await proc.stdout.read()).decode().strip()
 
     if network_name in output.splitlines():
-        _does_network_exist_cache = True
+        _does_network_exist_cache.add(docker_host)
         return network_name
 
     # Create the network
-    proc = await run("docker", "network", "create", network_name)
+    proc = await run("docker", *docker_args(docker_host), "network", "create", network_name)
     await proc.wait()
     assert proc.returncode == 0, "Failed to create FATS network"
-    log(f"Created FATS network '{network_name}'.")
+    _does_network_exist_cache.add(docker_host)
+    log(f"Created FATS network '{network_name}' on docker host {docker_host}.")
     return network_name
 
 
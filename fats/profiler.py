@@ -0,0 +1,202 @@
+# Sampling profiler for the fats process itself, started on demand from /mgmt/profile
+# Looks at the event loop thread's stack at a fixed interval and counts the stacks it sees, grouped
+# by the asyncio task that was running. Nothing is installed or running while no profile is taken.
+#
+# With the loop on the main thread, samples are taken by a SIGPROF handler every `interval` seconds
+# of CPU time, so they land wherever the CPU time goes. Otherwise a background thread samples the
+# loop thread every `interval` seconds of wall time, which favours the points where the loop lets go
+# of the GIL (waiting for I/O) over short bursts of Python code.
+
+import asyncio
+import os
+import signal
+import sys
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from time import perf_counter
+from types import FrameType
+from typing import Dict, List, Optional
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 300
+
+# Frames deeper than this are cut off, the outermost ones are kept
+MAX_STACK_DEPTH = 128
+
+_SITE_PACKAGES = os.sep + "site-packages" + os.sep
+_FATS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+# Short names of the source files seen so far, frames are named a lot more often than files change
+_file_names: Dict[str, str] = {}
+
+
+class ProfileInProgress(Exception):
+    """Only one profile runs at a time, the sampler would otherwise count every stack twice."""
+
+
+@dataclass
+class Profile:
+    mode: str
+    """cpu or wall, the clock samples were taken by"""
+    samples: Counter[str] = field(default_factory=Counter)
+    sample_count: int = 0
+    duration: float = 0.0
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format flamegraph.pl and speedscope read, most frequent first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+_active: Optional[Profile] = None
+
+
+def _file_name(path: str) -> str:
+    name = _file_names.get(path)
+    if name is None:
+        if _SITE_PACKAGES in path:
+            name = path.rsplit(_SITE_PACKAGES, 1)[1]
+        elif path.startswith(_FATS_ROOT):
+            name = path[len(_FATS_ROOT) :]
+        else:
+            name = os.path.basename(path)
+        name = _file_names[path] = name.removesuffix(".py").replace(";", ":")
+    return name
+
+
+def _stack(frame: Optional[FrameType]) -> List[str]:
+    names: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{_file_name(code.co_filename)}:{code.co_qualname}")
+        frame = frame.f_back
+    names.reverse()
+    return names[:MAX_STACK_DEPTH]
+
+
+def _task_label(task: Optional[asyncio.Task]) -> str:
+    if task is None:
+        return "(no task)"
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or task.get_name()
+
+
+def _sample(
+    profile: Profile,
+    loop: asyncio.AbstractEventLoop,
+    loop_thread: int,
+    frames: Dict[int, FrameType],
+    all_threads: bool,
+):
+    for thread_id, frame in frames.items():
+        if thread_id == loop_thread:
+            # The task the loop is running right now, read without the loop's cooperation
+            label = f"task {_task_label(asyncio.current_task(loop))}"
+        elif all_threads:
+            thread = threading._active.get(thread_id)  # type: ignore[attr-defined]
+            label = f"thread {thread.name if thread else thread_id}"
+        else:
+            continue
+        profile.samples[";".join([label, *_stack(frame)])] += 1
+    profile.sample_count += 1
+
+
+def _run_sampler(
+    profile: Profile,
+    loop: asyncio.AbstractEventLoop,
+    loop_thread: int,
+    stop: threading.Event,
+    interval: float,
+    all_threads: bool,
+):
+    sampler_thread = threading.get_ident()
+    started = perf_counter()
+    next_sample = started
+    while not stop.is_set():
+        frames = sys._current_frames()
+        del frames[sampler_thread]
+        _sample(profile, loop, loop_thread, frames, all_threads)
+        next_sample += interval
+        # Fall behind rather than sample in bursts when the process is too busy to keep up
+        next_sample = max(next_sample, perf_counter())
+        stop.wait(next_sample - perf_counter())
+    profile.duration = perf_counter() - started
+
+
+async def _profile_cpu(
+    result: Profile, seconds: float, interval: float, all_threads: bool
+):
+    loop = asyncio.get_running_loop()
+    loop_thread = threading.get_ident()
+
+    def _on_sigprof(signum, frame: Optional[FrameType]):
+        if all_threads:
+            frames = sys._current_frames()
+        elif frame is not None:
+            frames = {loop_thread: frame}
+        else:
+            return
+        _sample(result, loop, loop_thread, frames, all_threads)
+
+    previous = signal.signal(signal.SIGPROF, _on_sigprof)
+    started = perf_counter()
+    signal.setitimer(signal.ITIMER_PROF, interval, interval)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+        result.duration = perf_counter() - started
+
+
+async def _profile_wall(
+    result: Profile, seconds: float, interval: float, all_threads: bool
+):
+    stop = threading.Event()
+    sampler = threading.Thread(
+        target=_run_sampler,
+        args=(
+            result,
+            asyncio.get_running_loop(),
+            threading.get_ident(),
+            stop,
+            interval,
+            all_threads,
+        ),
+        name="fats-profiler",
+        daemon=True,
+    )
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        await asyncio.to_thread(sampler.join)
+
+
+async def profile(
+    seconds: float, interval: float = SAMPLE_INTERVAL, all_threads: bool = False
+) -> Profile:
+    """
+    Sample the event loop thread, and with all_threads every other thread too, for a number of seconds.
+    Raises ProfileInProgress if another profile is running.
+    """
+    global _active
+    if _active is not None:
+        raise ProfileInProgress("A profile is already being taken")
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+
+    # Signal handlers only ever run on the main thread
+    on_main_thread = threading.current_thread() is threading.main_thread()
+    if on_main_thread and hasattr(signal, "setitimer"):
+        result = _active = Profile("cpu")
+        take_profile = _profile_cpu
+    else:
+        result = _active = Profile("wall")
+        take_profile = _profile_wall
+    try:
+        await take_profile(result, seconds, interval, all_threads)
+    finally:
+        _active = None
+    return result
@@ -2,16 +2,72 @@
 # the path and the service entries in the database
 
 
-from typing import AsyncGenerator, Dict, NamedTuple
+import asyncio
+from collections import defaultdict
+import os
+from itertools import count
+import time
+from time import monotonic
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 from async_lru import alru_cache
+import httpx
 from httpx import AsyncClient
-from quart import Blueprint, Response, request
+from quart import Blueprint, Response, request, websocket
 from sqlalchemy import select
 from werkzeug.datastructures import Headers
-
+from wsproto.utilities import RemoteProtocolError
+
+from .admission import AdmissionRejected, get_admission
+from .assets import Asset, asset_headers, etag_matches, find_asset, read_asset
+from .cache import (
+    MAX_ENTRY_BYTES,
+    CachedResponse,
+    freshness_lifetime,
+    is_storable,
+    parse_cache_control,
+    response_cache,
+)
+from .coalescing import (
+    FlightResult,
+    can_coalesce,
+    coalescing_key,
+    is_shareable,
+    join_flight,
+)
+from .compression import (
+    compress_stream,
+    compressed_headers,
+    negotiate_encoding,
+    should_compress,
+)
+from .hosts import upstream_address
 from .models.project_config import ProjectConfig
 from .models.service_entry import ServiceEntry
-from .utils import AsyncSessionLocal, debug
+from .tunnels import (
+    Tunnel,
+    TunnelRejected,
+    UpstreamWebSocket,
+    close_tunnels,
+    open_tunnels,
+)
+from .upstream import (
+    IDEMPOTENT_METHODS,
+    TimeoutPolicy,
+    breaker_retry_after,
+    get_breaker,
+    retry_budget,
+)
+from .utils import AsyncSessionLocal, debug, warning
 from urllib.parse import urlunsplit
 
 
@@ -24,11 +80,49 @@ class Components(NamedTuple):
     fragment: str
 
 
+class ProxyTarget(NamedTuple):
+    project: ProjectConfig
+    service_entries: List[ServiceEntry]
+
+
+# Bytes are sent with a Content-Length, iterators with the client's or chunked if it sent none
+RequestBody = bytes | AsyncIterator[bytes]
+
+
+class UpstreamResponse(NamedTuple):
+    response: httpx.Response
+    upstream: str
+
+
 _client = AsyncClient(
-    timeout=None,  # Disable timeouts for long-lived connections,
+    timeout=None,  # Timeouts are set per request from the app's TimeoutPolicy
     follow_redirects=True,
+    # Response bodies are passed through undecoded, so never ask upstreams for an encoding
+    # the client did not ask for. The client's own Accept-Encoding replaces this.
+    headers={"Accept-Encoding": "identity"},
 )
 
+# Size of the chunks response bodies are re-chunked into, by default chunks are forwarded as received
+PROXY_CHUNK_SIZE = int(os.getenv("FATS_PROXY_CHUNK_SIZE", "0")) or None
+
+# Request bodies up to this size are read whole and sent with a Content-Length, larger ones are streamed
+PROXY_BUFFER_BYTES = int(os.getenv("FATS_PROXY_BUFFER_KB", "64")) * 1024
+
+# Largest response fats reads whole when it makes requests of its own to an app
+MAX_APP_RESPONSE_BYTES = 16 * 1024 * 1024
+
+# Used to round-robin requests across an app's replicas
+_replica_counter = count()
+
+# Requests currently being proxied to each upstream (address:port)
+_upstream_in_flight: Dict[str, int] = defaultdict(int)
+
+# Upstreams being drained before removal, these receive no new requests
+_draining_upstreams: set[str] = set()
+
+# Releases of upstreams whose responses were dropped unread, kept until they are done
+_pending_releases: set[asyncio.Task[None]] = set()
+
 proxy_blueprint = Blueprint("proxy", __name__)
 
 # These are not to be forwarded by the proxy
@@ -43,9 +137,21 @@ HOP_BY_HOP_HEADERS = {
     "upgrade",
 }
 
+# Set up again by the upstream's own WebSocket handshake, or added by Quart
+WEBSOCKET_HANDSHAKE_HEADERS = {
+    "host",
+    "content-length",
+    "remote-addr",
+    "sec-websocket-key",
+    "sec-websocket-version",
+    "sec-websocket-extensions",
+    "sec-websocket-protocol",
+    "sec-websocket-accept",
+}
+
 
 @alru_cache(ttl=300)
-async def get_target_from_app_name(app_name: str) -> None | ServiceEntry:
+async def get_target_from_app_name(app_name: str) -> None | ProxyTarget:
     # Parse the app_name to extract project name and optional version
     if ":" in app_name:
         name, version = app_name.split(":", 1)
@@ -76,18 +182,74 @@ async def get_target_from_app_name(app_name: str) -> None | ServiceEntry:
         if target is None:
             return None
 
-        # Now, find a service entry for this project config
+        # Now, find the service entries (replicas) for this project config
 
         q = select(ServiceEntry).where(ServiceEntry.project_config_id == target.id)
-        service_entry = (await session.execute(q)).scalars().first()
-        if service_entry is None:
+        service_entries = list((await session.execute(q)).scalars().all())
+        if not service_entries:
             return None
 
-        return service_entry
+        return ProxyTarget(project=target, service_entries=service_entries)
+
+
+def upstream_key(service_entry: ServiceEntry) -> str:
+    address = upstream_address(service_entry.docker_host, service_entry.hostname)
+    return address + ":" + str(service_entry.port)
+
+
+def order_replicas(service_entries: List[ServiceEntry]) -> List[ServiceEntry]:
+    """Rotate the replicas so consecutive requests start at a different one, skipping draining ones."""
+    available = [
+        e for e in service_entries if upstream_key(e) not in _draining_upstreams
+    ]
+    if not available:
+        return []
+    offset = next(_replica_counter) % len(available)
+    return available[offset:] + available[:offset]
+
+
+def invalidate_routes():
+    """Forget cached app name -> service entry lookups, e.g. after replicas were added or removed."""
+    get_target_from_app_name.cache_clear()
+
+
+async def warm_routes() -> int:
+    """Resolve every app name and name:version up front so the first requests don't hit the database."""
+    async with AsyncSessionLocal() as session:
+        projects = (await session.execute(select(ProjectConfig))).scalars().all()
+
+    app_names = {p.name for p in projects} | {f"{p.name}:{p.version}" for p in projects}
+    async with asyncio.TaskGroup() as tg:
+        for app_name in app_names:
+            tg.create_task(get_target_from_app_name(app_name))
+    return len(app_names)
+
+
+def begin_drain(service_entry: ServiceEntry):
+    _draining_upstreams.add(upstream_key(service_entry))
+
+
+def end_drain(service_entry: ServiceEntry):
+    key = upstream_key(service_entry)
+    _draining_upstreams.discard(key)
+    _upstream_in_flight.pop(key, None)
+
+
+def upstream_in_flight(service_entry: ServiceEntry) -> int:
+    return _upstream_in_flight.get(upstream_key(service_entry), 0)
+
+
+def upstream_tunnels(service_entry: ServiceEntry) -> int:
+    return open_tunnels(upstream_key(service_entry))
+
+
+def close_upstream_tunnels(service_entry: ServiceEntry) -> int:
+    """Ask the clients of every tunnel to a replica to reconnect, e.g. before it is removed."""
+    return close_tunnels(upstream_key(service_entry))
 
 
 def construct_target_url(service_entry: ServiceEntry, path: str, query: str) -> str:
-    netloc = service_entry.hostname + ":" + str(service_entry.port)
+    netloc = upstream_key(service_entry)
     components = Components(
         scheme="http",
         netloc=netloc,
@@ -107,6 +269,76 @@ def prepare_headers_for_proxy(original_headers_wz: Headers) -> Dict[str, str]:
     return headers
 
 
+async def _send_to_replicas(
+    target: ProxyTarget,
+    path: str,
+    headers: Dict[str, str],
+    body_factory: Callable[[], RequestBody],
+    method: Optional[str] = None,
+    query: Optional[str] = None,
+) -> UpstreamResponse | Response:
+    """
+    Send the current request, or another one given its method and query, to one of the target's
+    replicas, applying the app's timeout policy.
+
+    Connection failures on idempotent requests are retried against the next replica while the
+    retry budget allows it. Replicas with an open circuit breaker are skipped. Returns an error
+    Response if no replica could be reached.
+    """
+    method = method or request.method
+    if query is None:
+        query = request.query_string.decode()
+    policy = TimeoutPolicy.from_project(target.project)
+    retry_budget.deposit()
+    replicas = order_replicas(target.service_entries)
+    can_retry = method in IDEMPOTENT_METHODS
+
+    for attempt, service_entry in enumerate(replicas):
+        breaker = get_breaker(upstream_key(service_entry))
+        if not breaker.allow_request():
+            continue
+
+        target_url = construct_target_url(service_entry, path, query)
+        debug("%s -> %s (attempt %d)", path, target_url, attempt + 1)
+
+        downstream_req = _client.build_request(
+            method=method,
+            url=target_url,
+            headers=headers,
+            content=body_factory(),
+            timeout=policy.as_httpx_timeout(),
+        )
+        try:
+            downstream_resp = await _client.send(downstream_req, stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            breaker.record_failure()
+            warning(f"Failed to connect to {target_url}: {e!r}")
+            if can_retry and retry_budget.try_withdraw():
+                continue
+            return Response("Bad gateway", status=502)
+        except httpx.TimeoutException:
+            breaker.record_failure()
+            warning(f"Timed out waiting for a response from {target_url}")
+            return Response("Gateway timeout", status=504)
+        except httpx.TransportError as e:
+            breaker.record_failure()
+            warning(f"Error proxying to {target_url}: {e!r}")
+            return Response("Bad gateway", status=502)
+
+        breaker.record_success()
+        policy.use_idle_read_timeout(downstream_resp)
+        upstream = upstream_key(service_entry)
+        _upstream_in_flight[upstream] += 1
+        return UpstreamResponse(downstream_resp, upstream)
+
+    retry_after = breaker_retry_after([upstream_key(e) for e in replicas]) or 1
+    return Response(
+        "Application is unavailable",
+        status=503,
+        headers={"Retry-After": str(max(1, round(retry_after)))},
+    )
+
+
 @proxy_blueprint.route(
     "/<string:app>",
     methods=["GET", "POST", "PUT", "DELETE", "PATCH"],
@@ -124,13 +356,15 @@ async def proxy_request(app: str, path: str):
     # Let's find and proxy to an appropriate service entry based on the path
     # The <app> will look like either /{project.name}/... or /{project.name}:{project.version}/...
 
-    service_entry = await get_target_from_app_name(app)
-    if service_entry is None:
+    target = await get_target_from_app_name(app)
+    if target is None:
         return "Application not found", 404
 
-    target_url = construct_target_url(
-        service_entry, path, request.query_string.decode()
-    )
+    if request.method in ("GET", "HEAD"):
+        asset = await find_asset(target.project, path)
+        if asset is not None:
+            return _respond_with_asset(target, asset, path)
+
     headers = prepare_headers_for_proxy(request.headers)
 
     upstream_ip, remote_addr = (
@@ -141,21 +375,199 @@ async def proxy_request(app: str, path: str):
     headers["X-Forwarded-For"] = upstream_ip or remote_addr or ""
     headers["X-Forwarded-Proto"] = upstream_proto or request.scheme
 
-    debug("/%s/%s -> %s", app, path, target_url)
     debug("Headers: %s", headers)
 
-    async def _stream_request_body():
-        async for chunk in request.body:
-            yield chunk
+    query = request.query_string.decode()
+    cached = None
+    revalidating = False
+    if request.method == "GET":
+        cached = await response_cache.lookup(
+            target.project, path, query, request.headers
+        )
+        if cached is not None and cached.is_fresh() and not _client_wants_revalidation():
+            response_cache.hits += 1
+            return _respond_from_cache(target, cached, "HIT")
+        if cached is None:
+            response_cache.misses += 1
+        elif cached.has_validators and not _client_sent_conditionals():
+            # Ask the app whether our stale copy is still good
+            revalidating = True
+            if etag := cached.header("etag"):
+                headers["If-None-Match"] = etag
+            if last_modified := cached.header("last-modified"):
+                headers["If-Modified-Since"] = last_modified
+
+    if (
+        not revalidating
+        and target.project.coalesce_requests
+        and can_coalesce(request.method, request.headers)
+    ):
+        coalesced = await _proxy_coalesced(target, path, query, headers)
+        if coalesced is not None:
+            return coalesced
+
+    body_factory = await _request_body_factory()
+    opened = await _open_upstream(target, path, headers, body_factory)
+    if isinstance(opened, Response):
+        return opened
+
+    if revalidating and cached is not None and opened.status == 304:
+        # Our stale copy is still good, refresh it and serve it
+        await opened.finish()
+        response_cache.revalidations += 1
+        refreshed = cached.refreshed(opened.headers, 0)
+        refreshed.lifetime = _cache_lifetime(dict(refreshed.headers)) or 0
+        await response_cache.store(
+            target.project, path, query, request.headers, refreshed
+        )
+        return _respond_from_cache(target, refreshed, "REVALIDATED")
+
+    body = _maybe_cache(
+        opened.body(),
+        target,
+        path,
+        query,
+        request.method,
+        dict(request.headers),
+        opened.status,
+        opened.headers,
+    )
+    return _finalize_response(target, opened.status, opened.headers, body)
+
+
+@proxy_blueprint.websocket("/<string:app>", defaults={"path": ""})
+@proxy_blueprint.websocket("/<string:app>/", defaults={"path": ""})
+@proxy_blueprint.websocket("/<string:app>/<path:path>")
+async def proxy_websocket(app: str, path: str):
+    """
+    Relay a WebSocket to one of the app's replicas. The upstream handshake happens before the client's
+    is accepted, so the client sees the upstream's subprotocol, or its response if it refused.
+    """
+    target = await get_target_from_app_name(app)
+    if target is None:
+        return "Application not found", 404
 
-    downstream_req = _client.build_request(
-        method=request.method,
-        url=target_url,
-        headers=headers,
-        content=_stream_request_body(),
+    headers = [
+        (key.lower().encode("latin1"), value.encode("latin1"))
+        for key, value in prepare_headers_for_proxy(websocket.headers).items()
+        if key.lower() not in WEBSOCKET_HANDSHAKE_HEADERS
+    ]
+    forwarded_for = websocket.headers.get("X-Forwarded-For") or websocket.remote_addr
+    forwarded_proto = websocket.headers.get("X-Forwarded-Proto") or (
+        "https" if websocket.scheme == "wss" else "http"
+    )
+    headers.append((b"x-forwarded-for", (forwarded_for or "").encode("latin1")))
+    headers.append((b"x-forwarded-proto", forwarded_proto.encode("latin1")))
+
+    query = websocket.query_string.decode()
+    request_target = "/" + path + ("?" + query if query else "")
+    app_name = f"{target.project.name}:{target.project.version}"
+    retry_budget.deposit()
+
+    replicas = order_replicas(target.service_entries)
+    for service_entry in replicas:
+        upstream = upstream_key(service_entry)
+        breaker = get_breaker(upstream)
+        if not breaker.allow_request():
+            continue
+
+        connection = None
+        try:
+            connection = await UpstreamWebSocket.connect(
+                upstream_address(service_entry.docker_host, service_entry.hostname),
+                service_entry.port,
+            )
+            subprotocol, accepted_headers = await connection.handshake(
+                upstream, request_target, websocket.requested_subprotocols, headers
+            )
+        except TunnelRejected as e:
+            breaker.record_success()
+            if connection is not None:
+                await connection.close()
+            return Response(
+                e.body,
+                status=e.status,
+                headers=_decode_headers(e.headers),
+            )
+        except (OSError, asyncio.TimeoutError, RemoteProtocolError) as e:
+            breaker.record_failure()
+            warning(f"Failed to open a WebSocket to {upstream}: {e!r}")
+            if connection is not None:
+                await connection.close()
+            # Nothing was sent to the client yet, so another replica can take it
+            if retry_budget.try_withdraw():
+                continue
+            return Response("Bad gateway", status=502)
+
+        breaker.record_success()
+        await websocket.accept(
+            headers=_decode_headers(accepted_headers), subprotocol=subprotocol
+        )
+        await Tunnel(app_name, upstream).relay(
+            websocket._get_current_object(), connection
+        )
+        return None
+
+    retry_after = breaker_retry_after([upstream_key(e) for e in replicas]) or 1
+    return Response(
+        "Application is unavailable",
+        status=503,
+        headers={"Retry-After": str(max(1, round(retry_after)))},
     )
 
-    downstream_resp = await _client.send(downstream_req, stream=True)
+
+def _decode_headers(headers: List[Tuple[bytes, bytes]]) -> Headers:
+    decoded = Headers()
+    for key, value in headers:
+        name = key.decode("latin1")
+        if (
+            name.lower() not in HOP_BY_HOP_HEADERS
+            and name.lower() not in WEBSOCKET_HANDSHAKE_HEADERS
+        ):
+            decoded.add(name, value.decode("latin1"))
+    return decoded
+
+
+class OpenedUpstream(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: Callable[[], AsyncGenerator[bytes, None]]
+    """Streams the body, releasing the upstream once it ends"""
+    finish: Callable[[], Awaitable[None]]
+    """Releases the upstream without reading the body"""
+
+
+async def _open_upstream(
+    target: ProxyTarget,
+    path: str,
+    headers: Dict[str, str],
+    body_factory: Callable[[], RequestBody],
+    method: Optional[str] = None,
+    query: Optional[str] = None,
+) -> OpenedUpstream | Response:
+    """Send a request to the app under its admission limits, returning once the response headers arrive."""
+    admission = get_admission(target.project)
+    try:
+        await admission.acquire()
+    except AdmissionRejected as e:
+        return Response(
+            e.reason, status=e.status, headers={"Retry-After": e.retry_after_header}
+        )
+
+    started = monotonic()
+    try:
+        upstream_resp = await _send_to_replicas(
+            target, path, headers, body_factory, method, query
+        )
+    except BaseException:
+        admission.release()
+        raise
+    if isinstance(upstream_resp, Response):
+        # We could not reach any replica
+        admission.release()
+        return upstream_resp
+    admission.record_latency(monotonic() - started)
+    downstream_resp, upstream = upstream_resp
 
     downstream_headers = {
         key: value
@@ -163,16 +575,299 @@ async def proxy_request(app: str, path: str):
         if key.lower() not in HOP_BY_HOP_HEADERS
     }
 
+    released = False
+
+    async def _finish_upstream():
+        nonlocal released
+        if released:
+            return
+        released = True
+        if opener is not None:
+            opener.remove_done_callback(_release_if_unread)
+        _upstream_in_flight[upstream] -= 1
+        admission.release()
+        await downstream_resp.aclose()
+
+    def _release_if_unread(_: asyncio.Task):
+        # The body is normally streamed by the task that opened it, but Quart drops the response
+        # without starting the body if the client went away first, so nothing else would release it
+        if not released:
+            task = asyncio.ensure_future(_finish_upstream())
+            _pending_releases.add(task)
+            task.add_done_callback(_pending_releases.discard)
+
+    opener = asyncio.current_task()
+    if opener is not None:
+        opener.add_done_callback(_release_if_unread)
+
     async def _stream_response_body() -> AsyncGenerator[bytes, None]:
-        async for chunk in downstream_resp.aiter_bytes():
+        try:
+            # Raw bytes, so compressed bodies are forwarded as-is with their Content-Encoding
+            async for chunk in downstream_resp.aiter_raw(PROXY_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await _finish_upstream()
+
+    return OpenedUpstream(
+        downstream_resp.status_code,
+        downstream_headers,
+        _stream_response_body,
+        _finish_upstream,
+    )
+
+
+def _no_body() -> bytes:
+    return b""
+
+
+async def _request_body_factory() -> Callable[[], RequestBody]:
+    """
+    How to send the current request's body upstream. Small bodies are read whole, so they go out in
+    one piece with a Content-Length and can be sent again to another replica. Larger ones are streamed
+    with the client's Content-Length, or chunked if the client sent them chunked.
+    """
+    content_length = request.content_length
+    chunked = "chunked" in request.headers.get("Transfer-Encoding", "").lower()
+
+    async def _stream(prefix: bytes = b"") -> AsyncGenerator[bytes, None]:
+        if prefix:
+            yield prefix
+        async for chunk in request.body:
             yield chunk
-        await downstream_resp.aclose()
 
-    return Response(
-        _stream_response_body(),
-        status=downstream_resp.status_code,
-        headers=downstream_headers,
+    if chunked or (content_length is not None and content_length > PROXY_BUFFER_BYTES):
+        return _stream
+
+    # Bodies without a length are empty over HTTP/1, over HTTP/2 we only find out by reading them
+    buffered = bytearray()
+    async for chunk in request.body:
+        buffered += chunk
+        if len(buffered) > PROXY_BUFFER_BYTES:
+            # Too large after all, the rest is streamed after what was read so far
+            prefix = bytes(buffered)
+            return lambda: _stream(prefix)
+    body = bytes(buffered)
+    return lambda: body
+
+
+class AppResponse(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+async def request_app(
+    target: ProxyTarget,
+    method: str,
+    path: str,
+    headers: Dict[str, str],
+    body: bytes = b"",
+    query: str = "",
+) -> AppResponse | Response:
+    """
+    Make a request of fats' own to an app, with the same admission, retries and pooled connections
+    as proxied requests, and read the whole response. Returns an error Response if the app could not
+    be reached or its response is too large.
+    """
+    # Content-Length is set for our own body, and the response is read here so it has to arrive unencoded
+    headers = {
+        key: value
+        for key, value in headers.items()
+        if key.lower() not in ("content-length", "accept-encoding")
+    }
+    opened = await _open_upstream(
+        target, path.lstrip("/"), headers, lambda: body, method, query
+    )
+    if isinstance(opened, Response):
+        return opened
+
+    received = bytearray()
+    chunks = opened.body()
+    try:
+        async for chunk in chunks:
+            received += chunk
+            if len(received) > MAX_APP_RESPONSE_BYTES:
+                return Response("Application response is too large", status=502)
+    finally:
+        await chunks.aclose()
+    return AppResponse(opened.status, opened.headers, bytes(received))
+
+
+async def _proxy_coalesced(
+    target: ProxyTarget, path: str, query: str, headers: Dict[str, str]
+) -> Optional[Response]:
+    """
+    Share one upstream request between identical concurrent GETs.
+    Returns None if the response turned out to be private, the caller then sends its own request.
+    """
+    key = coalescing_key(target.project, path, query, request.headers)
+    flight, subscriber, leader = join_flight(key)
+    if leader:
+        request_headers = dict(request.headers)
+
+        async def _fetch() -> FlightResult:
+            opened = await _open_upstream(target, path, headers, _no_body)
+            if isinstance(opened, Response):
+                error_body = await opened.get_data()
+
+                async def _error_body() -> AsyncGenerator[bytes, None]:
+                    yield error_body
+
+                return opened.status_code, dict(opened.headers), _error_body()
+            body = _maybe_cache(
+                opened.body(),
+                target,
+                path,
+                query,
+                "GET",
+                request_headers,
+                opened.status,
+                opened.headers,
+            )
+            return opened.status, opened.headers, body
+
+        flight.start(_fetch)
+
+    try:
+        await flight.ready.wait()
+        flight.raise_for_error()
+    except BaseException:
+        await flight.unsubscribe(subscriber)
+        raise
+    if not leader and not is_shareable(flight.headers):
+        await flight.unsubscribe(subscriber)
+        return None
+
+    assert flight.status is not None
+    return _finalize_response(
+        target, flight.status, dict(flight.headers), flight.stream(subscriber)
+    )
+
+
+def _client_wants_revalidation() -> bool:
+    cache_control = parse_cache_control(request.headers.get("Cache-Control"))
+    return "no-cache" in cache_control or cache_control.get("max-age") == "0"
+
+
+def _client_sent_conditionals() -> bool:
+    return (
+        "If-None-Match" in request.headers or "If-Modified-Since" in request.headers
+    )
+
+
+def _cache_lifetime(headers: Dict[str, str]) -> Optional[float]:
+    """Freshness lifetime of a response, less however long it already spent in upstream caches."""
+    lifetime = freshness_lifetime(headers)
+    if lifetime is None:
+        return None
+    age = next((v for k, v in headers.items() if k.lower() == "age"), "0")
+    return max(0, lifetime - (int(age) if age.isdigit() else 0))
+
+
+def _maybe_cache(
+    body: AsyncGenerator[bytes, None],
+    target: ProxyTarget,
+    path: str,
+    query: str,
+    method: str,
+    request_headers: Dict[str, str],
+    status: int,
+    headers: Dict[str, str],
+) -> AsyncGenerator[bytes, None]:
+    if not is_storable(method, status, request_headers, headers):
+        return body
+    return _cache_while_streaming(
+        body, target, path, query, request_headers, status, headers
+    )
+
+
+async def _cache_while_streaming(
+    chunks: AsyncGenerator[bytes, None],
+    target: ProxyTarget,
+    path: str,
+    query: str,
+    request_headers: Dict[str, str],
+    status: int,
+    headers: Dict[str, str],
+) -> AsyncGenerator[bytes, None]:
+    """Pass a response body through, storing it in the cache once it was received completely."""
+    # This runs after the handler returned, outside of the request context
+    buffered = bytearray()
+    too_large = False
+    try:
+        async for chunk in chunks:
+            if not too_large:
+                if len(buffered) + len(chunk) > MAX_ENTRY_BYTES:
+                    too_large = True
+                    buffered = bytearray()
+                else:
+                    buffered += chunk
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+    lifetime = _cache_lifetime(headers)
+    if too_large or lifetime is None:
+        return
+    entry = CachedResponse(
+        status=status,
+        headers=list(headers.items()),
+        body=bytes(buffered),
+        stored_at=time.time(),
+        lifetime=lifetime,
     )
+    await response_cache.store(target.project, path, query, request_headers, entry)
+
+
+def _respond_with_asset(target: ProxyTarget, asset: Asset, path: str) -> Response:
+    headers = asset_headers(asset, path)
+    if etag_matches(request.headers.get("If-None-Match"), asset.etag):
+        del headers["Content-Length"]
+        return Response(b"", status=304, headers=headers)
+    # Hypercorn has no zero-copy send, so the file is streamed in large chunks off a thread
+    return _finalize_response(target, 200, headers, read_asset(asset))
+
+
+def _respond_from_cache(
+    target: ProxyTarget, cached: CachedResponse, cache_status: str
+) -> Response:
+    headers = dict(cached.headers)
+    headers["Age"] = str(cached.age())
+    headers["X-Fats-Cache"] = cache_status
+
+    etag = cached.header("etag")
+    if_none_match = request.headers.get("If-None-Match")
+    if etag is not None and if_none_match is not None:
+        if if_none_match.strip() == "*" or etag in (
+            tag.strip() for tag in if_none_match.split(",")
+        ):
+            headers.pop("Content-Length", None)
+            headers.pop("content-length", None)
+            return Response(b"", status=304, headers=headers)
+
+    async def _body() -> AsyncGenerator[bytes, None]:
+        yield cached.body
+
+    return _finalize_response(target, cached.status, headers, _body())
+
+
+def _finalize_response(
+    target: ProxyTarget,
+    status: int,
+    headers: Dict[str, str],
+    body: AsyncGenerator[bytes, None],
+) -> Response:
+    """Build the response to the client, applying edge compression if appropriate."""
+    encoding = None
+    if target.project.edge_compression and should_compress(
+        request.method, status, headers
+    ):
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is not None:
+        headers = compressed_headers(headers, encoding)
+        body = compress_stream(body, encoding)
+
+    return Response(body, status=status, headers=headers)
 
 
 @proxy_blueprint.after_app_serving
@@ -2,48 +2,201 @@
 # Ensure they are running and given a PORT
 # Record them in a service entry in the db
 
-from asyncio import Task, TaskGroup
+from asyncio import Lock, Task, TaskGroup, create_subprocess_exec, gather
+from asyncio.subprocess import DEVNULL
+from collections import Counter, defaultdict
+import json
+import os
 import re
-from typing import List
+from time import monotonic
+from typing import Any, Dict, List, Literal, NamedTuple, Optional
 from sqlalchemy import select
 from random import randint
 
+from fats.hosts import LOCAL_HOST, docker_args, place_replicas, publish_address
 from fats.network import create_or_get_fats_network
+from fats.proxy import close_upstream_tunnels, invalidate_routes
 from fats.models.project_config import ProjectConfig
 from fats.models.service_entry import ServiceEntry
 from fats.models.service_number import get_service_number
 from fats.secrets import get_secret
 from fats.utils import AsyncSessionLocal, log, run
 
+ReconcileOutcome = Literal["reused", "restarted", "destroyed"]
 
-async def does_container_exist(container_name: str) -> bool:
-    does_container_exist_proc = await run(
+# Outcome of the most recent reconciliation, e.g. how long recovering after a reboot took
+last_reconcile: Dict[str, Any] = {}
+
+_image_transfer_locks: Dict[tuple[str, str], Lock] = {}
+
+# Ports published on remote engines are picked at random, another one is tried if the engine has it taken
+PUBLISH_ATTEMPTS = 5
+_PORT_TAKEN_REGEX = re.compile(
+    r"port is already allocated|address already in use", re.IGNORECASE
+)
+
+
+class ContainerState(NamedTuple):
+    id: str
+    running: bool
+    image_id: str
+    env: Dict[str, str]
+
+
+async def inspect_containers(
+    container_ids: List[str], docker_host: str = LOCAL_HOST
+) -> Dict[str, ContainerState]:
+    """
+    Look up containers by id, running or stopped, in a single docker call.
+    Containers that no longer exist are missing from the result.
+    """
+    if not container_ids:
+        return {}
+    proc = await run(
+        "docker", *docker_args(docker_host), "container", "inspect", *container_ids
+    )
+    assert proc.stdout is not None, "Failed to get container inspect output"
+    # Read before waiting, the output of many containers does not fit in the pipe buffer
+    output = await proc.stdout.read()
+    await proc.wait()
+    # docker exits non-zero if any container is missing, but still prints the ones it found
+    try:
+        inspected = json.loads(output or b"[]")
+    except ValueError:
+        return {}
+
+    states: Dict[str, ContainerState] = {}
+    for container in inspected:
+        env = dict(
+            item.split("=", 1) for item in container["Config"]["Env"] or [] if "=" in item
+        )
+        state = ContainerState(
+            id=container["Id"],
+            running=container["State"]["Running"],
+            image_id=container["Image"],
+            env=env,
+        )
+        # Entries may hold the full or the short id
+        for container_id in container_ids:
+            if state.id.startswith(container_id):
+                states[container_id] = state
+    return states
+
+
+async def get_image_id(tag: str, docker_host: str = LOCAL_HOST) -> Optional[str]:
+    proc = await run(
         "docker",
-        "ps",
-        "-q",
-        "-f",
-        f"name={container_name}",
+        *docker_args(docker_host),
+        "image",
+        "inspect",
+        "--format",
+        "{{.Id}}",
+        tag,
     )
-    await does_container_exist_proc.wait()
-    assert (
-        does_container_exist_proc.returncode == 0
-    ), "Failed to check if container exists"
-    assert (
-        does_container_exist_proc.stdout is not None
-    ), "Failed to get container existence output"
-    container_exists = (
-        await does_container_exist_proc.stdout.read()
-    ).decode().strip() != ""
+    assert proc.stdout is not None, "Failed to get image inspect output"
+    output = (await proc.stdout.read()).decode().strip()
+    await proc.wait()
+    return output if proc.returncode == 0 and output else None
 
-    return container_exists
 
+async def ensure_image_on_host(tag: str, docker_host: str):
+    """
+    Images are built on the local engine. Copy one to a remote engine with docker save | docker load
+    unless the engine already has the same image id.
+    """
+    if docker_host == LOCAL_HOST:
+        return
+    lock = _image_transfer_locks.setdefault((tag, docker_host), Lock())
+    async with lock:
+        local_id = await get_image_id(tag)
+        assert local_id is not None, f"Image {tag} does not exist locally"
+        if await get_image_id(tag, docker_host) == local_id:
+            return
+
+        started = monotonic()
+        # The two processes are joined by an OS pipe, the image never passes through fats
+        read_fd, write_fd = os.pipe()
+        try:
+            save = await create_subprocess_exec(
+                "docker", "save", tag, stdout=write_fd, stderr=DEVNULL
+            )
+            load = await create_subprocess_exec(
+                "docker",
+                *docker_args(docker_host),
+                "load",
+                stdin=read_fd,
+                stdout=DEVNULL,
+                stderr=DEVNULL,
+            )
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+        save_code, load_code = await gather(save.wait(), load.wait())
+        assert (
+            save_code == 0 and load_code == 0
+        ), f"Failed to copy image {tag} to docker host {docker_host}"
+        log(
+            f"Copied image {tag} to docker host {docker_host} in {monotonic() - started:.1f}s"
+        )
+
+
+async def resolve_app_env(app: ProjectConfig) -> Dict[str, str]:
+    """The secrets an app asked for, as they would be passed to a new container."""
+    env: Dict[str, str] = {}
+    if not app.desired_secrets:
+        return env
+
+    secrets: dict[str, Task[str | None]] = {}
+    async with TaskGroup() as tg:
+        for secret_name in app.desired_secrets:
+            secrets[secret_name] = tg.create_task(get_secret(secret_name))
 
-async def homogenize_or_destroy_service_entry(entry: ServiceEntry) -> bool:
+    for secret_name, secret_task in secrets.items():
+        secret_value = secret_task.result()
+        if secret_value is None:
+            log(
+                f"Warning: Secret '{secret_name}' requested by app '{app.name}:{app.version}' but not found."
+            )
+            continue
+        env[secret_name] = secret_value
+    return env
+
+
+def container_matches(
+    container: ContainerState,
+    entry: ServiceEntry,
+    app: ProjectConfig,
+    image_id: Optional[str],
+    secret_env: Dict[str, str],
+) -> bool:
+    """Whether an existing container still runs the app's current image and config."""
+    if image_id is None or container.image_id != image_id:
+        return False
+    expected = {
+        "FATS_PROJECT_CONFIG_ID": str(app.id),
+        "PORT": str(entry.port),
+        **secret_env,
+    }
+    if any(container.env.get(key) != value for key, value in expected.items()):
+        return False
+    # A secret the app no longer asks for should not linger in its environment
+    return not any(
+        key in container.env and key not in secret_env
+        for key in (app.desired_secrets or [])
+    )
+
+
+async def homogenize_or_destroy_service_entry(
+    entry: ServiceEntry,
+    container: Optional[ContainerState],
+    image_id: Optional[str],
+) -> ReconcileOutcome:
     """
     Given a service entry that is orphaned (i.e., from a different service number),
     either homogenize it to match the current desired state or destroy it if it's no longer needed.
+    Stopped containers that still match their app's image and config are started again.
 
-    Returns True if we were able to homogenize and its corresponding project can be considered running, false if not.
+    Returns how the entry was reconciled, only destroyed entries need their project's container recreated.
     """
     current_service_number = await get_service_number()
 
@@ -53,37 +206,56 @@ async def homogenize_or_destroy_service_entry(entry: ServiceEntry) -> bool:
         project = await session.get(ProjectConfig, entry.project_config_id)
 
         if tracked_entry is None:
-            return False
+            return "destroyed"
+
+        reason = None
+        if project is None:
+            reason = "its project no longer exists"
+        elif container is None:
+            reason = "its container is gone"
+        elif not container_matches(
+            container, entry, project, image_id, await resolve_app_env(project)
+        ):
+            reason = "its image or config changed"
+        elif not container.running:
+            proc = await run(
+                "docker", *docker_args(entry.docker_host), "start", entry.container_id
+            )
+            await proc.wait()
+            if proc.returncode != 0:
+                reason = "its container failed to start"
 
-        # If the project no longer exists or a container with this hostname does not exist, drop the container and delete the entry
-        if project is None or not await does_container_exist(entry.hostname):
+        # Drop the container and delete the entry, a fresh container is created if still needed
+        if reason is not None:
             log(
-                f"Destroying service entry {entry.id} for project config {entry.project_config_id} as it is no longer valid."
+                f"Destroying service entry {entry.id} for project config {entry.project_config_id} as {reason}."
+            )
+            # Tell clients with open tunnels to reconnect rather than cutting them off
+            close_upstream_tunnels(entry)
+            proc = await run(
+                "docker", *docker_args(entry.docker_host), "rm", "-f", entry.container_id
             )
-            proc = await run("docker", "rm", "-f", entry.container_id)
             await proc.wait()
             await session.delete(tracked_entry)
             await session.commit()
-            return False
+            return "destroyed"
 
+        assert container is not None
         # Otherwise, we can homogenize. Just update the service number
         tracked_entry.service_number = current_service_number
         await session.commit()
         log(
             f"Homogenized service entry {entry.id} for project config {entry.project_config_id} to service number {current_service_number}."
         )
-        return True
+        return "reused" if container.running else "restarted"
 
 
 async def create_container_for_app(
-    app: ProjectConfig, service_number: int
+    app: ProjectConfig, service_number: int, docker_host: str = LOCAL_HOST
 ) -> ServiceEntry:
     # Use docker to create a container for the app
     # Record the container ID and port in a new ServiceEntry
 
-    # generate a random userspace port
-    port = randint(20000, 60000)
-
     name_version_sanitized = re.sub(r"[^a-zA-Z0-9-]+", "", app.name + app.version)
     salt = randint(1000, 9999)
 
@@ -91,46 +263,61 @@ async def create_container_for_app(
 
     # if requesting secrets, resolve them
     secret_env_args: list[str] = []
-    if app.desired_secrets and len(app.desired_secrets) > 0:
-        secrets: dict[str, Task[str | None]] = {}
-        async with TaskGroup() as tg:
-            for secret_name in app.desired_secrets:
-                secrets[secret_name] = tg.create_task(get_secret(secret_name))
-
-        for secret_name, secret_task in secrets.items():
-            secret_value = secret_task.result()
-            if secret_value is None:
-                log(
-                    f"Warning: Secret '{secret_name}' requested by app '{app.name}:{app.version}' but not found."
-                )
-                continue
-            secret_env_args.extend(["-e", f"{secret_name}={secret_value}"])
-
-    proc = await run(
-        "docker",
-        "run",
-        "-d",
-        "--name",
-        container_name,
-        "--network",
-        await create_or_get_fats_network(),
-        "-e",
-        f"FATS_SERVICE_NUMBER={service_number}",
-        "-e",
-        f"FATS_PROJECT_CONFIG_ID={app.id}",
-        "-e",
-        f"PORT={port}",
-        *secret_env_args,
-        f"{app.name}:{app.version}",
-    )
-
-    await proc.wait()
+    for secret_name, secret_value in (await resolve_app_env(app)).items():
+        secret_env_args.extend(["-e", f"{secret_name}={secret_value}"])
+
+    tag = f"{app.name}:{app.version}"
+    await ensure_image_on_host(tag, docker_host)
+
+    # Locally the proxy reaches containers on fats_network, on other engines through a port published
+    # on the address the proxy connects to, and nowhere else
+    remote = docker_host != LOCAL_HOST
+    bind_address = await publish_address(docker_host) if remote else None
+    network = await create_or_get_fats_network(docker_host)
+
+    for attempt in range(1, PUBLISH_ATTEMPTS + 1):
+        # generate a random userspace port
+        port = randint(20000, 60000)
+        publish_args = ["-p", f"{bind_address}:{port}:{port}"] if remote else []
+
+        proc = await run(
+            "docker",
+            *docker_args(docker_host),
+            "run",
+            "-d",
+            "--name",
+            container_name,
+            "--network",
+            network,
+            *publish_args,
+            "-e",
+            f"FATS_SERVICE_NUMBER={service_number}",
+            "-e",
+            f"FATS_PROJECT_CONFIG_ID={app.id}",
+            "-e",
+            f"PORT={port}",
+            *secret_env_args,
+            tag,
+        )
+        await proc.wait()
+        if proc.returncode == 0:
+            break
+
+        assert proc.stderr is not None, "Failed to get docker run errors"
+        error = (await proc.stderr.read()).decode().strip()
+        if not (remote and _PORT_TAKEN_REGEX.search(error)) or attempt == PUBLISH_ATTEMPTS:
+            raise RuntimeError(f"Failed to start container {container_name}: {error}")
+        # docker run leaves the container behind when it could not be started
+        cleanup = await run("docker", *docker_args(docker_host), "rm", "-f", container_name)
+        await cleanup.wait()
+        log(f"Port {port} is taken on docker host {docker_host}, trying another.")
 
-    assert proc.returncode == 0, "Failed to start container"
     assert proc.stdout is not None, "Failed to get container ID"
     container_id = (await proc.stdout.read()).decode().strip()
 
-    log(f"Started container {container_name} with ID {container_id} on port {port}")
+    log(
+        f"Started container {container_name} with ID {container_id} on port {port} of docker host {docker_host}"
+    )
 
     return ServiceEntry(
         service_number=service_number,
@@ -138,14 +325,78 @@ async def create_container_for_app(
         hostname=container_name,
         port=port,
         project_config_id=app.id,
+        docker_host=docker_host,
     )
 
 
+async def remove_service_entry(entry: ServiceEntry):
+    """Stop and remove a service entry's container, then delete the entry."""
+    proc = await run(
+        "docker", *docker_args(entry.docker_host), "rm", "-f", entry.container_id
+    )
+    await proc.wait()
+    async with AsyncSessionLocal() as session:
+        tracked_entry = await session.get(ServiceEntry, entry.id)
+        if tracked_entry is not None:
+            await session.delete(tracked_entry)
+            await session.commit()
+    invalidate_routes()
+    log(f"Removed service entry {entry.id} and container {entry.hostname}.")
+
+
+async def _reconcile_orphaned_entries(
+    entries: List[ServiceEntry], apps: Dict[int, ProjectConfig]
+) -> List[ReconcileOutcome]:
+    """Reconcile orphaned entries concurrently, inspecting all their containers and images up front."""
+    if not entries:
+        return []
+    by_host: Dict[str, List[str]] = defaultdict(list)
+    for entry in entries:
+        by_host[entry.docker_host].append(entry.container_id)
+    containers: Dict[str, ContainerState] = {}
+    async with TaskGroup() as tg:
+        inspect_tasks = [
+            tg.create_task(inspect_containers(container_ids, docker_host))
+            for docker_host, container_ids in by_host.items()
+        ]
+    for inspect_task in inspect_tasks:
+        containers.update(inspect_task.result())
+
+    # Images are built locally and copied as is, so image ids are the same on every engine
+
+    tags = {
+        f"{app.name}:{app.version}"
+        for entry in entries
+        if (app := apps.get(entry.project_config_id)) is not None
+    }
+    image_ids: Dict[str, Optional[str]] = {}
+    async with TaskGroup() as tg:
+        image_tasks = {tag: tg.create_task(get_image_id(tag)) for tag in tags}
+    for tag, image_task in image_tasks.items():
+        image_ids[tag] = image_task.result()
+
+    def _image_for(entry: ServiceEntry) -> Optional[str]:
+        app = apps.get(entry.project_config_id)
+        return image_ids.get(f"{app.name}:{app.version}") if app else None
+
+    async with TaskGroup() as tg:
+        tasks = [
+            tg.create_task(
+                homogenize_or_destroy_service_entry(
+                    entry, containers.get(entry.container_id), _image_for(entry)
+                )
+            )
+            for entry in entries
+        ]
+    return [task.result() for task in tasks]
+
+
 async def setup_application_containers():
     """
     Idempotently ensure that application containers are running for all desired apps
     Also ensure all service entries directly match a real, running container
     """
+    started = monotonic()
     # First, let's find any app containers that have service entries. We should check if they run from other versions of fats
     current_service_number = await get_service_number()
     async with AsyncSessionLocal() as session:
@@ -154,33 +405,50 @@ async def setup_application_containers():
 
         hm_desired_apps = {app.id: app for app in desired_apps}
 
+    # Count the running replicas of each app, and where they run
+    replica_counts: Counter[int] = Counter()
+    replica_hosts: Dict[int, List[str]] = defaultdict(list)
+    orphaned_entries: List[ServiceEntry] = []
     for entry in svc_entries:
         if entry.service_number != current_service_number:
             # This service entry is from a different fats execution and therefore orphaned
-            # We should see if we can homogenize it or destroy it
-            did_homogenize = await homogenize_or_destroy_service_entry(entry)
-            if did_homogenize:
-                # If we homogenized, we can consider this app as already running
-                del hm_desired_apps[entry.project_config_id]
+            orphaned_entries.append(entry)
             continue
 
-        # Otherwise, we should check if the service entry matches a desired app
-        # and check it off our list if its already present
+        replica_counts[entry.project_config_id] += 1
+        replica_hosts[entry.project_config_id].append(entry.docker_host)
+
+    # We should see if we can homogenize orphaned entries (e.g. after a reboot) or destroy them
+    outcomes = await _reconcile_orphaned_entries(orphaned_entries, hm_desired_apps)
+    for entry, outcome in zip(orphaned_entries, outcomes):
+        if outcome != "destroyed":
+            # If we homogenized, we can consider this replica as already running
+            replica_counts[entry.project_config_id] += 1
+            replica_hosts[entry.project_config_id].append(entry.docker_host)
 
-        if entry.project_config_id in hm_desired_apps:
-            del hm_desired_apps[entry.project_config_id]
+    # Every app should have at least its minimum number of replicas, the autoscaler manages the rest
+    missing_replicas = {
+        app_id: max(1, app.min_replicas) - replica_counts[app_id]
+        for app_id, app in hm_desired_apps.items()
+        if replica_counts[app_id] < max(1, app.min_replicas)
+    }
 
     log(
-        f"{len(hm_desired_apps)} applications need new containers out of {len(desired_apps)} desired applications."
+        f"{len(missing_replicas)} applications need new containers out of {len(desired_apps)} desired applications."
     )
 
     # Ok, for those that remain, let's create new containers and service entries
     async with TaskGroup() as tg:
         se_tasks: List[Task[ServiceEntry]] = []
-        for app in hm_desired_apps.values():
-            se_tasks.append(
-                tg.create_task(create_container_for_app(app, current_service_number))
-            )
+        for app_id, missing in missing_replicas.items():
+            for docker_host in await place_replicas(replica_hosts[app_id], missing):
+                se_tasks.append(
+                    tg.create_task(
+                        create_container_for_app(
+                            hm_desired_apps[app_id], current_service_number, docker_host
+                        )
+                    )
+                )
 
     # Now let's add all these to the db
     async with AsyncSessionLocal() as session:
@@ -189,5 +457,24 @@ async def setup_application_containers():
             session.add(service_entry)
         await session.commit()
 
+    if se_tasks or orphaned_entries:
+        invalidate_routes()
+
+    duration = monotonic() - started
+    outcome_counts = Counter(outcomes)
+    last_reconcile.update(
+        {
+            "seconds": duration,
+            "reused": outcome_counts["reused"],
+            "restarted": outcome_counts["restarted"],
+            "destroyed": outcome_counts["destroyed"],
+            "created": len(se_tasks),
+        }
+    )
+    log(
+        f"Reconciled containers in {duration * 1000:.0f} ms: {outcome_counts['reused']} reused, "
+        f"{outcome_counts['restarted']} restarted, {outcome_counts['destroyed']} destroyed, {len(se_tasks)} created."
+    )
+
     # All done!
     return
@@ -1,12 +1,24 @@
 import asyncio
-from dataclasses import dataclass
+import heapq
+import random
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Any, Callable, Coroutine
+from time import monotonic
+from typing import Any, Callable, Coroutine, Dict, Optional
 
 from .utils import log
 
 _schedules: list["Schedule"] = []
 
+# Min-heap of (deadline, sequence, generation, schedule). Entries whose generation no longer
+# matches their schedule's were superseded by a newer deadline and are skipped when popped.
+_heap: list[tuple[float, int, int, "Schedule"]] = []
+_sequence = 0
+# Set whenever the heap changes, created by start_scheduler on the running loop
+_wakeup: Optional[asyncio.Event] = None
+_running_tasks: set[asyncio.Task[Any]] = set()
+_started = False
+
 
 @dataclass
 class Schedule:
@@ -14,50 +26,150 @@ class Schedule:
     action: Callable[[], Coroutine[Any, Any, Any]]  # callable
     friendly_name: str = "Unnamed Schedule"
     last_run: datetime = datetime.min
+    jitter: float = 0.1
+    """Fraction of the interval by which each run may be randomly delayed, to spread out work"""
+
+    running: bool = field(default=False, init=False)
+    # Set when the schedule is asked to run while already running, it reruns once the current run ends
+    pending: bool = field(default=False, init=False)
+    runs: int = field(default=0, init=False)
+    last_duration: float = field(default=0.0, init=False)
+    max_duration: float = field(default=0.0, init=False)
+    total_duration: float = field(default=0.0, init=False)
+    _generation: int = field(default=0, init=False)
 
     def __post_init__(self):
         global _schedules
         _schedules.append(self)
+        if _started:
+            _push(self, self._initial_deadline())
+
+    def _initial_deadline(self) -> float:
+        if self.last_run == datetime.min:
+            return monotonic()
+        elapsed = (datetime.now() - self.last_run).total_seconds()
+        return monotonic() + max(0.0, self.interval.total_seconds() - elapsed)
+
+    def _next_deadline(self) -> float:
+        interval = self.interval.total_seconds()
+        return monotonic() + interval + random.uniform(0, interval * self.jitter)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "last_duration_seconds": self.last_duration,
+            "max_duration_seconds": self.max_duration,
+            "mean_duration_seconds": (
+                self.total_duration / self.runs if self.runs else None
+            ),
+        }
 
 
-async def _log_completion_of_task(task: asyncio.Task[Any], friendly_name: str):
+def _push(schedule: Schedule, deadline: float):
+    """Set a schedule's next deadline, superseding any earlier one, and wake the scheduler."""
+    global _sequence
+    schedule._generation += 1
+    _sequence += 1
+    heapq.heappush(_heap, (deadline, _sequence, schedule._generation, schedule))
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _run_schedule(schedule: Schedule):
+    started = monotonic()
     try:
-        await task
-        log(f"Scheduled action completed: {friendly_name}")
+        await schedule.action()
+        log(f"Scheduled action completed: {schedule.friendly_name}")
     except Exception as e:
-        log(f"Scheduled action {friendly_name} raised an exception: {e}")
+        log(f"Scheduled action {schedule.friendly_name} raised an exception: {e}")
+    finally:
+        duration = monotonic() - started
+        schedule.runs += 1
+        schedule.last_duration = duration
+        schedule.total_duration += duration
+        schedule.max_duration = max(schedule.max_duration, duration)
+        schedule.running = False
+
+        if schedule.pending:
+            # Requests that came in while we were running are coalesced into a single rerun
+            schedule.pending = False
+            _push(schedule, monotonic())
+        else:
+            _push(schedule, schedule._next_deadline())
+
+
+def _start_run(schedule: Schedule):
+    log(f"Running scheduled action: {schedule.friendly_name}")
+    schedule.running = True
+    schedule.last_run = datetime.now()
+    # The schedule is off the heap while it runs, it is pushed back when the run completes
+    schedule._generation += 1
+    task = asyncio.create_task(_run_schedule(schedule))
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
 
 
 async def _scheduler_thread():
     """
     When executed in a separate task, this will run scheduled actions at their specified intervals
     """
+    assert _wakeup is not None, "Scheduler was not started"
+    while True:
+        timeout: Optional[float] = None
+        while _heap:
+            deadline, _, generation, schedule = _heap[0]
+            if generation != schedule._generation:
+                heapq.heappop(_heap)
+                continue
+            timeout = deadline - monotonic()
+            if timeout > 0:
+                break
+            heapq.heappop(_heap)
+            _start_run(schedule)
+            timeout = None
 
-    async with asyncio.TaskGroup() as tg:
-        while True:
-            now = datetime.now()
-            for schedule in _schedules:
-                if now - schedule.last_run >= schedule.interval:
-                    log(f"Running scheduled action: {schedule.friendly_name}")
-                    task = tg.create_task(schedule.action())
-                    tg.create_task(
-                        _log_completion_of_task(task, schedule.friendly_name)
-                    )
-                    schedule.last_run = now
-
-            await asyncio.sleep(1)
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
 
 
 def start_scheduler():
     """
     Start the scheduler thread in the background
     """
+    global _started, _wakeup
     log("Starting scheduler...")
-    asyncio.create_task(_scheduler_thread())
+    _wakeup = asyncio.Event()
+    _started = True
+    for schedule in _schedules:
+        _push(schedule, schedule._initial_deadline())
+    task = asyncio.create_task(_scheduler_thread())
+    _running_tasks.add(task)
+
+
+def mark_schedule_executed(schedule: Schedule):
+    """
+    Record that a schedule's action was just run outside of the scheduler, e.g. during startup
+    """
+    schedule.last_run = datetime.now()
+    if _started and not schedule.running:
+        _push(schedule, schedule._next_deadline())
 
 
 def request_early_schedule_execution(schedule: Schedule):
     """
     Request that a schedule be executed as soon as possible
     """
+    if schedule.running:
+        schedule.pending = True
+        return
     schedule.last_run = datetime.min
+    if _started:
+        _push(schedule, monotonic())
+
+
+def schedule_stats() -> Dict[str, Dict[str, Any]]:
+    return {schedule.friendly_name: schedule.stats() for schedule in _schedules}
@@ -1,4 +1,7 @@
 from datetime import timedelta
+from .autoscaler import autoscale_applications
+from .cleanup import collect_garbage
+from .logs import sync_log_readers
 from .runner import setup_application_containers
 from .scheduler import Schedule
 
@@ -7,3 +10,21 @@ create_containers_schedule = Schedule(
     interval=timedelta(minutes=3),
     action=setup_application_containers,
 )
+
+autoscale_schedule = Schedule(
+    friendly_name="Autoscale Application Replicas",
+    interval=timedelta(seconds=15),
+    action=autoscale_applications,
+)
+
+collect_garbage_schedule = Schedule(
+    friendly_name="Collect Garbage",
+    interval=timedelta(minutes=30),
+    action=collect_garbage,
+)
+
+follow_logs_schedule = Schedule(
+    friendly_name="Follow Container Logs",
+    interval=timedelta(seconds=30),
+    action=sync_log_readers,
+)
@@ -0,0 +1,285 @@
+# Relay WebSocket connections between clients and app replicas
+# The client side is the websocket Quart hands us, the upstream side a plain TCP connection speaking
+# WebSocket through wsproto. One message at a time is in flight in each direction, so a slow reader
+# on either end stops us reading from the other.
+
+import asyncio
+import os
+from collections import defaultdict
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from quart import Websocket
+from quart.wrappers.websocket import Buffer
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import (
+    AcceptConnection,
+    BytesMessage,
+    CloseConnection,
+    Ping,
+    RejectConnection,
+    RejectData,
+    Request,
+    TextMessage,
+)
+from wsproto.utilities import LocalProtocolError, RemoteProtocolError
+
+from .utils import debug
+
+# Tunnels without a message in either direction for this long are closed
+TUNNEL_IDLE_TIMEOUT = float(os.getenv("FATS_TUNNEL_IDLE_SECONDS", "300"))
+
+# Messages received from a client before we stop reading from its connection
+TUNNEL_BUFFERED_MESSAGES = 4
+
+# Same limit hypercorn applies to messages from clients
+MAX_TUNNEL_MESSAGE_BYTES = 16 * 1024 * 1024
+
+TUNNEL_CONNECT_TIMEOUT = 10
+_READ_SIZE = 64 * 1024
+
+# Close codes from RFC 6455
+CLOSE_GOING_AWAY = 1001
+CLOSE_MESSAGE_TOO_BIG = 1009
+CLOSE_SERVICE_RESTART = 1012
+
+# Open tunnels by app name and by upstream (address:port)
+_app_tunnels: Dict[str, int] = defaultdict(int)
+_upstream_tunnels: Dict[str, set["Tunnel"]] = defaultdict(set)
+_tunnels_opened = 0
+_tunnels_idled_out = 0
+
+
+class BoundedBuffer(Buffer):
+    """Buffer for client messages that makes Quart stop reading from the client while it is full."""
+
+    def __init__(self) -> None:
+        self._queue = asyncio.Queue[bytes | str](maxsize=TUNNEL_BUFFERED_MESSAGES)
+
+
+class TunnelWebsocket(Websocket):
+    buffer_class = BoundedBuffer
+
+
+class TunnelRejected(Exception):
+    """The upstream answered the handshake with an HTTP response instead of accepting it."""
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        super().__init__(f"Upstream rejected the WebSocket with status {status}")
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class UpstreamWebSocket:
+    """The client end of a WebSocket connection to an app replica."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._connection = WSConnection(ConnectionType.CLIENT)
+        self._events = iter(())
+        self.close_code: Optional[int] = None
+        self.close_reason = ""
+
+    @classmethod
+    async def connect(cls, address: str, port: int) -> "UpstreamWebSocket":
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(address, port), TUNNEL_CONNECT_TIMEOUT
+        )
+        return cls(reader, writer)
+
+    async def _send(self, event) -> None:
+        self._writer.write(self._connection.send(event))
+        # Waits while the upstream is slow to read, which is what holds back the client
+        await self._writer.drain()
+
+    async def _next_event(self):
+        while True:
+            event = next(self._events, None)
+            if event is not None:
+                return event
+            data = await self._reader.read(_READ_SIZE)
+            self._connection.receive_data(data or None)
+            self._events = self._connection.events()
+            if not data:
+                event = next(self._events, None)
+                if event is None:
+                    raise ConnectionResetError("Upstream closed the connection")
+                return event
+
+    async def handshake(
+        self,
+        host: str,
+        target: str,
+        subprotocols: List[str],
+        headers: List[Tuple[bytes, bytes]],
+    ) -> Tuple[Optional[str], List[Tuple[bytes, bytes]]]:
+        """Open the WebSocket, returning the subprotocol and headers the upstream accepted it with."""
+        await self._send(
+            Request(
+                host=host,
+                target=target,
+                subprotocols=subprotocols,
+                extra_headers=headers,
+            )
+        )
+        event = await asyncio.wait_for(self._next_event(), TUNNEL_CONNECT_TIMEOUT)
+        if isinstance(event, AcceptConnection):
+            return event.subprotocol, list(event.extra_headers)
+        if isinstance(event, RejectConnection):
+            body = bytearray()
+            while event.has_body:
+                data = await asyncio.wait_for(self._next_event(), TUNNEL_CONNECT_TIMEOUT)
+                if not isinstance(data, RejectData):
+                    break
+                body += data.data
+                if data.body_finished:
+                    break
+            raise TunnelRejected(event.status_code, list(event.headers), bytes(body))
+        raise RemoteProtocolError(f"Unexpected handshake event {event!r}")
+
+    async def send(self, message: str | bytes) -> None:
+        if isinstance(message, str):
+            await self._send(TextMessage(data=message))
+        else:
+            await self._send(BytesMessage(data=message))
+
+    async def receive(self) -> Optional[str | bytes]:
+        """The next whole message, or None once the upstream closed the WebSocket."""
+        parts: List[str | bytes] = []
+        size = 0
+        while True:
+            event = await self._next_event()
+            if isinstance(event, (TextMessage, BytesMessage)):
+                parts.append(event.data)
+                size += len(event.data)
+                if size > MAX_TUNNEL_MESSAGE_BYTES:
+                    self.close_code, self.close_reason = CLOSE_MESSAGE_TOO_BIG, "Message too big"
+                    await self.close(self.close_code, self.close_reason)
+                    return None
+                if event.message_finished:
+                    if isinstance(event, TextMessage):
+                        return "".join(parts)  # type: ignore[arg-type]
+                    return b"".join(parts)  # type: ignore[arg-type]
+            elif isinstance(event, Ping):
+                await self._send(event.response())
+            elif isinstance(event, CloseConnection):
+                self.close_code, self.close_reason = event.code, event.reason or ""
+                try:
+                    await self._send(event.response())
+                except (LocalProtocolError, ConnectionError):
+                    pass
+                return None
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        try:
+            await self._send(CloseConnection(code=code, reason=reason))
+        except (LocalProtocolError, ConnectionError):
+            pass
+        finally:
+            self._writer.close()
+
+
+class Tunnel:
+    """One client's WebSocket relayed to a replica, closed when it idles or its replica drains."""
+
+    def __init__(self, app_name: str, upstream: str):
+        self.app_name = app_name
+        self.upstream = upstream
+        self.last_activity = monotonic()
+        self._shutdown = asyncio.Event()
+        self.close_code = CLOSE_GOING_AWAY
+        self.close_reason = ""
+
+    def touch(self):
+        self.last_activity = monotonic()
+
+    def shut_down(self, code: int, reason: str):
+        self.close_code, self.close_reason = code, reason
+        self._shutdown.set()
+
+    async def _watch(self):
+        """Return once the tunnel should be closed from our side."""
+        global _tunnels_idled_out
+        while True:
+            remaining = self.last_activity + TUNNEL_IDLE_TIMEOUT - monotonic()
+            if remaining <= 0:
+                _tunnels_idled_out += 1
+                self.close_code, self.close_reason = CLOSE_GOING_AWAY, "Idle timeout"
+                return
+            try:
+                await asyncio.wait_for(self._shutdown.wait(), remaining)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def relay(self, client: Websocket, upstream: UpstreamWebSocket):
+        """Pass messages both ways until either side closes, then close the other side to match."""
+        global _tunnels_opened
+        _tunnels_opened += 1
+        _app_tunnels[self.app_name] += 1
+        _upstream_tunnels[self.upstream].add(self)
+
+        async def _client_to_upstream():
+            while True:
+                message = await client.receive()
+                self.touch()
+                await upstream.send(message)
+
+        async def _upstream_to_client():
+            while True:
+                message = await upstream.receive()
+                if message is None:
+                    return
+                self.touch()
+                await client.send(message)
+
+        upstream_task = asyncio.ensure_future(_upstream_to_client())
+        watch_task = asyncio.ensure_future(self._watch())
+        # Client disconnects cancel the whole handler, so this one runs in it
+        client_task = asyncio.ensure_future(_client_to_upstream())
+        tasks = [upstream_task, watch_task, client_task]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if upstream_task.done():
+                if upstream_task.exception() is None and upstream.close_code:
+                    code, reason = upstream.close_code, upstream.close_reason
+                else:
+                    code, reason = CLOSE_GOING_AWAY, "Upstream went away"
+                await client.close(code, reason)
+            elif watch_task.done():
+                await client.close(self.close_code, self.close_reason)
+            debug("Tunnel to %s for %s closed", self.upstream, self.app_name)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # A no-op apart from closing the connection if the upstream closed first
+            await upstream.close(self.close_code, self.close_reason)
+            _app_tunnels[self.app_name] -= 1
+            if not _app_tunnels[self.app_name]:
+                del _app_tunnels[self.app_name]
+            _upstream_tunnels[self.upstream].discard(self)
+            if not _upstream_tunnels[self.upstream]:
+                del _upstream_tunnels[self.upstream]
+
+
+def open_tunnels(upstream: str) -> int:
+    return len(_upstream_tunnels.get(upstream, ()))
+
+
+def close_tunnels(upstream: str, reason: str = "Service restart") -> int:
+    """Close every tunnel to an upstream, telling clients to reconnect. Returns how many there were."""
+    tunnels = list(_upstream_tunnels.get(upstream, ()))
+    for tunnel in tunnels:
+        tunnel.shut_down(CLOSE_SERVICE_RESTART, reason)
+    return len(tunnels)
+
+
+def tunnel_stats() -> Dict[str, object]:
+    return {
+        "open": dict(_app_tunnels),
+        "opened": _tunnels_opened,
+        "idled_out": _tunnels_idled_out,
+    }
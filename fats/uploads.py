@@ -0,0 +1,254 @@
+# Resumable chunked tarball uploads
+#
+#   POST   /mgmt/uploads                   {"size": N}                 -> 201 {"id", ...}
+#   PUT    /mgmt/uploads/<id>              Content-Range: bytes a-b/N  -> 200 upload status
+#   GET    /mgmt/uploads/<id>                                          -> 200 upload status
+#   POST   /mgmt/uploads/<id>/finalize     {"sha256": "..."}           -> 200 once deployed
+#   DELETE /mgmt/uploads/<id>                                          -> 204
+#
+# Chunks may be sent in any order and in parallel. Each one is written straight to its offset in a
+# preallocated file, so the tarball is complete on disk once every byte has arrived.
+
+import asyncio
+import hashlib
+import os
+import re
+import secrets
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from quart import Blueprint, request
+
+from .cleanup import UPLOAD_PREFIX, protect_temp_path, release_temp_path, remove_path
+from .deploy import deploy_tarball
+from .scheduler import Schedule
+from .utils import log
+
+uploads_blueprint = Blueprint("uploads", __name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("FATS_MAX_UPLOAD_MB", "4096")) * 1024 * 1024
+
+# Suggested chunk size for clients, kept under Quart's default request body limit of 16 MiB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Sessions nobody touched for this long are abandoned and removed
+UPLOAD_SESSION_TTL_SECONDS = 24 * 60 * 60
+
+_CONTENT_RANGE_REGEX = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class UploadSession:
+    def __init__(self, upload_id: str, size: int, path: Path, fd: int):
+        self.id = upload_id
+        self.size = size
+        self.path = path
+        self.fd = fd
+        # Sorted, non-overlapping [start, end) ranges of bytes that were written
+        self.received: List[Tuple[int, int]] = []
+        self.writers = 0
+        self.finalizing = False
+        self.touched = monotonic()
+
+    def mark_received(self, start: int, end: int):
+        ranges = []
+        for range_start, range_end in self.received:
+            if range_end < start or range_start > end:
+                ranges.append((range_start, range_end))
+            else:
+                # Overlapping or adjacent, merge
+                start, end = min(start, range_start), max(end, range_end)
+        ranges.append((start, end))
+        self.received = sorted(ranges)
+
+    @property
+    def received_bytes(self) -> int:
+        return sum(end - start for start, end in self.received)
+
+    @property
+    def complete(self) -> bool:
+        return self.received == [(0, self.size)] or self.size == 0
+
+    def status(self):
+        return {
+            "id": self.id,
+            "size": self.size,
+            "received_bytes": self.received_bytes,
+            # Inclusive byte ranges, like Content-Range
+            "received": [[start, end - 1] for start, end in self.received],
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "complete": self.complete,
+        }
+
+
+_sessions: Dict[str, UploadSession] = {}
+
+
+def _get_session(upload_id: str) -> Optional[UploadSession]:
+    session = _sessions.get(upload_id)
+    if session is not None:
+        session.touched = monotonic()
+    return session
+
+
+async def _discard_session(session: UploadSession):
+    _sessions.pop(session.id, None)
+    os.close(session.fd)
+    release_temp_path(session.path)
+    await remove_path(session.path)
+
+
+async def expire_stale_uploads():
+    now = monotonic()
+    for session in list(_sessions.values()):
+        idle = now - session.touched
+        if idle > UPLOAD_SESSION_TTL_SECONDS and not session.writers:
+            log(f"Discarding upload {session.id}, idle for {idle:.0f} seconds")
+            await _discard_session(session)
+
+
+# Declared here rather than in schedules.py, which deploy imports
+expire_uploads_schedule = Schedule(
+    friendly_name="Expire Stale Uploads",
+    interval=timedelta(minutes=30),
+    action=expire_stale_uploads,
+)
+
+
+@uploads_blueprint.post("")
+async def create_upload():
+    options = await request.get_json(silent=True) or {}
+    size = options.get("size")
+    if not isinstance(size, int) or size < 0:
+        return "A size in bytes is required", 400
+    if size > MAX_UPLOAD_BYTES:
+        return f"Uploads are limited to {MAX_UPLOAD_BYTES} bytes", 413
+
+    upload_id = secrets.token_urlsafe(16)
+    fd, name = tempfile.mkstemp(prefix=UPLOAD_PREFIX, suffix=".tar.gz")
+    path = Path(name)
+    protect_temp_path(path)
+    try:
+        # Reserve the whole file up front, chunks are written into place
+        await asyncio.to_thread(os.ftruncate, fd, size)
+    except OSError:
+        os.close(fd)
+        release_temp_path(path)
+        await remove_path(path)
+        raise
+    session = _sessions[upload_id] = UploadSession(upload_id, size, path, fd)
+    log(f"Created upload {upload_id} of {size} bytes at {path}")
+    return session.status(), 201, {"Location": f"/mgmt/uploads/{upload_id}"}
+
+
+@uploads_blueprint.get("/<upload_id>")
+async def get_upload(upload_id: str):
+    session = _get_session(upload_id)
+    if session is None:
+        return "Upload not found", 404
+    return session.status()
+
+
+@uploads_blueprint.put("/<upload_id>")
+async def put_upload_chunk(upload_id: str):
+    session = _get_session(upload_id)
+    if session is None:
+        return "Upload not found", 404
+    if session.finalizing:
+        return "Upload is being finalized", 409
+
+    match = _CONTENT_RANGE_REGEX.fullmatch(request.headers.get("Content-Range", ""))
+    if match is None:
+        return "A Content-Range header like 'bytes 0-1023/4096' is required", 400
+    start, end = int(match.group(1)), int(match.group(2)) + 1
+    total = match.group(3)
+    if start >= end or end > session.size or (total != "*" and int(total) != session.size):
+        return "Content-Range does not fit the upload", 416, {
+            "Content-Range": f"bytes */{session.size}"
+        }
+
+    session.writers += 1
+    offset = start
+    try:
+        async for chunk in request.body:
+            if offset + len(chunk) > end:
+                return "Body is longer than its Content-Range", 400
+            await asyncio.to_thread(os.pwrite, session.fd, chunk, offset)
+            # Record progress as it is made, so an interrupted chunk only needs its remainder resent
+            session.mark_received(offset, offset + len(chunk))
+            offset += len(chunk)
+    finally:
+        session.writers -= 1
+        session.touched = monotonic()
+
+    if offset != end:
+        return "Body is shorter than its Content-Range", 400
+    return session.status()
+
+
+@uploads_blueprint.delete("/<upload_id>")
+async def delete_upload(upload_id: str):
+    session = _get_session(upload_id)
+    if session is None:
+        return "Upload not found", 404
+    if session.writers or session.finalizing:
+        return "Upload is in use", 409
+    await _discard_session(session)
+    return "", 204
+
+
+def _hash_file(fd: int, size: int) -> str:
+    digest = hashlib.sha256()
+    offset = 0
+    while offset < size:
+        chunk = os.pread(fd, UPLOAD_CHUNK_SIZE, offset)
+        if not chunk:
+            break
+        digest.update(chunk)
+        offset += len(chunk)
+    return digest.hexdigest()
+
+
+@uploads_blueprint.post("/<upload_id>/finalize")
+async def finalize_upload(upload_id: str):
+    session = _get_session(upload_id)
+    if session is None:
+        return "Upload not found", 404
+    options = await request.get_json(silent=True) or {}
+    expected = str(options.get("sha256", "")).strip().lower()
+    if not expected:
+        return "The sha256 of the whole tarball is required", 400
+    if session.finalizing:
+        return "Upload is already being finalized", 409
+    if session.writers or not session.complete:
+        return {"error": "Upload is incomplete", **session.status()}, 409
+
+    session.finalizing = True
+    try:
+        digest = await asyncio.to_thread(_hash_file, session.fd, session.size)
+        if digest != expected:
+            # Keep the session, the client may resend chunks it suspects
+            session.finalizing = False
+            return {"error": f"sha256 mismatch, received {digest}"}, 422
+
+        log(f"Upload {upload_id} complete and verified, deploying")
+        project_config = await deploy_tarball(session.path)
+    except BaseException:
+        session.finalizing = False
+        raise
+    await _discard_session(session)
+
+    return {
+        "name": project_config.name,
+        "version": project_config.version,
+        "sha256": digest,
+    }
+
+
+def upload_stats():
+    return {
+        "sessions": len(_sessions),
+        "bytes_pending": sum(s.size - s.received_bytes for s in _sessions.values()),
+    }
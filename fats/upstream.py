@@ -0,0 +1,179 @@
+# Policies for talking to upstream application containers:
+# timeouts, a global retry budget and per-upstream circuit breakers
+
+from dataclasses import dataclass
+from enum import Enum
+from time import monotonic
+from typing import Dict, Optional
+
+import httpx
+
+from .models.project_config import ProjectConfig
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_FIRST_BYTE_TIMEOUT = 60.0
+DEFAULT_READ_TIMEOUT = 300.0
+
+# Methods that can safely be retried when we failed to connect
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+@dataclass
+class TimeoutPolicy:
+    connect: float
+    first_byte: float
+    idle_read: float
+
+    @classmethod
+    def from_project(cls, project: ProjectConfig) -> "TimeoutPolicy":
+        return cls(
+            connect=project.connect_timeout or DEFAULT_CONNECT_TIMEOUT,
+            first_byte=project.first_byte_timeout or DEFAULT_FIRST_BYTE_TIMEOUT,
+            idle_read=project.read_timeout or DEFAULT_READ_TIMEOUT,
+        )
+
+    def as_httpx_timeout(self) -> httpx.Timeout:
+        # httpx applies each timeout to every individual connect, write or read. Nothing is read before
+        # the whole request body is written, so until the response headers arrive the read timeout is
+        # the first byte timeout, after that use_idle_read_timeout() makes it an idle timeout.
+        return httpx.Timeout(
+            connect=self.connect, read=self.first_byte, write=self.idle_read, pool=None
+        )
+
+    def use_idle_read_timeout(self, response: httpx.Response):
+        """Apply the idle read timeout to the rest of a response whose headers have arrived."""
+        # httpcore looks the timeouts up in the request's extensions when the body is first read
+        extensions = response.request.extensions
+        extensions["timeout"] = {**extensions.get("timeout", {}), "read": self.idle_read}
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of regular traffic so retries cannot amplify an outage.
+
+    Every request deposits `ratio` of a retry, and a small number of retries per second
+    are always allowed so that low traffic apps can still retry.
+    """
+
+    def __init__(
+        self, ratio: float = 0.2, min_per_second: float = 2.0, max_balance: float = 50
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = 0.0
+        self.reserve = min_per_second
+        self.updated = monotonic()
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        now = monotonic()
+        self.reserve = min(
+            self.min_per_second,
+            self.reserve + (now - self.updated) * self.min_per_second,
+        )
+        self.updated = now
+        if self.balance >= 1:
+            self.balance -= 1
+        elif self.reserve >= 1:
+            self.reserve -= 1
+        else:
+            self.exhausted += 1
+            return False
+        self.retries += 1
+        return True
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, failing fast for `open_duration` seconds.
+    Afterwards a single probe request is let through, closing the circuit again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = 5, open_duration: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.open_duration = open_duration
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.open_duration - monotonic())
+
+    def allow_request(self) -> bool:
+        if self.state == CircuitState.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = CircuitState.HALF_OPEN
+            self._probe_started_at = None
+        if self.state == CircuitState.HALF_OPEN:
+            now = monotonic()
+            # Only one probe at a time, unless the last one never reported back
+            if (
+                self._probe_started_at is not None
+                and now - self._probe_started_at < self.open_duration
+            ):
+                return False
+            self._probe_started_at = now
+        return True
+
+    def record_success(self):
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self._probe_started_at = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_started_at = None
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = CircuitState.OPEN
+            self.opened_at = monotonic()
+
+
+retry_budget = RetryBudget()
+
+# Keyed by the upstream's address:port
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    breaker = _breakers.get(upstream)
+    if breaker is None:
+        breaker = _breakers[upstream] = CircuitBreaker()
+    return breaker
+
+
+def breaker_retry_after(upstreams: list[str]) -> Optional[float]:
+    """Seconds until one of the given upstreams will accept a request again, if they are all open."""
+    waits = [get_breaker(u).retry_after() for u in upstreams]
+    return min(waits) if waits else None
+
+
+def upstream_stats() -> Dict[str, object]:
+    return {
+        "retry_budget": {
+            "retries": retry_budget.retries,
+            "exhausted": retry_budget.exhausted,
+        },
+        "circuit_breakers": {
+            upstream: {
+                "state": breaker.state.value,
+                "consecutive_failures": breaker.consecutive_failures,
+            }
+            for upstream, breaker in _breakers.items()
+        },
+    }
@@ -1,14 +1,18 @@
+import dataclasses
+import json
 from pathlib import Path
-from sqlalchemy import JSON
+from typing import Any, Optional
+
+from sqlalchemy import JSON, Column, Connection, Table
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, MappedAsDataclass
 
 from . import log
 
-_sqlite_dir = Path("/") / "var" / "lib" / "fats"
-if not _sqlite_dir.exists():
-    _sqlite_dir.mkdir(parents=True, exist_ok=True)
-_sqlite_path = _sqlite_dir / "fats.db"
+FATS_DATA_DIR = Path("/") / "var" / "lib" / "fats"
+if not FATS_DATA_DIR.exists():
+    FATS_DATA_DIR.mkdir(parents=True, exist_ok=True)
+_sqlite_path = FATS_DATA_DIR / "fats.db"
 
 _sqlite_uri = "sqlite+aiosqlite:///" + str(_sqlite_path)
 
@@ -29,6 +33,63 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+def _column_default(table: Table, column: Column) -> Optional[Any]:
+    """The value a new row gets for a column, from the column or else its model's dataclass field."""
+    if column.default is not None and column.default.is_scalar:
+        return column.default.arg
+    for mapper in Base.registry.mappers:
+        if mapper.local_table is table:
+            field = getattr(mapper.class_, "__dataclass_fields__", {}).get(column.key)
+            if field is None:
+                break
+            # Scalar defaults are on the column already, only factories are kept on the field
+            if field.default_factory is not dataclasses.MISSING:
+                return field.default_factory()
+    return None
+
+
+def _sql_literal(column: Column, value: Any) -> str:
+    if isinstance(column.type, JSON):
+        value = json.dumps(value)
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def add_missing_columns(conn: Connection) -> list[str]:
+    """
+    create_all never changes tables that already exist, so columns added to the models since a
+    database was created are added here, with existing rows getting the column's default.
+    Returns the columns that were added.
+    """
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {
+            row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')
+        }
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(conn.dialect)}'
+            default = _column_default(table, column)
+            if default is not None:
+                ddl += f" DEFAULT {_sql_literal(column, default)}"
+            if not column.nullable:
+                if default is None:
+                    raise RuntimeError(
+                        f"Can't add {table.name}.{column.name} to the database, it has no default"
+                    )
+                ddl += " NOT NULL"
+            conn.exec_driver_sql(ddl)
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
 async def create_tables():
     async with async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(add_missing_columns)
+    if added:
+        log(f"Added columns to the database: {', '.join(added)}")
@@ -0,0 +1,62 @@
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from fatstacks.schema.action import (
+    Action,
+    ActionBehaviorTypes,
+    NavigateActionBehavior,
+    ParamFromData,
+    RequestActionBehavior,
+)
+
+ContentData = Dict[str, Any]
+
+
+def behaviors(action: Action) -> List[ActionBehaviorTypes]:
+    return action.behavior if isinstance(action.behavior, list) else [action.behavior]
+
+
+def resolve_params(value: Any, data: ContentData) -> Any:
+    """Replace every ParamFromData, or {"fromData": key} in raw payloads, with the value from data."""
+    if isinstance(value, ParamFromData):
+        return data.get(value.fromData)
+    if isinstance(value, dict):
+        if set(value) == {"fromData"} and isinstance(value["fromData"], str):
+            return data.get(value["fromData"])
+        return {key: resolve_params(item, data) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_params(item, data) for item in value]
+    return value
+
+
+def request_payload(
+    behavior: RequestActionBehavior,
+    data: ContentData,
+    form_data: Optional[ContentData] = None,
+) -> Any:
+    """
+    The body of a request behavior: its payload merged with the item's data, and with the form's data
+    when the behavior uses a form. Later sources win. Payloads that aren't objects are sent as they are.
+    """
+    payload = resolve_params(behavior.payload, data)
+    if payload is not None and not isinstance(payload, dict):
+        return payload
+    merged: ContentData = {**(payload or {}), **data}
+    if behavior.formToUse is not None:
+        merged.update(form_data or {})
+    return merged
+
+
+def navigation_uri(behavior: NavigateActionBehavior, data: ContentData) -> str:
+    """The target uri of a navigate behavior with its query parameters resolved and merged in."""
+    if not behavior.queryParams:
+        return behavior.targetUri
+    parts = urlsplit(behavior.targetUri)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    for key, value in behavior.queryParams.items():
+        resolved = resolve_params(value, data)
+        if isinstance(resolved, bool):
+            query[key] = "true" if resolved else "false"
+        elif resolved is not None:
+            query[key] = str(resolved)
+    return urlunsplit(parts._replace(query=urlencode(query)))
@@ -0,0 +1,216 @@
+import hashlib
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Set, Type, TypeVar
+
+from fatstacks.schema.delta import (
+    DeltaOperationType,
+    FormOperation,
+    ItemOperation,
+    SurfaceDelta,
+)
+from fatstacks.schema.form import Form
+from fatstacks.schema.item import Item
+from fatstacks.schema.surface import Surface
+from fatstacks.validation import adapter
+
+# How many past revisions of each surface a history keeps deltas from
+HISTORY_LENGTH = 16
+
+_LIST_FIELDS = {"items", "forms", "revision"}
+
+T = TypeVar("T", Item, Form)
+Operation = TypeVar("Operation", ItemOperation, FormOperation)
+
+
+class DeltaMismatch(ValueError):
+    """A delta did not apply cleanly, the client should fetch the whole surface instead."""
+
+
+def surface_revision(surface: Surface) -> str:
+    """A hash of everything in a surface except its revision."""
+    encoded = adapter(Surface).dump_json(surface, exclude={"revision": True})
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def with_revision(surface: Surface) -> Surface:
+    return surface.model_copy(update={"revision": surface_revision(surface)})
+
+
+def _unmoved(old_positions: List[int]) -> Set[int]:
+    """
+    Indexes into old_positions of its longest increasing subsequence, the elements that keep their
+    relative order. Everything else has moved and is sent as a removal and an addition.
+    """
+    tails: List[int] = []
+    tail_indexes: List[int] = []
+    previous = [-1] * len(old_positions)
+    for i, position in enumerate(old_positions):
+        at = bisect_left(tails, position)
+        if at == len(tails):
+            tails.append(position)
+            tail_indexes.append(i)
+        else:
+            tails[at] = position
+            tail_indexes[at] = i
+        previous[i] = tail_indexes[at - 1] if at else -1
+    kept: Set[int] = set()
+    i = tail_indexes[-1] if tail_indexes else -1
+    while i != -1:
+        kept.add(i)
+        i = previous[i]
+    return kept
+
+
+def _diff_list(
+    old: Sequence[T], new: Sequence[T], schema: Type[T], operation: Type[Operation]
+) -> List[Operation]:
+    element_adapter = adapter(schema)
+    key = "item" if schema is Item else "form"
+    old_by_id = {element.id: (i, element) for i, element in enumerate(old)}
+    new_ids = {element.id for element in new}
+
+    operations: List[Operation] = [
+        operation(op=DeltaOperationType.REMOVE, id=element.id)
+        for element in old
+        if element.id not in new_ids
+    ]
+
+    common = [i for i, element in enumerate(new) if element.id in old_by_id]
+    kept = _unmoved([old_by_id[new[i].id][0] for i in common])
+    unmoved = {common[i] for i in kept}
+
+    additions: List[Operation] = []
+    for index, element in enumerate(new):
+        if index in unmoved:
+            previous = old_by_id[element.id][1]
+            if previous is not element and element_adapter.dump_json(
+                previous
+            ) != element_adapter.dump_json(element):
+                operations.append(
+                    operation(
+                        op=DeltaOperationType.REPLACE, id=element.id, **{key: element}
+                    )
+                )
+            continue
+        if element.id in old_by_id:
+            # Moved, so taken out and put back where it belongs
+            operations.append(operation(op=DeltaOperationType.REMOVE, id=element.id))
+        additions.append(
+            operation(
+                op=DeltaOperationType.ADD, id=element.id, index=index, **{key: element}
+            )
+        )
+    return operations + additions
+
+
+def _surface_fields(surface: Surface) -> Dict[str, Any]:
+    return adapter(Surface).dump_python(
+        surface, mode="json", exclude={field: True for field in _LIST_FIELDS}
+    )
+
+
+def diff_surfaces(old: Surface, new: Surface) -> SurfaceDelta:
+    """The operations that turn `old` into `new`, matching items and forms by id."""
+    old_fields, new_fields = _surface_fields(old), _surface_fields(new)
+    fields = {
+        name: value
+        for name, value in new_fields.items()
+        if old_fields.get(name) != value
+    }
+    if (old.forms is None) != (new.forms is None):
+        fields["forms"] = None if new.forms is None else []
+
+    return SurfaceDelta(
+        surfaceId=new.id,
+        fromRevision=old.revision or surface_revision(old),
+        revision=new.revision or surface_revision(new),
+        fields=fields,
+        items=_diff_list(old.items, new.items, Item, ItemOperation),
+        forms=_diff_list(old.forms or [], new.forms or [], Form, FormOperation),
+    )
+
+
+def _apply_list(
+    elements: Sequence[T], operations: Sequence[Operation], key: str
+) -> List[T]:
+    removed = {o.id for o in operations if o.op == DeltaOperationType.REMOVE}
+    replaced = {
+        o.id: getattr(o, key) for o in operations if o.op == DeltaOperationType.REPLACE
+    }
+    result = [
+        replaced.get(element.id, element)
+        for element in elements
+        if element.id not in removed
+    ]
+    additions = sorted(
+        (o for o in operations if o.op == DeltaOperationType.ADD),
+        key=lambda o: o.index if o.index is not None else len(elements),
+    )
+    for addition in additions:
+        element = getattr(addition, key)
+        if element is None:
+            raise DeltaMismatch(f"Addition of {addition.id} has no {key}")
+        index = addition.index if addition.index is not None else len(result)
+        result.insert(index, element)
+    return result
+
+
+def apply_delta(surface: Surface, delta: SurfaceDelta) -> Surface:
+    """Apply a delta to the surface it was made from, checking the result hashes to its revision."""
+    revision = surface.revision or surface_revision(surface)
+    if delta.fromRevision != revision:
+        raise DeltaMismatch(
+            f"Delta applies to revision {delta.fromRevision}, not {revision}"
+        )
+
+    items = _apply_list(surface.items, delta.items, "item")
+    forms: Optional[List[Form]] = _apply_list(surface.forms or [], delta.forms, "form")
+    if "forms" in delta.fields:
+        forms = forms if delta.fields["forms"] is not None else None
+    elif surface.forms is None:
+        forms = forms or None
+
+    fields = {k: v for k, v in delta.fields.items() if k not in _LIST_FIELDS}
+    updated = adapter(Surface).validate_python(
+        {**_surface_fields(surface), **fields, "items": []}
+    ).model_copy(update={"items": items, "forms": forms})
+
+    if surface_revision(updated) != delta.revision:
+        raise DeltaMismatch(f"Delta did not produce revision {delta.revision}")
+    return updated.model_copy(update={"revision": delta.revision})
+
+
+class SurfaceHistory:
+    """
+    Recent revisions of one surface, to answer "what changed since revision X" with a delta.
+    Revisions older than the history are answered with None, and the client gets the whole surface.
+    """
+
+    def __init__(self, length: int = HISTORY_LENGTH):
+        self.length = length
+        self._revisions: OrderedDict[str, Surface] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._revisions)
+
+    @property
+    def latest(self) -> Optional[Surface]:
+        return next(reversed(self._revisions.values()), None)
+
+    def record(self, surface: Surface) -> Surface:
+        """Record a surface as the latest revision, and return it with its revision set."""
+        surface = with_revision(surface)
+        assert surface.revision is not None
+        self._revisions.pop(surface.revision, None)
+        self._revisions[surface.revision] = surface
+        while len(self._revisions) > self.length:
+            self._revisions.popitem(last=False)
+        return surface
+
+    def changes_since(self, revision: str) -> Optional[SurfaceDelta]:
+        latest = self.latest
+        base = self._revisions.get(revision)
+        if latest is None or base is None:
+            return None
+        return diff_surfaces(base, latest)
@@ -1,27 +1,19 @@
-from typing import List, Type
-from fatstacks.schema.action import Action
-from fatstacks.schema.app import App
-from fatstacks.schema.form import Form
-from fatstacks.schema.item import Item
-from fatstacks.schema.layout_hints import LayoutHints
-from fatstacks.schema.surface import Surface
-import json
+from pathlib import Path
 
-from fatstacks.utils.model import Model
+from fatstacks.registry import SCHEMA_MODELS, schema_json
 
 
-schemas_to_generate: List[Type[Model]] = [
-    Action,
-    App,
-    Form,
-    Item,
-    LayoutHints,
-    Surface,
-]
+def generate_schemas(directory: Path = Path(".")):
+    """Write each model's JSON schema to <name>_schema.json, skipping files that are already up to date."""
+    for name, model in SCHEMA_MODELS.items():
+        schema_path = directory / f"{name}_schema.json"
+        schema_data = schema_json(model)
+        if schema_path.exists() and schema_path.read_text() == schema_data:
+            print(f"Schema for {model.__name__} in {schema_path} is up to date")
+            continue
+        schema_path.write_text(schema_data)
+        print(f"Generated schema for {model.__name__} in {schema_path}")
 
-for schema in schemas_to_generate:
-    schema_data = schema.model_json_schema()
-    schema_filename = f"{schema.__name__.lower()}_schema.json"
-    with open(schema_filename, "w") as f:
-        f.write(json.dumps(schema_data, indent=4))
-    print(f"Generated schema for {schema.__name__} in {schema_filename}")
+
+if __name__ == "__main__":
+    generate_schemas()
@@ -0,0 +1,54 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from functools import cache
+from typing import Dict, Type
+
+from fatstacks.schema.action import Action
+from fatstacks.schema.app import App
+from fatstacks.schema.delta import SurfaceDelta
+from fatstacks.schema.form import Form
+from fatstacks.schema.item import Item
+from fatstacks.schema.layout_hints import LayoutHints
+from fatstacks.schema.pagination import Pagination
+from fatstacks.schema.surface import Surface
+from fatstacks.utils.model import Model
+
+# Every published schema, by the lowercase model name used in file names and urls
+SCHEMA_MODELS: Dict[str, Type[Model]] = {
+    model.__name__.lower(): model
+    for model in (
+        Action,
+        App,
+        Form,
+        Item,
+        LayoutHints,
+        Pagination,
+        Surface,
+        SurfaceDelta,
+    )
+}
+
+
+@dataclass(frozen=True)
+class SchemaDocument:
+    name: str
+    body: bytes
+    """The JSON schema, encoded"""
+    digest: str
+    """sha256 of body"""
+
+
+def schema_json(model: Type[Model]) -> str:
+    return json.dumps(model.model_json_schema(), indent=4)
+
+
+@cache
+def schema_document(name: str) -> SchemaDocument:
+    """The JSON schema of a registered model, generated once. Raises KeyError for unknown names."""
+    body = schema_json(SCHEMA_MODELS[name]).encode()
+    return SchemaDocument(name, body, hashlib.sha256(body).hexdigest())
+
+
+def build_schemas() -> Dict[str, SchemaDocument]:
+    return {name: schema_document(name) for name in SCHEMA_MODELS}
@@ -1,8 +1,8 @@
-from typing import Any, List, Optional, Type
-from pydantic import Field
+from typing import Annotated, Any, List, Optional
+from pydantic import Discriminator, Field, Tag
 from enum import Enum
 
-from fatstacks.utils.model import Model
+from fatstacks.utils.model import Model, type_discriminator
 
 
 class ActionBehaviorType(str, Enum):
@@ -11,11 +11,6 @@ class ActionBehaviorType(str, Enum):
     TOAST = "toast"
 
 
-ActionBehaviorTypes = Type[
-    "NavigateActionBehavior | RequestActionBehavior | ToastActionBehavior"
-]
-
-
 class ActionBehavior(Model):
     """Defines the behavior of an action when it is triggered."""
 
@@ -66,6 +61,14 @@ class ToastActionBehavior(ActionBehavior):
     """The message to display in the toast notification when the action is triggered."""
 
 
+ActionBehaviorTypes = Annotated[
+    Annotated[NavigateActionBehavior, Tag(ActionBehaviorType.NAVIGATE.value)]
+    | Annotated[RequestActionBehavior, Tag(ActionBehaviorType.REQUEST.value)]
+    | Annotated[ToastActionBehavior, Tag(ActionBehaviorType.TOAST.value)],
+    Discriminator(type_discriminator()),
+]
+
+
 class Action(Model):
     """An action represents an operation that can be performed within the application, such as navigating to a different surface, submitting a form, or triggering a specific functionality."""
 
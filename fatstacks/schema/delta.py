@@ -0,0 +1,72 @@
+from typing import Any, Dict, List, Optional
+from enum import Enum
+
+from pydantic import Field
+
+from fatstacks.schema.form import Form
+from fatstacks.schema.item import Item
+from fatstacks.utils.model import Model
+
+
+class DeltaOperationType(str, Enum):
+    ADD = "add"
+    REPLACE = "replace"
+    REMOVE = "remove"
+
+
+class ItemOperation(Model):
+    """A change to one item of a surface, identified by its id."""
+
+    op: DeltaOperationType
+    """Whether the item is added, replaced or removed."""
+
+    id: str
+    """The id of the item the operation applies to."""
+
+    index: Optional[int] = Field(default=None, ge=0)
+    """For additions, the position of the item in the updated list of items."""
+
+    item: Optional[Item] = None
+    """For additions and replacements, the item itself."""
+
+
+class FormOperation(Model):
+    """A change to one form of a surface, identified by its id."""
+
+    op: DeltaOperationType
+    """Whether the form is added, replaced or removed."""
+
+    id: str
+    """The id of the form the operation applies to."""
+
+    index: Optional[int] = Field(default=None, ge=0)
+    """For additions, the position of the form in the updated list of forms."""
+
+    form: Optional[Form] = None
+    """For additions and replacements, the form itself."""
+
+
+class SurfaceDelta(Model):
+    """
+    The changes between two revisions of a surface. Clients holding the surface at fromRevision apply them to get the surface at revision, instead of fetching it whole.
+
+    Operations are applied in order: removals, then replacements, then additions by ascending index. If the result does not hash to revision, the client should fetch the whole surface.
+    """
+
+    surfaceId: str
+    """The id of the surface that changed."""
+
+    fromRevision: str
+    """The revision the changes apply to."""
+
+    revision: str
+    """The revision of the surface once the changes are applied."""
+
+    fields: Dict[str, Any] = {}
+    """Top-level surface fields, other than items and forms, that changed, with their new values."""
+
+    items: List[ItemOperation] = []
+    """Changes to the surface's items."""
+
+    forms: List[FormOperation] = []
+    """Changes to the surface's forms."""
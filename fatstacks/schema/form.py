@@ -1,7 +1,9 @@
-from typing import Optional, Type
+from typing import Annotated, Optional
 from enum import Enum
 
-from fatstacks.utils.model import Model
+from pydantic import Discriminator, Tag
+
+from fatstacks.utils.model import Model, type_discriminator
 
 
 class InputFieldType(str, Enum):
@@ -10,9 +12,6 @@ class InputFieldType(str, Enum):
     SELECT = "select"
 
 
-InputFieldTypes = Type["TextInputField | NumberInputField | SelectInputField"]
-
-
 class InputField(Model):
     type: InputFieldType
     """The type of input field (e.g., text, number, select)."""
@@ -39,6 +38,14 @@ class SelectInputField(InputField):
     """A list of options available for selection."""
 
 
+InputFieldTypes = Annotated[
+    Annotated[TextInputField, Tag(InputFieldType.TEXT.value)]
+    | Annotated[NumberInputField, Tag(InputFieldType.NUMBER.value)]
+    | Annotated[SelectInputField, Tag(InputFieldType.SELECT.value)],
+    Discriminator(type_discriminator()),
+]
+
+
 class Form(Model):
     """
     A form represents a collection of input fields and actions that allow users to submit data or perform operations within a surface.
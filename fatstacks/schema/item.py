@@ -1,7 +1,9 @@
-from typing import Dict, List, Optional, Type
+from typing import Annotated, Any, Dict, List, Optional
 from enum import Enum
 
-from fatstacks.utils.model import Model
+from pydantic import Discriminator, Tag
+
+from fatstacks.utils.model import Model, type_discriminator
 
 
 class DisplayStrategy(str, Enum):
@@ -12,7 +14,6 @@ class DisplayStrategy(str, Enum):
 
 
 ContentPrimitive = str | int | float | bool
-ContentTypes = Type["ContentAuto | ContentText | ContentImage | ContentAction"]
 
 
 class Content(Model):
@@ -55,6 +56,45 @@ class ContentAction(Content):
     """Allows overriding the Item data when this action is triggered, instead passing the data defined here."""
 
 
+ContentTypes = Annotated[
+    Annotated[ContentAuto, Tag(DisplayStrategy.AUTO.value)]
+    | Annotated[ContentText, Tag(DisplayStrategy.TEXT.value)]
+    | Annotated[ContentImage, Tag(DisplayStrategy.IMAGE.value)]
+    | Annotated[ContentAction, Tag(DisplayStrategy.ACTION.value)],
+    Discriminator(type_discriminator(DisplayStrategy.AUTO.value)),
+]
+
+_DISPLAY_STRATEGIES = {strategy.value for strategy in DisplayStrategy}
+
+
+def _is_content_object(value: Any) -> bool:
+    # A dict is a content object when its type names a display strategy, any other dict is data
+    if isinstance(value, dict):
+        return value.get("type") in _DISPLAY_STRATEGIES
+    return isinstance(value, Content)
+
+
+def _content_value_kind(value: Any) -> str:
+    return "content" if _is_content_object(value) else "primitive"
+
+
+def _item_content_kind(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return "list"
+    if _is_content_object(value):
+        return "content"
+    if isinstance(value, dict):
+        return "dict"
+    return "primitive"
+
+
+ContentValue = Annotated[
+    Annotated[ContentTypes, Tag("content")]
+    | Annotated[ContentPrimitive, Tag("primitive")],
+    Discriminator(_content_value_kind),
+]
+
+
 class Item(Model):
     """
     An item represents a discrete piece of content within a surface.
@@ -63,12 +103,13 @@ class Item(Model):
     id: str
     """A unique identifier for the item within the surface."""
 
-    content: (
-        Dict[str, "ContentTypes | ContentPrimitive"]
-        | List["ContentTypes | ContentPrimitive"]
-        | ContentTypes
-        | ContentPrimitive
-    )
+    content: Annotated[
+        Annotated[Dict[str, ContentValue], Tag("dict")]
+        | Annotated[List[ContentValue], Tag("list")]
+        | Annotated[ContentTypes, Tag("content")]
+        | Annotated[ContentPrimitive, Tag("primitive")],
+        Discriminator(_item_content_kind),
+    ]
     """The content of the item, which can be a dictionary, list, or single content object. The content structure is flexible to accommodate various types of data, chiefly auto-displaying JSON data."""
 
     data: Optional[Dict[str, ContentPrimitive]]
@@ -76,3 +117,6 @@ class Item(Model):
 
     actions: Optional[List[str]] = []
     """A list of action identifiers that can be triggered from this item."""
+
+    cursor: Optional[str] = None
+    """An opaque cursor to resume a paginated surface after this item. Defaults to the item's id."""
@@ -0,0 +1,25 @@
+from typing import Optional
+from pydantic import Field
+
+from fatstacks.utils.model import Model
+
+
+class Pagination(Model):
+    """
+    Pagination describes where a surface's items continue when they are delivered in pages. The next page is the same surface, fetched from nextUri, carrying the items that follow.
+    """
+
+    cursor: Optional[str] = None
+    """The cursor this page of items starts after, if it is not the first page."""
+
+    nextCursor: Optional[str] = None
+    """The cursor to request the next page with. Absent on the last page."""
+
+    nextUri: Optional[str] = None
+    """The uri of the next page, if there is one. Clients should append its items to the ones they already have."""
+
+    pageSizeHint: Optional[int] = Field(default=None, gt=0)
+    """The number of items per page the provider prefers clients to ask for."""
+
+    totalItems: Optional[int] = Field(default=None, ge=0)
+    """The total number of items across all pages, if the provider knows it."""
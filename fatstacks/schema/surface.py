@@ -1,8 +1,10 @@
 from typing import Optional, List
 
+from fatstacks.schema.action import Action
 from fatstacks.schema.form import Form
 from fatstacks.schema.item import Item
 from fatstacks.schema.layout_hints import LayoutHints
+from fatstacks.schema.pagination import Pagination
 from fatstacks.utils.model import Model
 
 
@@ -16,6 +18,9 @@ class Surface(Model):
     version: int = 1
     """The version of the surface schema. Currently always 1."""
 
+    revision: Optional[str] = None
+    """A hash of the surface's content, which clients can ask for changes since. Set by the provider or the FATS runtime."""
+
     id: str
     """A unique identifier for the surface within the application."""
     name: Optional[str]
@@ -27,7 +32,13 @@ class Surface(Model):
     """Optional layout hints to guide rendering engines on how to display the surface."""
 
     items: List["Item"]
-    """A list of items that make up the content of the surface."""
+    """A list of items that make up the content of the surface. When paginated, only the items of this page."""
+
+    pagination: Optional["Pagination"] = None
+    """Where the items continue, for surfaces whose items are delivered in pages."""
 
     forms: Optional[List["Form"]] = None
     """A list of forms available within the surface for user input and data submission."""
+
+    actions: Optional[List["Action"]] = None
+    """The actions that items and content on this surface refer to by id."""
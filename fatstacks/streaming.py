@@ -0,0 +1,90 @@
+from typing import Any, AsyncIterable, AsyncIterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from fatstacks.schema.item import Item
+from fatstacks.schema.pagination import Pagination
+from fatstacks.schema.surface import Surface
+from fatstacks.validation import adapter, dump_json
+
+# Encoded items are sent in chunks of about this size, rather than one write per item
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def continuation_uri(uri: str, cursor: str, page_size: Optional[int] = None) -> str:
+    """The uri of the page after `cursor`, with cursor (and pageSize) query parameters replaced."""
+    parts = urlsplit(uri)
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in ("cursor", "pageSize")
+    ]
+    query.append(("cursor", cursor))
+    if page_size is not None:
+        query.append(("pageSize", str(page_size)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+async def encode_surface(
+    surface: Surface,
+    items: AsyncIterable[Item | Any],
+    page_size: Optional[int] = None,
+    uri: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Encode a surface as JSON incrementally, taking its items from `items` as they are produced
+    instead of from `surface.items`. Items given as plain data are validated one at a time.
+
+    With a page_size, at most that many items are sent. If there are more, the surface ends with
+    pagination pointing after the last item sent, and a nextUri built from `uri` when given.
+    """
+    item_adapter = adapter(Item)
+    # Everything but the items and pagination, with the object left open. id is required, so it's never empty
+    head = adapter(Surface).dump_json(
+        surface, exclude={"items": True, "pagination": True}
+    )
+    buffer = bytearray(head[:-1])
+    buffer += b',"items":['
+
+    sent = 0
+    last_cursor: Optional[str] = None
+    has_more = False
+    iterator = aiter(items)
+    try:
+        async for item in iterator:
+            if page_size is not None and sent >= page_size:
+                has_more = True
+                break
+            if not isinstance(item, Item):
+                item = item_adapter.validate_python(item)
+            if sent:
+                buffer += b","
+            buffer += item_adapter.dump_json(item)
+            last_cursor = item.cursor or item.id
+            sent += 1
+            if len(buffer) >= STREAM_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+    finally:
+        # Stopping at page_size leaves the app's generator, and whatever it reads from, open otherwise
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    buffer += b"]"
+
+    pagination = surface.pagination
+    if has_more and last_cursor is not None:
+        pagination = (pagination or Pagination()).model_copy(
+            update={
+                "nextCursor": last_cursor,
+                "nextUri": (
+                    continuation_uri(uri, last_cursor, page_size) if uri else None
+                ),
+            }
+        )
+    elif pagination is not None:
+        # The last page, nothing follows it
+        pagination = pagination.model_copy(update={"nextCursor": None, "nextUri": None})
+    if pagination is not None:
+        buffer += b',"pagination":' + dump_json(pagination)
+    buffer += b"}"
+    yield bytes(buffer)
@@ -1,5 +1,24 @@
+from enum import Enum
+from typing import Any, Callable, Optional
+
 from pydantic import ConfigDict, BaseModel
 
 
 class Model(BaseModel):
     model_config = ConfigDict(use_attribute_docstrings=True)
+
+
+def type_discriminator(default: Optional[str] = None) -> Callable[[Any], Optional[str]]:
+    """
+    Pick a union member by its `type`, from both raw documents and model instances, so validation goes
+    straight to one member instead of trying each. Without a default, `type` is required.
+    """
+
+    def discriminate(value: Any) -> Optional[str]:
+        if isinstance(value, dict):
+            tag = value.get("type", default)
+        else:
+            tag = getattr(value, "type", default)
+        return tag.value if isinstance(tag, Enum) else tag
+
+    return discriminate
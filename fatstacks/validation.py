@@ -0,0 +1,37 @@
+from functools import cache
+from typing import Any, Iterable, List, Type, TypeVar
+
+from pydantic import TypeAdapter
+
+T = TypeVar("T")
+
+
+@cache
+def adapter(schema: Type[T]) -> TypeAdapter[T]:
+    """
+    A validator and serializer for a schema model, or any type built from them like `List[Surface]`.
+    Building one compiles the whole schema, so each is built once and reused.
+    """
+    return TypeAdapter(schema)
+
+
+def validate(schema: Type[T], document: Any) -> T:
+    """Validate a document, given as JSON bytes or text, or as already parsed Python data."""
+    if isinstance(document, (bytes, bytearray, memoryview, str)):
+        # Parsed and validated in one pass, without building intermediate dicts
+        return adapter(schema).validate_json(document)
+    return adapter(schema).validate_python(document)
+
+
+def validate_many(schema: Type[T], documents: Iterable[Any]) -> List[T]:
+    return [validate(schema, document) for document in documents]
+
+
+def dump_json(value: Any, schema: Type[Any] | None = None) -> bytes:
+    """Serialize a validated value straight to JSON bytes."""
+    return adapter(schema or type(value)).dump_json(value)
+
+
+def dump_python(value: Any, schema: Type[Any] | None = None) -> Any:
+    """Serialize a validated value to JSON compatible Python data."""
+    return adapter(schema or type(value)).dump_python(value, mode="json")
@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Optional, Type, TypeVar
+
+import msgpack
+
+from fatstacks.validation import adapter
+
+T = TypeVar("T")
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Names MessagePack has gone by, all understood when decoding and negotiating
+MSGPACK_ALIASES = {MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack"}
+
+
+def supported_media_types() -> List[str]:
+    """Media types we can encode, in order of preference when the client has none."""
+    return [JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE]
+
+
+def _canonical(media_type: str) -> str:
+    media_type = media_type.split(";", 1)[0].strip().lower()
+    return MSGPACK_MEDIA_TYPE if media_type in MSGPACK_ALIASES else media_type
+
+
+def negotiate_media_type(accept: Optional[str]) -> Optional[str]:
+    """
+    Pick the media type to answer with from an Accept header. JSON wins ties, so clients have to ask
+    for MessagePack. Returns None if the client accepts nothing we can encode.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    qualities: Dict[str, float] = {}
+    for part in accept.split(","):
+        media_type, *params = part.split(";")
+        media_type = _canonical(media_type)
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+
+    def _quality(media_type: str) -> float:
+        main_type = media_type.split("/", 1)[0]
+        return qualities.get(
+            media_type, qualities.get(f"{main_type}/*", qualities.get("*/*", 0.0))
+        )
+
+    best: Optional[str] = None
+    best_quality = 0.0
+    for media_type in supported_media_types():
+        quality = _quality(media_type)
+        if quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+def encode(
+    value: Any, media_type: str = JSON_MEDIA_TYPE, schema: Type[Any] | None = None
+) -> bytes:
+    """Serialize a validated value as JSON or MessagePack, with the same cached serializer for both."""
+    serializer = adapter(schema or type(value))
+    if _canonical(media_type) == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(serializer.dump_python(value, mode="json"))
+    return serializer.dump_json(value)
+
+
+def decode(schema: Type[T], body: bytes, media_type: str = JSON_MEDIA_TYPE) -> T:
+    """Parse and validate a JSON or MessagePack document with the cached validator of its schema."""
+    if _canonical(media_type) == MSGPACK_MEDIA_TYPE:
+        return adapter(schema).validate_python(msgpack.unpackb(body))
+    return adapter(schema).validate_json(body)
@@ -0,0 +1,18 @@
+import httpx
+import pytest
+
+from fats import proxy
+
+
+@pytest.fixture(autouse=True)
+def _client(monkeypatch):
+    # Pooled connections belong to the event loop they were opened on, every test runs its own
+    monkeypatch.setattr(
+        proxy,
+        "_client",
+        httpx.AsyncClient(
+            timeout=None,
+            follow_redirects=True,
+            headers={"Accept-Encoding": "identity"},
+        ),
+    )
@@ -0,0 +1,124 @@
+# Stand-ins for Docker engines, for tests of the code that places containers on them.
+# FakeEngine serves the parts of the Engine API fats reads over HTTP, on a TCP port or a unix socket.
+# FakeDockerCli puts a `docker` executable first on PATH that answers the commands fats runs, keeping
+# the ports each engine has published in a state directory and recording every command.
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ENGINE_INFO = {"NCPU": 4, "MemTotal": 8 * 1024**3, "ContainersRunning": 2}
+
+
+class FakeEngine:
+    def __init__(self, info: Optional[Dict[str, Any]] = None):
+        self.info = dict(ENGINE_INFO if info is None else info)
+        self.requests: List[str] = []
+        self._server: Optional[asyncio.Server] = None
+        self.endpoint = ""
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        head = await reader.readuntil(b"\r\n\r\n")
+        method, path, _ = head.split(b"\r\n", 1)[0].decode().split(" ", 2)
+        self.requests.append(f"{method} {path}")
+        if path.rstrip("/").rsplit("/", 1)[-1] == "info":
+            status, body = "200 OK", json.dumps(self.info).encode()
+        else:
+            status, body = "404 Not Found", b'{"message": "page not found"}'
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+        writer.close()
+
+    async def start_tcp(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.endpoint = f"tcp://127.0.0.1:{self._server.sockets[0].getsockname()[1]}"
+        return self.endpoint
+
+    async def start_unix(self, path: Path) -> str:
+        self._server = await asyncio.start_unix_server(self._handle, str(path))
+        self.endpoint = f"unix://{path}"
+        return self.endpoint
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+# Runs as the docker CLI, with the state directory as its first argument
+_CLI_SCRIPT = """
+import json, os, sys
+from pathlib import Path
+
+state = Path(sys.argv[1])
+args = sys.argv[2:]
+endpoint = "local"
+if args[:1] == ["-H"]:
+    endpoint, args = args[1], args[2:]
+with open(state / "commands.jsonl", "a") as log:
+    log.write(json.dumps({"endpoint": endpoint, "args": args}) + "\\n")
+
+taken_path = state / "taken.json"
+taken = json.loads(taken_path.read_text()) if taken_path.exists() else {}
+if args[:2] == ["image", "inspect"]:
+    if args[-1].endswith(":missing"):
+        sys.exit("Error: No such image: " + args[-1])
+    print("sha256:" + args[-1].encode().hex())
+elif args[:2] == ["network", "ls"]:
+    print("fats_network")
+elif args[:1] == ["run"]:
+    name = args[args.index("--name") + 1]
+    if args[-1].endswith(":missing"):
+        sys.stderr.write("Unable to find image '" + args[-1] + "' locally\\n")
+        sys.exit(125)
+    if "-p" in args:
+        address, host_port, _ = args[args.index("-p") + 1].rsplit(":", 2)
+        ports = taken.setdefault(endpoint, [])
+        if int(host_port) in ports:
+            sys.stderr.write(
+                "docker: Error response from daemon: driver failed programming external connectivity"
+                f" on endpoint {name}: Bind for {address}:{host_port} failed: port is already allocated.\\n"
+            )
+            sys.exit(125)
+        ports.append(int(host_port))
+        taken_path.write_text(json.dumps(taken))
+    print(name.encode().hex())
+"""
+
+
+class FakeDockerCli:
+    def __init__(self, directory: Path):
+        self.state = directory / "state"
+        self.state.mkdir()
+        self.bin = directory / "bin"
+        self.bin.mkdir()
+        (self.state / "cli.py").write_text(_CLI_SCRIPT)
+        docker = self.bin / "docker"
+        docker.write_text(
+            f'#!/bin/sh\nexec "{sys.executable}" "{self.state / "cli.py"}" "{self.state}" "$@"\n'
+        )
+        docker.chmod(0o755)
+
+    @property
+    def path(self) -> str:
+        return f"{self.bin}{os.pathsep}{os.environ.get('PATH', '')}"
+
+    def take_port(self, endpoint: str, port: int):
+        """Have an engine report a port as already allocated."""
+        taken_path = self.state / "taken.json"
+        taken = json.loads(taken_path.read_text()) if taken_path.exists() else {}
+        taken.setdefault(endpoint, []).append(port)
+        taken_path.write_text(json.dumps(taken))
+
+    def commands(self) -> List[Dict[str, Any]]:
+        log_path = self.state / "commands.jsonl"
+        if not log_path.exists():
+            return []
+        return [json.loads(line) for line in log_path.read_text().splitlines()]
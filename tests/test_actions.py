@@ -0,0 +1,65 @@
+from fatstacks.actions import navigation_uri, request_payload, resolve_params
+from fatstacks.schema.action import (
+    NavigateActionBehavior,
+    ParamFromData,
+    RequestActionBehavior,
+)
+
+
+def test_params_are_resolved_from_data_at_any_depth():
+    data = {"id": 7, "user": "ada"}
+    value = {
+        "id": ParamFromData(fromData="id"),
+        "who": {"fromData": "user"},
+        "list": [{"fromData": "id"}, "literal"],
+        "missing": {"fromData": "nope"},
+        # Only dicts that are nothing but a fromData are params
+        "other": {"fromData": "id", "extra": 1},
+    }
+    assert resolve_params(value, data) == {
+        "id": 7,
+        "who": "ada",
+        "list": [7, "literal"],
+        "missing": None,
+        "other": {"fromData": "id", "extra": 1},
+    }
+
+
+def test_payload_is_merged_with_data_then_form_data():
+    behavior = RequestActionBehavior(
+        type="request",
+        endpoint="/api/save",
+        formToUse="f",
+        payload={"kind": "save", "id": {"fromData": "id"}, "note": "default"},
+    )
+    payload = request_payload(behavior, {"id": 7}, {"note": "typed", "kind": "edited"})
+    assert payload == {"kind": "edited", "id": 7, "note": "typed"}
+
+
+def test_form_data_is_left_out_without_a_form():
+    behavior = RequestActionBehavior(type="request", endpoint="/api/like")
+    assert request_payload(behavior, {"id": 7}, {"note": "typed"}) == {"id": 7}
+
+
+def test_payloads_that_are_not_objects_are_sent_as_they_are():
+    behavior = RequestActionBehavior(
+        type="request", endpoint="/api/tags", payload=["a", {"fromData": "id"}]
+    )
+    assert request_payload(behavior, {"id": 7}) == ["a", 7]
+
+
+def test_navigation_query_params_are_resolved_and_merged():
+    behavior = NavigateActionBehavior(
+        type="navigate",
+        targetUri="surface://detail?tab=info",
+        queryParams={
+            "id": ParamFromData(fromData="id"),
+            "flag": {"fromData": "flag"},
+            "gone": {"fromData": "missing"},
+            "tab": "reviews",
+        },
+    )
+    assert (
+        navigation_uri(behavior, {"id": 7, "flag": True})
+        == "surface://detail?tab=reviews&id=7&flag=true"
+    )
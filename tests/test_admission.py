@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from fats import admission
+from fats.admission import AdmissionLimits, AdmissionRejected, AppAdmission, TokenBucket
+
+
+def test_token_bucket_allows_a_burst_then_waits_for_refill(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=2, capacity=2)
+
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    now[0] += 0.5
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    # Refills never exceed the capacity
+    now[0] += 60
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() > 0
+
+
+def test_rate_limited_requests_are_rejected_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission, "monotonic", lambda: 100.0)
+
+    async def _run():
+        app = AppAdmission(AdmissionLimits(requests_per_second=1))
+        await app.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await app.acquire()
+        return app, rejected.value
+
+    app, rejected = asyncio.run(_run())
+    assert rejected.status == 429
+    assert rejected.retry_after_header == "1"
+    assert app.in_flight == 1
+    assert app.rejected_rate_limited == 1
+
+
+def test_queued_requests_get_released_slots_in_order():
+    async def _run():
+        app = AppAdmission(AdmissionLimits(max_in_flight=1, queue_size=2))
+        await app.acquire()
+        order = []
+
+        async def _queued(name: str):
+            await app.acquire()
+            order.append(name)
+
+        first = asyncio.create_task(_queued("first"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(_queued("second"))
+        await asyncio.sleep(0)
+        assert app.queued == 2
+
+        # The queue is full
+        with pytest.raises(AdmissionRejected) as rejected:
+            await app.acquire()
+        assert rejected.value.status == 503
+
+        app.release()
+        await first
+        assert app.in_flight == 1 and not second.done()
+        app.release()
+        await second
+        app.release()
+        return app, order
+
+    app, order = asyncio.run(_run())
+    assert order == ["first", "second"]
+    assert app.in_flight == 0
+    assert app.admitted == 3
+    assert app.rejected_queue_full == 1
+
+
+def test_queue_wait_times_out(monkeypatch):
+    monkeypatch.setattr(admission, "QUEUE_TIMEOUT_SECONDS", 0.01)
+
+    async def _run():
+        app = AppAdmission(AdmissionLimits(max_in_flight=1))
+        await app.acquire()
+        with pytest.raises(AdmissionRejected):
+            await app.acquire()
+        return app
+
+    app = asyncio.run(_run())
+    assert app.in_flight == 1
+    assert app.queued == 0
+    assert app.rejected_queue_timeout == 1
+
+
+def test_cancelled_waiter_gives_back_a_slot_handed_to_it():
+    async def _run():
+        app = AppAdmission(AdmissionLimits(max_in_flight=1))
+        await app.acquire()
+        waiter = asyncio.create_task(app.acquire())
+        await asyncio.sleep(0)
+        # The slot goes to the waiter, which is cancelled before it gets to run
+        app.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return app
+
+    app = asyncio.run(_run())
+    assert app.in_flight == 0
+    assert app.queued == 0
+
+
+def test_raising_the_limit_admits_queued_requests():
+    async def _run():
+        app = AppAdmission(AdmissionLimits(max_in_flight=1))
+        await app.acquire()
+        waiter = asyncio.create_task(app.acquire())
+        await asyncio.sleep(0)
+        app.update_limits(AdmissionLimits(max_in_flight=2))
+        await waiter
+        return app
+
+    app = asyncio.run(_run())
+    assert app.in_flight == 2
+    assert app.queued == 0
@@ -0,0 +1,66 @@
+import pytest
+
+from fats.autoscaler import desired_replicas
+from fats.models.project_config import ProjectConfig
+
+
+def _app(**settings) -> ProjectConfig:
+    settings = {
+        "min_replicas": 1,
+        "max_replicas": 5,
+        "target_in_flight_per_replica": 10,
+        **settings,
+    }
+    return ProjectConfig(name="app", version="v1", **settings)
+
+
+def test_replicas_stay_within_min_and_max():
+    assert desired_replicas(_app(), 1, 500, None) == 5
+    assert desired_replicas(_app(min_replicas=2), 3, 0, None) == 2
+    # Limits changed below what is running
+    assert desired_replicas(_app(max_replicas=2), 4, 0, None) == 2
+    assert desired_replicas(_app(min_replicas=3), 1, 0, None) == 3
+    # A max below the min is taken as the min
+    assert desired_replicas(_app(min_replicas=3, max_replicas=1), 3, 500, None) == 3
+
+
+def test_scales_out_to_what_the_load_needs():
+    # 10 in flight per replica is the target
+    assert desired_replicas(_app(), 1, 10, None) == 1
+    assert desired_replicas(_app(), 1, 10.5, None) == 2
+    assert desired_replicas(_app(), 2, 35, None) == 4
+
+
+def test_scales_out_one_at_a_time_on_latency():
+    app = _app(target_latency=0.2)
+    assert desired_replicas(app, 2, 5, 0.5) == 3
+    assert desired_replicas(app, 2, 5, 0.15) == 2
+
+
+@pytest.mark.parametrize("load", [18, 15, 12.1, 10])
+def test_no_scale_in_while_load_stays_inside_the_band(load):
+    # Two replicas: one would be more than 60% utilized at these loads, but two aren't overloaded
+    assert desired_replicas(_app(), 2, load, None) == 2
+
+
+def test_scales_in_one_at_a_time_once_the_rest_would_be_lightly_loaded():
+    assert desired_replicas(_app(), 2, 6, None) == 1
+    assert desired_replicas(_app(), 4, 0, None) == 3
+
+
+def test_no_scale_in_while_latency_is_not_well_below_target():
+    app = _app(target_latency=0.2)
+    assert desired_replicas(app, 3, 0, 0.15) == 3
+    assert desired_replicas(app, 3, 0, 0.05) == 2
+
+
+def test_scaling_out_and_back_in_does_not_flap():
+    app = _app()
+    current = 1
+    history = []
+    # Load rises past one replica's target, then hovers just below it
+    for load in [5, 12, 9, 9.5, 8, 9, 7, 6.5]:
+        current = desired_replicas(app, current, load, None)
+        history.append(current)
+    assert history == [1, 2, 2, 2, 2, 2, 2, 2]
+    assert desired_replicas(app, current, 6, None) == 1
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from fats.cache import CachedResponse, ResponseCache, normalize_accept_encoding
+from fats.models.project_config import ProjectConfig
+
+
+def _project() -> ProjectConfig:
+    project = ProjectConfig(name="app", version="v1")
+    project.id = 1
+    return project
+
+
+def _entry(*headers) -> CachedResponse:
+    return CachedResponse(
+        status=200,
+        headers=[("Cache-Control", "max-age=60"), *headers],
+        body=b"body",
+        stored_at=time.time(),
+        lifetime=60,
+    )
+
+
+def _lookup(cache: ResponseCache, accept_encoding=None):
+    headers = {} if accept_encoding is None else {"Accept-Encoding": accept_encoding}
+    return asyncio.run(cache.lookup(_project(), "page", "", headers))
+
+
+def _store(cache: ResponseCache, entry: CachedResponse, accept_encoding: str):
+    asyncio.run(
+        cache.store(_project(), "page", "", {"Accept-Encoding": accept_encoding}, entry)
+    )
+
+
+def test_accept_encoding_is_normalized():
+    assert normalize_accept_encoding("GZIP, br;q=0.5") == "br,gzip"
+    assert normalize_accept_encoding("br, gzip;q=0, zstd;q=0.0") == "br"
+    assert normalize_accept_encoding("") == ""
+
+
+def test_encoded_responses_are_keyed_by_accept_encoding(tmp_path):
+    cache = ResponseCache(1024 * 1024, 0, tmp_path)
+    # The app sent a compressed body without Vary: Accept-Encoding
+    _store(cache, _entry(("Content-Encoding", "br")), "br, gzip")
+
+    assert _lookup(cache, "gzip,br") is not None
+    assert _lookup(cache, "gzip") is None
+    assert _lookup(cache) is None
+
+
+def test_unencoded_responses_are_shared_by_every_client(tmp_path):
+    cache = ResponseCache(1024 * 1024, 0, tmp_path)
+    _store(cache, _entry(), "br, gzip")
+
+    assert _lookup(cache, "gzip") is not None
+    assert _lookup(cache) is not None
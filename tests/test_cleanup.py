@@ -0,0 +1,41 @@
+from fats.cleanup import default_version, versions_to_retire
+from fats.models.project_config import ProjectConfig
+
+
+def _versions(*specs):
+    versions = []
+    for id, (version, deployed_at) in enumerate(specs, start=1):
+        project = ProjectConfig(name="app", version=version, deployed_at=deployed_at)
+        project.id = id
+        versions.append(project)
+    return versions
+
+
+def _retired(versions, retention):
+    return [p.version for p in versions_to_retire(versions, retention)]
+
+
+def test_versions_are_ranked_by_when_they_were_deployed():
+    # v1 was uploaded again after v3, so it is among the newest despite its id, and v4 is what
+    # unversioned requests go to
+    versions = _versions(("v1", 400.0), ("v2", 200.0), ("v3", 300.0), ("v4", 100.0))
+    assert _retired(versions, 3) == ["v2"]
+
+
+def test_latest_is_kept_on_top_of_the_retention():
+    versions = _versions(("latest", 100.0), ("v1", 200.0), ("v2", 300.0), ("v3", 400.0))
+    assert default_version(versions).version == "latest"
+    assert _retired(versions, 2) == ["v1"]
+
+
+def test_the_default_version_is_never_retired():
+    # Unversioned requests go to v9, the highest version, even if it is the oldest upload
+    versions = _versions(("v9", 100.0), ("v1", 200.0), ("v2", 300.0))
+    assert default_version(versions).version == "v9"
+    assert _retired(versions, 2) == ["v1"]
+    assert _retired(versions, 1) == ["v2", "v1"]
+
+
+def test_versions_deployed_before_timestamps_rank_by_id():
+    versions = _versions(("a", None), ("b", None), ("c", None), ("z", None))
+    assert _retired(versions, 2) == ["b", "a"]
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from fats import coalescing
+from fats.coalescing import Flight, SubscriberStalled
+
+CHUNKS = [bytes([i]) * 4 for i in range(10)]
+
+
+def _fetch_chunks(produced: list):
+    async def _body():
+        for chunk in CHUNKS:
+            produced.append(chunk)
+            yield chunk
+
+    async def _fetch():
+        return 200, {}, _body()
+
+    return _fetch
+
+
+async def _read(flight: Flight, subscriber: int, delay: float = 0) -> bytes:
+    received = b""
+    async for chunk in flight.stream(subscriber):
+        received += chunk
+        await asyncio.sleep(delay)
+    return received
+
+
+async def _subscribe(flight: Flight) -> int:
+    return flight.subscribe()
+
+
+def test_producer_waits_for_the_slowest_subscriber():
+    async def _run():
+        produced = []
+        flight = Flight("key", buffer_bytes=8)
+        fast, slow = flight.subscribe(), flight.subscribe()
+        flight.start(_fetch_chunks(produced))
+        fast_task = asyncio.create_task(_read(flight, fast))
+        slow_stream = flight.stream(slow)
+        assert await anext(slow_stream) == CHUNKS[0]
+        await asyncio.sleep(0.05)
+        # The buffer holds 8 bytes beyond what the slow subscriber read, plus the chunk that filled it
+        assert len(produced) <= 4
+        assert not fast_task.done()
+        rest = b"".join([chunk async for chunk in slow_stream])
+        return CHUNKS[0] + rest, await fast_task
+
+    slow, fast = asyncio.run(_run())
+    assert slow == fast == b"".join(CHUNKS)
+
+
+def test_subscriber_whose_task_ends_before_reading_is_dropped():
+    async def _run():
+        produced = []
+        flight = Flight("key", buffer_bytes=8)
+        reader = flight.subscribe()
+        # Like a request whose client went away before Quart started sending the body
+        abandoned = await asyncio.create_task(_subscribe(flight))
+        assert abandoned in flight._positions
+        flight.start(_fetch_chunks(produced))
+        received = await asyncio.wait_for(_read(flight, reader), 1)
+        return received, flight
+
+    received, flight = asyncio.run(_run())
+    assert received == b"".join(CHUNKS)
+    assert flight.subscribers == 0
+
+
+def test_stalled_subscriber_is_evicted(monkeypatch):
+    monkeypatch.setattr(coalescing, "SUBSCRIBER_STALL_SECONDS", 0.1)
+
+    async def _run():
+        produced = []
+        flight = Flight("key", buffer_bytes=8)
+        reader, stalled = flight.subscribe(), flight.subscribe()
+        flight.start(_fetch_chunks(produced))
+        stalled_stream = flight.stream(stalled)
+        assert await anext(stalled_stream) == CHUNKS[0]
+        received = await asyncio.wait_for(_read(flight, reader), 1)
+        with pytest.raises(SubscriberStalled):
+            await anext(stalled_stream)
+        return received
+
+    assert asyncio.run(_run()) == b"".join(CHUNKS)
@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+from fatstacks.delta import (
+    DeltaMismatch,
+    SurfaceHistory,
+    apply_delta,
+    diff_surfaces,
+    with_revision,
+)
+from fatstacks.schema.delta import DeltaOperationType, SurfaceDelta
+from fatstacks.schema.surface import Surface
+from fatstacks.validation import validate
+
+
+def _item(item_id: str, text: str = "") -> dict:
+    return {"id": item_id, "content": text or item_id, "data": None}
+
+
+def _surface(item_ids, name: str = "Surface", forms=None, **items) -> Surface:
+    return with_revision(
+        Surface(
+            id="surface",
+            name=name,
+            items=[items.get(i, _item(i)) for i in item_ids],
+            forms=forms,
+        )
+    )
+
+
+def _round_trip(old: Surface, new: Surface) -> SurfaceDelta:
+    delta = diff_surfaces(old, new)
+    # As the client receives it
+    delta = validate(SurfaceDelta, delta.model_dump_json())
+    assert apply_delta(old, delta) == new
+    return delta
+
+
+def _ops(delta: SurfaceDelta):
+    return [(o.op.value, o.id, o.index) for o in delta.items]
+
+
+def test_unchanged_surface_has_an_empty_delta():
+    surface = _surface("abc")
+    delta = _round_trip(surface, _surface("abc"))
+    assert (delta.fields, delta.items, delta.forms) == ({}, [], [])
+
+
+def test_changed_items_are_replaced_and_new_ones_added_in_place():
+    old = _surface("abc")
+    new = _surface("abxc", b=_item("b", "changed"))
+    assert _ops(_round_trip(old, new)) == [("replace", "b", None), ("add", "x", 2)]
+
+
+def test_removed_items_are_removed():
+    assert _ops(_round_trip(_surface("abcd"), _surface("ad"))) == [
+        ("remove", "b", None),
+        ("remove", "c", None),
+    ]
+
+
+def test_only_items_that_left_their_relative_order_move():
+    # Moving one item to the front leaves the rest where they were relative to each other
+    delta = _round_trip(_surface("abcde"), _surface("eabcd"))
+    assert _ops(delta) == [("remove", "e", None), ("add", "e", 0)]
+
+
+def test_surface_fields_and_forms_are_sent_when_they_change():
+    form = {"id": "f", "name": None, "inputFields": [{"type": "text", "name": "note"}]}
+    old = _surface("ab")
+    new = _surface("ab", name="Renamed", forms=[form])
+    delta = _round_trip(old, new)
+    assert delta.fields == {"name": "Renamed", "forms": []}
+    assert [(o.op, o.id) for o in delta.forms] == [(DeltaOperationType.ADD, "f")]
+
+    # And back to having no forms at all, rather than an empty list
+    assert _round_trip(new, old).fields == {"name": "Surface", "forms": None}
+
+
+def test_random_edits_round_trip():
+    rng = random.Random(43)
+    for _ in range(200):
+        old_ids = rng.sample("abcdefghijklmnop", rng.randint(0, 10))
+        new_ids = [i for i in old_ids if rng.random() > 0.2]
+        if rng.random() > 0.5:
+            rng.shuffle(new_ids)
+        for extra in rng.sample("qrstuvwxyz", rng.randint(0, 3)):
+            new_ids.insert(rng.randint(0, len(new_ids)), extra)
+        changed = {i: _item(i, "changed") for i in new_ids if rng.random() > 0.8}
+        _round_trip(_surface(old_ids), _surface(new_ids, **changed))
+
+
+def test_delta_for_another_revision_is_refused():
+    delta = diff_surfaces(_surface("ab"), _surface("abc"))
+    with pytest.raises(DeltaMismatch):
+        apply_delta(_surface("ax"), delta)
+
+
+def test_delta_that_does_not_produce_its_revision_is_refused():
+    old = _surface("ab")
+    delta = diff_surfaces(old, _surface("abc"))
+    delta.items[0].index = 0
+    with pytest.raises(DeltaMismatch):
+        apply_delta(old, delta)
+
+
+def test_history_answers_recent_revisions_only():
+    history = SurfaceHistory(length=2)
+    first = history.record(_surface("a"))
+    second = history.record(_surface("ab"))
+    assert _ops(history.changes_since(first.revision)) == [("add", "b", 1)]
+    history.record(_surface("abc"))
+    assert history.changes_since(first.revision) is None
+    assert _ops(history.changes_since(second.revision)) == [("add", "c", 2)]
+    assert history.changes_since("unknown") is None
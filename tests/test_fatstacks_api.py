@@ -0,0 +1,46 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from fats import main
+from fats.compression import negotiate_encoding
+
+
+def _get_schema(headers):
+    async def _run():
+        response = await main.app.test_client().get(
+            "/mgmt/fatstacks/schema/surface", headers=headers
+        )
+        return response, await response.get_data()
+
+    return asyncio.run(_run())
+
+
+def test_browsers_get_the_precomputed_gzip_schema():
+    response, body = _get_schema({"Accept-Encoding": "gzip, deflate, br, zstd"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"].endswith('-gzip"')
+    assert json.loads(gzip.decompress(body))["title"] == "Surface"
+
+
+def test_clients_without_a_precomputed_encoding_get_identity():
+    response, body = _get_schema({"Accept-Encoding": "zstd, br"})
+    assert "Content-Encoding" not in response.headers
+    assert json.loads(body)["title"] == "Surface"
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, available, expected",
+    [
+        ("gzip, deflate, br, zstd", None, "zstd"),
+        ("gzip, deflate, br, zstd", ["gzip"], "gzip"),
+        ("zstd;q=0.5, gzip", None, "gzip"),
+        ("*", ["gzip"], "gzip"),
+        ("gzip;q=0", ["gzip"], None),
+        ("", None, None),
+    ],
+)
+def test_encoding_is_negotiated_among_the_available_ones(accept_encoding, available, expected):
+    assert negotiate_encoding(accept_encoding, available) == expected
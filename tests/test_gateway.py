@@ -0,0 +1,308 @@
+import asyncio
+import json
+from typing import Callable, Dict, List, Tuple
+
+import pytest
+
+from fats import gateway, main
+from fats.gateway import invalidate_gateway_project
+from fats.models.project_config import ProjectConfig
+from fats.models.service_entry import ServiceEntry
+from fats.proxy import ProxyTarget
+
+AppResponse = Tuple[int, Dict[str, str], bytes]
+
+
+class _FakeApp:
+    """A fatstacks provider on a local port, answering each path with what `routes` returns for it."""
+
+    def __init__(self):
+        self.routes: Dict[str, Callable[[Dict[str, str]], AppResponse]] = {}
+        self.requests: List[Tuple[str, str, Dict[str, str], bytes]] = []
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            try:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin1")
+            except asyncio.IncompleteReadError:
+                break
+            lines = head.split("\r\n")
+            method, target, _ = lines[0].split(" ")
+            headers = dict(line.lower().split(": ", 1) for line in lines[1:] if line)
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            self.requests.append((method, target, headers, body))
+            path = target.split("?", 1)[0]
+            route = self.routes.get(path)
+            status, response_headers, response_body = (
+                route(headers) if route else (404, {}, b"")
+            )
+            response_headers = {**response_headers, "Content-Length": str(len(response_body))}
+            writer.write(
+                f"HTTP/1.1 {status} X\r\n".encode()
+                + "".join(f"{k}: {v}\r\n" for k, v in response_headers.items()).encode()
+                + b"\r\n"
+                + response_body
+            )
+            await writer.drain()
+        writer.close()
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self._server.close()
+
+    def paths(self) -> List[str]:
+        return [target for _, target, _, _ in self.requests]
+
+
+def _surface(*item_ids: str) -> bytes:
+    items = [{"id": i, "content": i, "data": None} for i in item_ids]
+    return json.dumps({"id": "home", "name": "Home", "items": items}).encode()
+
+
+def _json(body: bytes, **headers: str) -> AppResponse:
+    return 200, {"Content-Type": "application/json", **headers}, body
+
+
+@pytest.fixture(autouse=True)
+def _empty_gateway(monkeypatch):
+    monkeypatch.setattr(gateway, "_documents", gateway.OrderedDict())
+    monkeypatch.setattr(gateway, "_sizes", {})
+    monkeypatch.setattr(gateway, "_used_bytes", 0)
+    monkeypatch.setattr(
+        gateway, "_stats", {"hits": 0, "revalidated": 0, "unchanged": 0, "validated": 0}
+    )
+
+
+@pytest.fixture
+def fake_app(monkeypatch):
+    """A fake provider deployed as the app "docs", with project config id 1."""
+    app = _FakeApp()
+    targets: Dict[str, ProxyTarget] = {}
+
+    async def _target(app_name: str):
+        if "docs" not in targets:
+            project = ProjectConfig(name="docs", version="v1")
+            project.id = 1
+            entry = ServiceEntry(
+                service_number=1,
+                container_id="abc",
+                hostname="127.0.0.1",
+                port=await app.start(),
+                project_config_id=1,
+            )
+            targets["docs"] = ProxyTarget(project, [entry])
+        return targets.get(app_name)
+
+    monkeypatch.setattr(gateway, "get_target_from_app_name", _target)
+    return app
+
+
+def _get_all(fake_app: _FakeApp, *requests: Tuple[str, Dict[str, str]]):
+    """Make requests to the gateway in turn."""
+
+    async def _run():
+        client = main.app.test_client()
+        responses = []
+        for path, headers in requests:
+            responses.append(await client.get(path, headers=headers))
+        fake_app.close()
+        return responses
+
+    return asyncio.run(_run())
+
+
+def _sources(responses) -> List[str]:
+    return [r.headers.get("X-Fats-Gateway") for r in responses]
+
+
+def test_fresh_documents_are_served_from_the_cache_per_query(fake_app):
+    fake_app.routes["/surfaces/home"] = lambda h: _json(_surface("a"), **{"Cache-Control": "max-age=60"})
+    responses = _get_all(
+        fake_app,
+        ("/fatstacks/docs/surfaces/home", {}),
+        ("/fatstacks/docs/surfaces/home", {}),
+        ("/fatstacks/docs/surfaces/home?cursor=a", {}),
+        ("/fatstacks/docs/surfaces/home?cursor=a", {}),
+    )
+    assert _sources(responses) == ["MISS", "HIT", "MISS", "HIT"]
+    assert fake_app.paths() == ["/surfaces/home", "/surfaces/home?cursor=a"]
+
+
+def test_stale_documents_are_revalidated_with_the_apps_etag(fake_app):
+    def _home(headers):
+        if headers.get("if-none-match") == '"v1"':
+            return 304, {"ETag": '"v1"'}, b""
+        return _json(_surface("a"), ETag='"v1"', **{"Cache-Control": "max-age=0"})
+
+    fake_app.routes["/surfaces/home"] = _home
+    first, second = _get_all(
+        fake_app,
+        ("/fatstacks/docs/surfaces/home", {}),
+        ("/fatstacks/docs/surfaces/home", {}),
+    )
+    assert _sources([first, second]) == ["MISS", "REVALIDATED"]
+    assert fake_app.requests[1][2]["if-none-match"] == '"v1"'
+    assert first.headers["ETag"] == second.headers["ETag"]
+
+
+def test_unchanged_content_is_not_validated_again(fake_app):
+    fake_app.routes["/surfaces/home"] = lambda h: _json(_surface("a"))
+    responses = _get_all(
+        fake_app,
+        ("/fatstacks/docs/surfaces/home", {}),
+        ("/fatstacks/docs/surfaces/home", {}),
+    )
+    assert _sources(responses) == ["MISS", "UNCHANGED"]
+    assert gateway._stats["validated"] == 1
+
+
+@pytest.mark.parametrize(
+    "response_headers, request_headers",
+    [
+        ({"Cache-Control": "private, max-age=60"}, {}),
+        ({"Cache-Control": "max-age=60", "Set-Cookie": "session=1"}, {}),
+        ({"Cache-Control": "max-age=60", "Vary": "Cookie"}, {}),
+        ({"Cache-Control": "max-age=60"}, {"Authorization": "Bearer token"}),
+    ],
+)
+def test_documents_for_one_client_are_not_kept(fake_app, response_headers, request_headers):
+    fake_app.routes["/surfaces/home"] = lambda h: _json(_surface("a"), **response_headers)
+    responses = _get_all(
+        fake_app,
+        ("/fatstacks/docs/surfaces/home", request_headers),
+        ("/fatstacks/docs/surfaces/home", request_headers),
+    )
+    assert _sources(responses) == ["MISS", "MISS"]
+    assert not gateway._documents
+
+
+def test_authorized_documents_the_app_marks_public_are_kept(fake_app):
+    fake_app.routes["/surfaces/home"] = lambda h: _json(
+        _surface("a"), **{"Cache-Control": "public, max-age=60"}
+    )
+    headers = {"Authorization": "Bearer token"}
+    responses = _get_all(
+        fake_app,
+        ("/fatstacks/docs/surfaces/home", headers),
+        ("/fatstacks/docs/surfaces/home", headers),
+    )
+    assert _sources(responses) == ["MISS", "HIT"]
+
+
+def test_redeploying_drops_the_apps_documents(fake_app):
+    fake_app.routes["/surfaces/home"] = lambda h: _json(_surface("a"), **{"Cache-Control": "max-age=60"})
+
+    async def _run():
+        client = main.app.test_client()
+        first = await client.get("/fatstacks/docs/surfaces/home")
+        invalidate_gateway_project(1)
+        second = await client.get("/fatstacks/docs/surfaces/home")
+        fake_app.close()
+        return [first, second]
+
+    assert _sources(asyncio.run(_run())) == ["MISS", "MISS"]
+    assert len(fake_app.requests) == 2
+
+
+def test_since_answers_with_the_changes_from_a_known_revision(fake_app):
+    items = ["a", "b"]
+    fake_app.routes["/surfaces/home"] = lambda h: _json(_surface(*items))
+
+    async def _run():
+        client = main.app.test_client()
+        first = await (await client.get("/fatstacks/docs/surfaces/home")).get_json()
+        items.append("c")
+        latest = await (await client.get("/fatstacks/docs/surfaces/home")).get_json()
+        delta = await client.get(f"/fatstacks/docs/surfaces/home?since={first['revision']}")
+        current = await client.get(f"/fatstacks/docs/surfaces/home?since={latest['revision']}")
+        unknown = await client.get("/fatstacks/docs/surfaces/home?since=unknown")
+        fake_app.close()
+        return first, latest, await delta.get_json(), current, await unknown.get_json()
+
+    first, latest, delta, current, unknown = asyncio.run(_run())
+    assert first["revision"] != latest["revision"]
+    assert (delta["fromRevision"], delta["revision"]) == (first["revision"], latest["revision"])
+    assert [(op["op"], op["id"]) for op in delta["items"]] == [("add", "c")]
+    assert current.status_code == 304
+    # Revisions the gateway doesn't know get the whole surface
+    assert unknown == latest
+    # since is not passed on to the app
+    assert all("since" not in path for path in fake_app.paths())
+
+
+ACTIONS_SURFACE = {
+    "id": "home",
+    "name": "Home",
+    "items": [],
+    "forms": [{"id": "f", "name": None, "inputFields": [{"type": "text", "name": "note"}]}],
+    "actions": [
+        {
+            "id": "save",
+            "behavior": [
+                {
+                    "type": "request",
+                    "endpoint": "/api/save?src=gateway",
+                    "formToUse": "f",
+                    "payload": {"kind": "save", "who": {"fromData": "user"}},
+                },
+                {"type": "request", "endpoint": "https://other.example/hook"},
+                {"type": "request", "endpoint": "/api/fail"},
+                {"type": "toast", "message": "never shown"},
+            ],
+        },
+    ],
+}
+
+
+def _run_action(fake_app: _FakeApp, options: Dict[str, object]):
+    fake_app.routes["/surfaces/home"] = lambda h: _json(json.dumps(ACTIONS_SURFACE).encode())
+    fake_app.routes["/api/save"] = lambda h: _json(b'{"saved": true}')
+    fake_app.routes["/api/fail"] = lambda h: (409, {}, b"conflict")
+
+    async def _run():
+        response = await main.app.test_client().post(
+            "/fatstacks/docs/surfaces/home/actions/save", json=options
+        )
+        fake_app.close()
+        return response.status_code, await response.get_json()
+
+    return asyncio.run(_run())
+
+
+def test_action_runs_behaviors_until_one_fails(fake_app):
+    status, result = _run_action(
+        fake_app, {"data": {"user": "ada"}, "formData": {"note": "hi"}}
+    )
+    assert status == 200
+    assert result["completed"] is False
+    save, external, fail = result["results"]
+    assert (save["executed"], save["status"], save["body"]) == (True, 200, {"saved": True})
+    assert (fail["executed"], fail["status"], fail["body"]) == (True, 409, "conflict")
+
+    requests = [(m, t, json.loads(b)) for m, t, _, b in fake_app.requests if m == "POST"]
+    # The payload's params resolved, merged with the item's data and then the form's
+    assert requests == [
+        ("POST", "/api/save?src=gateway", {"kind": "save", "who": "ada", "user": "ada", "note": "hi"}),
+        ("POST", "/api/fail", {"user": "ada"}),
+    ]
+
+
+def test_external_endpoints_are_returned_instead_of_fetched(fake_app):
+    _, result = _run_action(fake_app, {"data": {}, "formData": {}})
+    external = result["results"][1]
+    assert external == {
+        "type": "request",
+        "endpoint": "https://other.example/hook",
+        "executed": False,
+        "payload": {},
+    }
+    assert all("other.example" not in target for _, target, _, _ in fake_app.requests)
+
+
+def test_action_needing_a_form_is_refused_without_its_data(fake_app):
+    status, _ = _run_action(fake_app, {"data": {}})
+    assert status == 400
+    assert [m for m, _, _, _ in fake_app.requests] == ["GET"]
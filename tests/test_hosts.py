@@ -0,0 +1,155 @@
+import asyncio
+from itertools import chain, repeat
+
+import pytest
+from fake_docker import FakeDockerCli, FakeEngine
+
+from fats import hosts, network, runner
+from fats.hosts import (
+    LOCAL_HOST,
+    DockerHost,
+    fetch_host_info,
+    parse_docker_hosts,
+    place_replicas,
+    publish_address,
+)
+from fats.models.project_config import ProjectConfig
+
+
+@pytest.fixture(autouse=True)
+def _no_hosts(monkeypatch):
+    monkeypatch.setattr(
+        hosts, "_hosts", {LOCAL_HOST: DockerHost(name=LOCAL_HOST, endpoint=None)}
+    )
+    monkeypatch.setattr(hosts, "_host_info", {})
+
+
+def _add_host(monkeypatch, name: str, endpoint: str, address: str = "10.0.0.5"):
+    monkeypatch.setitem(
+        hosts._hosts, name, DockerHost(name=name, endpoint=endpoint, address=address)
+    )
+
+
+def test_docker_hosts_are_parsed():
+    parsed = parse_docker_hosts(
+        "edge1=tcp://10.0.0.5:2375, edge2=ssh://fats@edge2@10.0.0.6,"
+    )
+    assert parsed["edge1"] == DockerHost("edge1", "tcp://10.0.0.5:2375", "10.0.0.5")
+    assert parsed["edge2"] == DockerHost("edge2", "ssh://fats@edge2", "10.0.0.6")
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["edge1", "=tcp://10.0.0.5:2375", "local=tcp://10.0.0.5:2375", "edge1=unix:///run/edge1.sock"],
+)
+def test_invalid_docker_hosts_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_docker_hosts(value)
+
+
+def test_host_info_is_read_from_the_engine_api(monkeypatch, tmp_path):
+    async def _run():
+        tcp_engine, unix_engine = FakeEngine(), FakeEngine({"NCPU": 2})
+        _add_host(monkeypatch, "tcp", await tcp_engine.start_tcp())
+        _add_host(monkeypatch, "unix", await unix_engine.start_unix(tmp_path / "docker.sock"))
+        tcp_info = await fetch_host_info(hosts._hosts["tcp"])
+        # Cached for a while
+        await fetch_host_info(hosts._hosts["tcp"])
+        unix_info = await fetch_host_info(hosts._hosts["unix"])
+        await tcp_engine.stop()
+        await unix_engine.stop()
+        return tcp_engine, tcp_info, unix_info
+
+    engine, tcp_info, unix_info = asyncio.run(_run())
+    assert engine.requests == ["GET /info"]
+    assert (tcp_info.cpus, tcp_info.containers_running) == (4, 2)
+    assert unix_info.cpus == 2
+
+
+def test_replicas_spread_over_reachable_engines(monkeypatch, tmp_path):
+    async def _run():
+        local, busy, idle = FakeEngine(), FakeEngine({"NCPU": 1, "ContainersRunning": 8}), FakeEngine()
+        monkeypatch.setenv("DOCKER_HOST", await local.start_unix(tmp_path / "local.sock"))
+        _add_host(monkeypatch, "busy", await busy.start_tcp())
+        _add_host(monkeypatch, "idle", await idle.start_tcp())
+        unreachable = FakeEngine()
+        _add_host(monkeypatch, "gone", await unreachable.start_tcp())
+        await unreachable.stop()
+
+        placements = await place_replicas([LOCAL_HOST], 3)
+        for engine in (local, busy, idle):
+            await engine.stop()
+        return placements
+
+    placements = asyncio.run(_run())
+    assert "gone" not in placements
+    # The two engines without a replica first, the less loaded one before the busy one
+    assert placements[:2] == ["idle", "busy"]
+
+
+def test_publish_address_resolves_to_an_ip(monkeypatch):
+    _add_host(monkeypatch, "ip", "tcp://10.0.0.5:2375", "10.0.0.5")
+    _add_host(monkeypatch, "v6", "tcp://[fd00::5]:2375", "fd00::5")
+    _add_host(monkeypatch, "name", "tcp://localhost:2375", "localhost")
+
+    assert asyncio.run(publish_address("ip")) == "10.0.0.5"
+    assert asyncio.run(publish_address("v6")) == "[fd00::5]"
+    assert asyncio.run(publish_address("name")) in ("127.0.0.1", "[::1]")
+
+
+@pytest.fixture
+def docker_cli(monkeypatch, tmp_path) -> FakeDockerCli:
+    cli = FakeDockerCli(tmp_path)
+    monkeypatch.setenv("PATH", cli.path)
+    monkeypatch.setattr(network, "_does_network_exist_cache", set())
+    return cli
+
+
+def _app(version: str = "v1") -> ProjectConfig:
+    app = ProjectConfig(name="app", version=version)
+    app.id = 1
+    return app
+
+
+def _pick_ports(monkeypatch, *ports: int):
+    # The container name's salt and then the ports, in the order create_container_for_app asks
+    picks = chain([1234], ports, repeat(ports[-1]))
+    monkeypatch.setattr(runner, "randint", lambda low, high: next(picks))
+
+
+def test_remote_containers_publish_on_the_engine_address_only(monkeypatch, docker_cli):
+    _add_host(monkeypatch, "edge1", "tcp://10.0.0.5:2375")
+    _pick_ports(monkeypatch, 25000)
+
+    entry = asyncio.run(runner.create_container_for_app(_app(), 1, "edge1"))
+    run = next(c["args"] for c in docker_cli.commands() if c["args"][0] == "run")
+    assert run[run.index("-p") + 1] == "10.0.0.5:25000:25000"
+    assert "PORT=25000" in run
+    assert (entry.port, entry.docker_host) == (25000, "edge1")
+
+
+def test_taken_ports_are_swapped_for_another(monkeypatch, docker_cli):
+    _add_host(monkeypatch, "edge1", "tcp://10.0.0.5:2375")
+    docker_cli.take_port("tcp://10.0.0.5:2375", 25000)
+    _pick_ports(monkeypatch, 25000, 25001)
+
+    entry = asyncio.run(runner.create_container_for_app(_app(), 1, "edge1"))
+    commands = [c["args"][:2] for c in docker_cli.commands() if c["args"][0] in ("run", "rm")]
+    # The container docker created for the first attempt is removed before the second
+    assert commands == [["run", "-d"], ["rm", "-f"], ["run", "-d"]]
+    assert entry.port == 25001
+
+
+def test_other_failures_are_not_retried(monkeypatch, docker_cli):
+    _add_host(monkeypatch, "edge1", "tcp://10.0.0.5:2375")
+    _pick_ports(monkeypatch, 25000)
+    # Present on the local engine, but docker run can't find it
+    monkeypatch.setattr(runner, "ensure_image_on_host", _nothing)
+
+    with pytest.raises(RuntimeError, match="Unable to find image"):
+        asyncio.run(runner.create_container_for_app(_app("missing"), 1, "edge1"))
+    assert [c["args"][0] for c in docker_cli.commands()].count("run") == 1
+
+
+async def _nothing(*args):
+    pass
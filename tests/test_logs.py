@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from fats import logs, main
+from fats.logs import AppLogBuffer
+from fats.models.project_config import ProjectConfig
+from fats.proxy import ProxyTarget
+
+
+def _follow(monkeypatch, headers=None):
+    """Follow an app's logs, with a line logged between taking the backlog and sending it."""
+    project = ProjectConfig(name="app", version="v1")
+    project.id = 1
+    buffer = AppLogBuffer()
+
+    async def _target(app_name: str):
+        return ProxyTarget(project, [])
+
+    monkeypatch.setattr(main, "get_target_from_app_name", _target)
+    monkeypatch.setattr(main, "find_log_buffer", lambda project_config_id: buffer)
+
+    async def _run():
+        await buffer.append("2026-01-01T00:00:01Z", "c", "stdout", "one")
+        await buffer.append("2026-01-01T00:00:02Z", "c", "stdout", "two")
+        async with main.app.test_request_context(
+            "/mgmt/apps/app/logs?follow=1&tail=2", headers=headers
+        ):
+            response = await main.handle_app_logs("app")
+        await buffer.append("2026-01-01T00:00:03Z", "c", "stdout", "three")
+        seqs = []
+        async with response.response as body:
+            async for event in body:
+                if event.startswith(b"id: "):
+                    seqs.append(json.loads(event.split(b"data: ", 1)[1])["seq"])
+                if seqs[-1:] == [3]:
+                    break
+        return seqs, buffer
+
+    return asyncio.run(_run())
+
+
+def test_following_resumes_right_after_the_backlog(monkeypatch):
+    seqs, buffer = _follow(monkeypatch)
+    assert seqs == [1, 2, 3]
+    # Closing the response stops following the buffer
+    assert not buffer._changed._waiters
+
+
+def test_reconnecting_follower_gets_every_line_after_its_last_event_id(monkeypatch):
+    seqs, _ = _follow(monkeypatch, {"Last-Event-ID": "2"})
+    assert seqs == [3]
+
+
+def test_log_buffers_are_listed_in_the_metrics(monkeypatch):
+    buffer = AppLogBuffer()
+    monkeypatch.setattr(logs, "_buffers", {1: buffer})
+
+    async def _run():
+        await buffer.append("2026-01-01T00:00:01Z", "c", "stdout", "one")
+        response = await main.app.test_client().get("/mgmt/metrics")
+        return await response.get_json()
+
+    metrics = asyncio.run(_run())
+    assert metrics["logs"]["1"]["lines"] == 1
+    assert metrics["logs"]["1"]["last_seq"] == 1
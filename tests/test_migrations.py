@@ -0,0 +1,66 @@
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from fats.models.project_config import ProjectConfig
+from fats.models.service_entry import ServiceEntry
+from fats.utils.sqlite import Base, add_missing_columns
+
+# The tables as the first release of fats created them
+BASELINE_SCHEMA = [
+    """CREATE TABLE project_config (
+        name VARCHAR NOT NULL, version VARCHAR NOT NULL, id INTEGER NOT NULL,
+        desired_secrets JSON NOT NULL, PRIMARY KEY (id),
+        CONSTRAINT uix_name_version UNIQUE (name, version))""",
+    """CREATE TABLE service_entry (
+        id INTEGER NOT NULL, service_number INTEGER NOT NULL, container_id VARCHAR NOT NULL,
+        hostname VARCHAR NOT NULL, port INTEGER NOT NULL, project_config_id INTEGER NOT NULL,
+        PRIMARY KEY (id), FOREIGN KEY(project_config_id) REFERENCES project_config (id))""",
+    """INSERT INTO project_config (name, version, id, desired_secrets)
+        VALUES ('app', 'v1', 1, '["TOKEN"]')""",
+    """INSERT INTO service_entry
+        (id, service_number, container_id, hostname, port, project_config_id)
+        VALUES (1, 3, 'abc', 'fats-appv1-1234', 25000, 1)""",
+]
+
+
+def _baseline_engine():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.exec_driver_sql(statement)
+    return engine
+
+
+def test_existing_rows_get_column_defaults():
+    engine = _baseline_engine()
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        added = add_missing_columns(conn)
+    assert "project_config.max_in_flight" in added
+    assert "service_entry.docker_host" in added
+
+    with Session(engine) as session:
+        project = session.execute(select(ProjectConfig)).scalar_one()
+        entry = session.execute(select(ServiceEntry)).scalar_one()
+    assert project.desired_secrets == ["TOKEN"]
+    assert project.max_in_flight is None
+    assert project.min_replicas == 1 and project.max_replicas == 1
+    assert project.edge_compression is True
+    assert project.coalesce_requests is False
+    assert project.static_dirs == []
+    assert entry.docker_host == "local"
+
+
+def test_adding_columns_is_idempotent():
+    engine = _baseline_engine()
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        add_missing_columns(conn)
+        assert add_missing_columns(conn) == []
+
+
+def test_new_databases_need_no_columns():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        assert add_missing_columns(conn) == []
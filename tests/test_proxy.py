@@ -0,0 +1,293 @@
+import asyncio
+import socket
+from itertools import count
+from typing import Dict, List
+
+import pytest
+from quart import Response
+
+from fats import main, proxy
+from fats.admission import get_admission
+from fats.models.project_config import ProjectConfig
+from fats.models.service_entry import ServiceEntry
+from fats.proxy import (
+    ProxyTarget,
+    _no_body,
+    _open_upstream,
+    _pending_releases,
+    _send_to_replicas,
+    upstream_in_flight,
+)
+
+
+async def _serve_upstream():
+    async def _respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello")
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    return await asyncio.start_server(_respond, "127.0.0.1", 0)
+
+
+def _target(name: str, port: int, **settings) -> ProxyTarget:
+    project = ProjectConfig(name=name, version="v1", **settings)
+    entry = ServiceEntry(
+        service_number=1,
+        container_id="abc",
+        hostname="127.0.0.1",
+        port=port,
+        project_config_id=1,
+    )
+    return ProxyTarget(project, [entry])
+
+
+def test_response_dropped_before_its_body_releases_the_upstream():
+    async def _run():
+        server = await _serve_upstream()
+        target = _target("dropped", server.sockets[0].getsockname()[1])
+        # Like a client that went away once the handler returned, the body is never iterated
+        opened = await asyncio.create_task(
+            _open_upstream(target, "", {}, _no_body, "GET", "")
+        )
+        assert opened.status == 200
+        while _pending_releases:
+            await asyncio.gather(*_pending_releases)
+        server.close()
+        return target
+
+    target = asyncio.run(_run())
+    assert get_admission(target.project).in_flight == 0
+    assert upstream_in_flight(target.service_entries[0]) == 0
+
+
+def test_streamed_response_releases_the_upstream_once():
+    async def _run():
+        server = await _serve_upstream()
+        target = _target("streamed", server.sockets[0].getsockname()[1])
+
+        async def _proxy():
+            opened = await _open_upstream(target, "", {}, _no_body, "GET", "")
+            return b"".join([chunk async for chunk in opened.body()])
+
+        body = await asyncio.create_task(_proxy())
+        assert not _pending_releases
+        server.close()
+        return target, body
+
+    target, body = asyncio.run(_run())
+    assert body == b"hello"
+    assert get_admission(target.project).in_flight == 0
+    assert upstream_in_flight(target.service_entries[0]) == 0
+
+
+async def _serve_slowly(response_delay: float, body_delay: float):
+    """An upstream that reads the whole request, then takes its time with the response."""
+
+    async def _respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await reader.readuntil(b"\r\n\r\n")
+        await reader.readuntil(b"0\r\n\r\n")
+        await asyncio.sleep(response_delay)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n")
+        await writer.drain()
+        await asyncio.sleep(body_delay)
+        writer.write(b"hello")
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    return await asyncio.start_server(_respond, "127.0.0.1", 0)
+
+
+async def _slow_upload():
+    for _ in range(3):
+        await asyncio.sleep(0.15)
+        yield b"part"
+
+
+def _send_slow_upload(name: str, response_delay: float, body_delay: float):
+    async def _run():
+        server = await _serve_slowly(response_delay, body_delay)
+        target = _target(
+            name, server.sockets[0].getsockname()[1], first_byte_timeout=0.3
+        )
+        sent = await _send_to_replicas(target, "", {}, _slow_upload, "POST", "")
+        if isinstance(sent, Response):
+            result = sent.status_code, None
+        else:
+            result = sent.response.status_code, await sent.response.aread()
+            await sent.response.aclose()
+        server.close()
+        return result
+
+    return asyncio.run(_run())
+
+
+def test_first_byte_timeout_starts_once_the_body_is_sent():
+    # The upload alone takes longer than the first byte timeout, and so does reading the body
+    assert _send_slow_upload("slow-upload", 0.1, 0.4) == (200, b"hello")
+
+
+def test_first_byte_timeout_applies_to_the_response_headers():
+    assert _send_slow_upload("slow-response", 0.6, 0) == (504, None)
+
+
+class _RecordingUpstream:
+    """Records the head and body of each request, reading the body as the request frames it."""
+
+    def __init__(self):
+        self.requests: List[Dict[str, object]] = []
+        self.head_received = asyncio.Event()
+
+    async def _respond(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        head = (await reader.readuntil(b"\r\n\r\n")).decode("latin1")
+        lines = head.split("\r\n")
+        headers = dict(line.lower().split(": ", 1) for line in lines[1:] if line)
+        recorded: Dict[str, object] = {"method": lines[0].split(" ")[0], "headers": headers}
+        self.requests.append(recorded)
+        self.head_received.set()
+        body = b""
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            while size := int(await reader.readline(), 16):
+                body += await reader.readexactly(size)
+                await reader.readline()
+            await reader.readline()
+        recorded["body"] = body
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        await writer.drain()
+        writer.close()
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._respond, "127.0.0.1", 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    def close(self):
+        self._server.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """Route the app "framing" to replicas on the given ports, tried in order."""
+    targets: Dict[str, ProxyTarget] = {}
+
+    def _route(*ports: int):
+        target = _target("framing", ports[0])
+        for number, port in enumerate(ports[1:], 2):
+            target.service_entries.append(
+                ServiceEntry(
+                    service_number=number,
+                    container_id="abc",
+                    hostname="127.0.0.1",
+                    port=port,
+                    project_config_id=1,
+                )
+            )
+        targets["framing"] = target
+        monkeypatch.setattr(proxy, "_replica_counter", count())
+
+    async def _target_from_app_name(app_name: str):
+        return targets.get(app_name)
+
+    monkeypatch.setattr(proxy, "get_target_from_app_name", _target_from_app_name)
+    return _route
+
+
+async def _stream_request(
+    upstream: _RecordingUpstream,
+    method: str,
+    headers: Dict[str, str],
+    parts: List[bytes],
+    head_before_complete: bool = False,
+):
+    """Send a request through the proxy in parts, optionally waiting for it to reach the upstream first."""
+    connection = main.app.test_client().request(
+        "/app/framing/upload", method=method, headers=headers
+    )
+    async with connection:
+        for part in parts:
+            await connection.send(part)
+        if head_before_complete:
+            await asyncio.wait_for(upstream.head_received.wait(), 2)
+        await connection.send_complete()
+    return await connection.as_response()
+
+
+def _proxy_request(routed, method, headers, parts, head_before_complete=False, dead_first=False):
+    async def _run():
+        upstream = _RecordingUpstream()
+        port = await upstream.start()
+        if dead_first:
+            routed(_free_port(), port)
+        else:
+            routed(port)
+        response = await _stream_request(
+            upstream, method, headers, parts, head_before_complete
+        )
+        upstream.close()
+        return response.status_code, upstream.requests
+
+    return asyncio.run(_run())
+
+
+def test_small_body_is_buffered_and_sent_with_its_length(routed):
+    status, requests = _proxy_request(
+        routed, "POST", {"Content-Length": "10"}, [b"hello", b"world"]
+    )
+    assert status == 200
+    assert requests[0]["headers"]["content-length"] == "10"
+    assert "transfer-encoding" not in requests[0]["headers"]
+    assert requests[0]["body"] == b"helloworld"
+
+
+def test_large_body_streams_with_its_length(routed):
+    part = b"x" * proxy.PROXY_BUFFER_BYTES
+    status, requests = _proxy_request(
+        routed,
+        "POST",
+        {"Content-Length": str(2 * len(part))},
+        [part, part],
+        # The upstream has the request before the client finished sending it
+        head_before_complete=True,
+    )
+    assert status == 200
+    assert requests[0]["headers"]["content-length"] == str(2 * len(part))
+    assert "transfer-encoding" not in requests[0]["headers"]
+    assert requests[0]["body"] == part * 2
+
+
+def test_chunked_body_stays_chunked(routed):
+    status, requests = _proxy_request(
+        routed,
+        "POST",
+        {"Transfer-Encoding": "chunked"},
+        [b"hello", b"world"],
+        head_before_complete=True,
+    )
+    assert status == 200
+    assert requests[0]["headers"]["transfer-encoding"] == "chunked"
+    assert "content-length" not in requests[0]["headers"]
+    assert requests[0]["body"] == b"helloworld"
+
+
+def test_bodyless_get_has_no_framing_headers(routed):
+    status, requests = _proxy_request(routed, "GET", {}, [])
+    assert status == 200
+    assert "content-length" not in requests[0]["headers"]
+    assert "transfer-encoding" not in requests[0]["headers"]
+
+
+def test_retry_resends_the_buffered_body(routed):
+    status, requests = _proxy_request(
+        routed, "PUT", {"Content-Length": "10"}, [b"hello", b"world"], dead_first=True
+    )
+    assert status == 200
+    assert [(r["method"], r["body"]) for r in requests] == [("PUT", b"helloworld")]
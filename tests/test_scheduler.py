@@ -0,0 +1,118 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from fats import scheduler
+from fats.scheduler import Schedule, request_early_schedule_execution, start_scheduler
+
+
+@pytest.fixture(autouse=True)
+def _fresh_scheduler(monkeypatch):
+    # Schedules register themselves with the module, every test starts with none
+    monkeypatch.setattr(scheduler, "_schedules", [])
+    monkeypatch.setattr(scheduler, "_heap", [])
+    monkeypatch.setattr(scheduler, "_wakeup", None)
+    monkeypatch.setattr(scheduler, "_running_tasks", set())
+    monkeypatch.setattr(scheduler, "_started", False)
+
+
+async def _stop_scheduler():
+    for task in list(scheduler._running_tasks):
+        task.cancel()
+    await asyncio.gather(*scheduler._running_tasks, return_exceptions=True)
+
+
+def _recording_schedule(name: str, ran: list, interval: float, **kwargs) -> Schedule:
+    async def _action():
+        ran.append(name)
+
+    return Schedule(
+        interval=timedelta(seconds=interval),
+        action=_action,
+        friendly_name=name,
+        jitter=0,
+        **kwargs,
+    )
+
+
+def test_schedules_run_in_deadline_order():
+    async def _run():
+        ran = []
+        now = datetime.now()
+        # Due in 0.2s, 0.1s and right away
+        _recording_schedule("third", ran, 1, last_run=now - timedelta(seconds=0.8))
+        _recording_schedule("second", ran, 1, last_run=now - timedelta(seconds=0.9))
+        _recording_schedule("first", ran, 1)
+        start_scheduler()
+        await asyncio.sleep(0.35)
+        await _stop_scheduler()
+        return ran
+
+    assert asyncio.run(_run()) == ["first", "second", "third"]
+
+
+def test_superseded_deadlines_are_skipped():
+    async def _run():
+        ran = []
+        # Due in 0.1s, but asked to run right away, after which it is next due in a second
+        schedule = _recording_schedule(
+            "early", ran, 1, last_run=datetime.now() - timedelta(seconds=0.9)
+        )
+        start_scheduler()
+        request_early_schedule_execution(schedule)
+        await asyncio.sleep(0.3)
+        await _stop_scheduler()
+        return ran, schedule
+
+    ran, schedule = asyncio.run(_run())
+    assert ran == ["early"]
+    assert schedule.runs == 1
+
+
+def test_requests_while_running_coalesce_into_one_rerun():
+    async def _run():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def _action():
+            started.set()
+            await release.wait()
+
+        schedule = Schedule(
+            interval=timedelta(hours=1), action=_action, friendly_name="busy", jitter=0
+        )
+        start_scheduler()
+        await started.wait()
+        for _ in range(3):
+            request_early_schedule_execution(schedule)
+        assert schedule.running and schedule.pending
+
+        started.clear()
+        release.set()
+        await asyncio.wait_for(started.wait(), 1)
+        await asyncio.sleep(0.1)
+        await _stop_scheduler()
+        return schedule
+
+    schedule = asyncio.run(_run())
+    assert schedule.runs == 2
+    assert not schedule.pending
+
+
+def test_failing_actions_are_rescheduled():
+    async def _run():
+        async def _action():
+            raise RuntimeError("boom")
+
+        schedule = Schedule(
+            interval=timedelta(seconds=0.1), action=_action, friendly_name="failing", jitter=0
+        )
+        start_scheduler()
+        await asyncio.sleep(0.25)
+        await _stop_scheduler()
+        return schedule
+
+    schedule = asyncio.run(_run())
+    assert schedule.runs >= 2
+    assert not schedule.running
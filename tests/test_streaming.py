@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from fatstacks import streaming
+from fatstacks.schema.pagination import Pagination
+from fatstacks.schema.surface import Surface
+from fatstacks.streaming import continuation_uri, encode_surface
+from fatstacks.validation import validate
+
+SURFACE = Surface(id="list", name="List", items=[])
+
+
+async def _encode(items, **options) -> bytes:
+    return b"".join([chunk async for chunk in encode_surface(SURFACE, items, **options)])
+
+
+def _items(count: int, closed: list):
+    async def _generate():
+        try:
+            for i in range(count):
+                yield {"id": f"item-{i}", "content": i, "data": None}
+        finally:
+            closed.append(True)
+
+    return _generate()
+
+
+def test_streamed_surface_validates_with_every_item(monkeypatch):
+    monkeypatch.setattr(streaming, "STREAM_CHUNK_BYTES", 100)
+    closed = []
+
+    async def _run():
+        return [chunk async for chunk in encode_surface(SURFACE, _items(20, closed))]
+
+    chunks = asyncio.run(_run())
+    assert len(chunks) > 1
+    surface = validate(Surface, b"".join(chunks))
+    assert [item.id for item in surface.items] == [f"item-{i}" for i in range(20)]
+    assert surface.pagination is None
+    assert closed == [True]
+
+
+def test_page_ends_with_a_cursor_after_its_last_item_and_closes_the_items():
+    closed = []
+
+    async def _run():
+        body = await _encode(
+            _items(10, closed), page_size=4, uri="/surfaces/list?cursor=old&sort=name"
+        )
+        # Before the event loop closes leftover generators
+        return body, list(closed)
+
+    body, closed_when_sent = asyncio.run(_run())
+    surface = validate(Surface, body)
+    assert [item.id for item in surface.items] == [f"item-{i}" for i in range(4)]
+    assert surface.pagination.nextCursor == "item-3"
+    assert surface.pagination.nextUri == continuation_uri(
+        "/surfaces/list?sort=name", "item-3", 4
+    )
+    assert "cursor=item-3" in surface.pagination.nextUri
+    # The generator was stopped at the page, not left for the garbage collector
+    assert closed_when_sent == [True]
+
+
+def test_last_page_has_no_next_cursor():
+    surface = SURFACE.model_copy(
+        update={"pagination": Pagination(nextCursor="stale", nextUri="/stale")}
+    )
+
+    async def _run():
+        chunks = [c async for c in encode_surface(surface, _items(3, []), page_size=3)]
+        return b"".join(chunks)
+
+    encoded = json.loads(asyncio.run(_run()))
+    assert len(encoded["items"]) == 3
+    assert encoded["pagination"]["nextCursor"] is None
+    assert encoded["pagination"]["nextUri"] is None
@@ -0,0 +1,308 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import pytest
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import (
+    AcceptConnection,
+    BytesMessage,
+    CloseConnection,
+    RejectConnection,
+    RejectData,
+    Request,
+    TextMessage,
+)
+
+from fats import main, proxy, tunnels
+from fats.models.project_config import ProjectConfig
+from fats.models.service_entry import ServiceEntry
+from fats.proxy import ProxyTarget, close_upstream_tunnels
+
+
+class _Peer:
+    """The app's end of a WebSocket, on a local asyncio server speaking wsproto."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.connection = WSConnection(ConnectionType.SERVER)
+        self.pending: List[Any] = []
+
+    async def event(self):
+        while not self.pending:
+            data = await self.reader.read(65536)
+            self.connection.receive_data(data or None)
+            self.pending.extend(self.connection.events())
+            if not data and not self.pending:
+                return None
+        return self.pending.pop(0)
+
+    async def send(self, event):
+        self.writer.write(self.connection.send(event))
+        await self.writer.drain()
+
+    async def receive(self):
+        """The next message, or the CloseConnection that ended the WebSocket."""
+        event = await self.event()
+        if isinstance(event, (TextMessage, BytesMessage)):
+            return event.data
+        return event
+
+
+async def _serve(handle: Callable[[_Peer], Awaitable[None]]) -> asyncio.Server:
+    async def _handle(reader, writer):
+        try:
+            await handle(_Peer(reader, writer))
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(_handle, "127.0.0.1", 0)
+
+
+async def _accept(peer: _Peer, subprotocol: Optional[str] = None) -> Request:
+    request = await peer.event()
+    await peer.send(AcceptConnection(subprotocol=subprotocol))
+    return request
+
+
+class _Client:
+    """
+    Drives the app's ASGI WebSocket handling directly. Quart's test client drops close codes, and
+    counting how many messages the app pulls shows when it stops reading from the client.
+    """
+
+    def __init__(self, path: str, query: bytes = b"", subprotocols: List[str] = []):
+        self.scope: Dict[str, Any] = {
+            "type": "websocket",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": "1.1",
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query,
+            "root_path": "",
+            "headers": [(b"host", b"fats.test"), (b"x-client", b"yes")],
+            "client": ("192.0.2.1", 50000),
+            "server": ("fats.test", 80),
+            "subprotocols": subprotocols,
+            "extensions": {"websocket.http.response": {}},
+        }
+        self.incoming: asyncio.Queue[Dict[str, Any]] = asyncio.Queue()
+        self.outgoing: asyncio.Queue[Dict[str, Any]] = asyncio.Queue()
+        self.pulled = 0
+        self.task: Optional[asyncio.Task[None]] = None
+
+    async def _receive(self):
+        message = await self.incoming.get()
+        self.pulled += 1
+        return message
+
+    async def _send(self, message):
+        await self.outgoing.put(message)
+
+    def connect(self):
+        self.incoming.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(main.app(self.scope, self._receive, self._send))
+
+    def send(self, message: str | bytes):
+        key = "text" if isinstance(message, str) else "bytes"
+        self.incoming.put_nowait({"type": "websocket.receive", key: message})
+
+    async def next(self, timeout: float = 2) -> Dict[str, Any]:
+        return await asyncio.wait_for(self.outgoing.get(), timeout)
+
+    async def disconnect(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        assert self.task is not None
+        await asyncio.wait_for(self.task, 2)
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """Route the app "ws" to an upstream's port."""
+    targets: Dict[str, ProxyTarget] = {}
+
+    def _route(port: int) -> ServiceEntry:
+        project = ProjectConfig(name="ws", version="v1")
+        entry = ServiceEntry(
+            service_number=1,
+            container_id="abc",
+            hostname="127.0.0.1",
+            port=port,
+            project_config_id=1,
+        )
+        targets["ws"] = ProxyTarget(project, [entry])
+        return entry
+
+    async def _target(app_name: str):
+        return targets.get(app_name)
+
+    monkeypatch.setattr(proxy, "get_target_from_app_name", _target)
+    return _route
+
+
+def test_handshake_and_messages_are_relayed(routed):
+    requests = []
+
+    async def _echo(peer: _Peer):
+        requests.append(await _accept(peer, "chat"))
+        while isinstance(message := await peer.receive(), (str, bytes)):
+            kind = TextMessage if isinstance(message, str) else BytesMessage
+            await peer.send(kind(data=message))
+        await peer.send(message.response())
+
+    async def _run():
+        server = await _serve(_echo)
+        routed(server.sockets[0].getsockname()[1])
+        client = _Client("/app/ws/socket", b"room=1", ["chat", "other"])
+        client.connect()
+        accepted = await client.next()
+        client.send("hello")
+        client.send(b"\x00\x01")
+        echoed = [await client.next(), await client.next()]
+        await client.disconnect()
+        server.close()
+        return accepted, echoed
+
+    accepted, echoed = asyncio.run(_run())
+    assert accepted["type"] == "websocket.accept"
+    assert accepted["subprotocol"] == "chat"
+    assert [m.get("text") or m.get("bytes") for m in echoed] == ["hello", b"\x00\x01"]
+    request = requests[0]
+    assert request.target == "/socket?room=1"
+    assert request.subprotocols == ["chat", "other"]
+    headers = dict(request.extra_headers)
+    assert headers[b"x-client"] == b"yes"
+    assert headers[b"x-forwarded-for"] == b"192.0.2.1"
+
+
+def test_upstream_rejection_is_passed_to_the_client(routed):
+    async def _reject(peer: _Peer):
+        await peer.event()
+        await peer.send(
+            RejectConnection(
+                status_code=403, headers=[(b"content-length", b"7")], has_body=True
+            )
+        )
+        await peer.send(RejectData(data=b"go away", body_finished=True))
+
+    async def _run():
+        server = await _serve(_reject)
+        routed(server.sockets[0].getsockname()[1])
+        client = _Client("/app/ws/")
+        client.connect()
+        start = await client.next()
+        body = b""
+        while (message := await client.next())["type"] == "websocket.http.response.body":
+            body += message["body"]
+            if not message.get("more_body"):
+                break
+        await client.disconnect()
+        server.close()
+        return start, body
+
+    start, body = asyncio.run(_run())
+    assert start["type"] == "websocket.http.response.start"
+    assert start["status"] == 403
+    assert body == b"go away"
+
+
+def test_upstream_close_code_reaches_the_client(routed):
+    async def _close(peer: _Peer):
+        await _accept(peer)
+        await peer.send(CloseConnection(code=4001, reason="done"))
+        await peer.event()
+
+    async def _run():
+        server = await _serve(_close)
+        routed(server.sockets[0].getsockname()[1])
+        client = _Client("/app/ws/")
+        client.connect()
+        await client.next()
+        closed = await client.next()
+        await client.disconnect()
+        server.close()
+        return closed
+
+    closed = asyncio.run(_run())
+    assert (closed["type"], closed["code"], closed["reason"]) == ("websocket.close", 4001, "done")
+
+
+def _close_from_our_side(routed, shut_down: Callable[[ServiceEntry], Awaitable[None]]):
+    seen = []
+    upstream_closed = asyncio.Event()
+
+    async def _wait(peer: _Peer):
+        await _accept(peer)
+        seen.append(await peer.receive())
+        upstream_closed.set()
+
+    async def _run():
+        server = await _serve(_wait)
+        entry = routed(server.sockets[0].getsockname()[1])
+        client = _Client("/app/ws/")
+        client.connect()
+        await client.next()
+        await shut_down(entry)
+        closed = await client.next()
+        await asyncio.wait_for(upstream_closed.wait(), 2)
+        await client.disconnect()
+        server.close()
+        return closed
+
+    closed = asyncio.run(_run())
+    return closed, seen[0]
+
+
+def test_idle_tunnels_are_closed(routed, monkeypatch):
+    monkeypatch.setattr(tunnels, "TUNNEL_IDLE_TIMEOUT", 0.2)
+
+    async def _idle(entry):
+        pass
+
+    closed, upstream_close = _close_from_our_side(routed, _idle)
+    assert (closed["code"], closed["reason"]) == (tunnels.CLOSE_GOING_AWAY, "Idle timeout")
+    assert isinstance(upstream_close, CloseConnection)
+    assert upstream_close.code == tunnels.CLOSE_GOING_AWAY
+
+
+def test_draining_a_replica_closes_its_tunnels(routed):
+    async def _drain(entry):
+        assert close_upstream_tunnels(entry) == 1
+
+    closed, upstream_close = _close_from_our_side(routed, _drain)
+    assert closed["code"] == tunnels.CLOSE_SERVICE_RESTART
+    assert upstream_close.code == tunnels.CLOSE_SERVICE_RESTART
+
+
+def test_client_is_not_read_faster_than_the_upstream_reads(routed):
+    release = asyncio.Event()
+    received = []
+
+    async def _slow(peer: _Peer):
+        await _accept(peer)
+        await release.wait()
+        while isinstance(message := await peer.receive(), bytes):
+            received.append(len(message))
+
+    async def _run():
+        server = await _serve(_slow)
+        routed(server.sockets[0].getsockname()[1])
+        client = _Client("/app/ws/")
+        client.connect()
+        await client.next()
+        sent = 40
+        for _ in range(sent):
+            client.send(b"x" * 1024 * 1024)
+        await asyncio.sleep(0.5)
+        # A few messages are in socket buffers, a few in the tunnel's buffer, the rest wait for them
+        pulled_while_stalled = client.pulled
+        release.set()
+        while len(received) < sent:
+            await asyncio.sleep(0.05)
+        await client.disconnect()
+        server.close()
+        return pulled_while_stalled, sent
+
+    pulled, sent = asyncio.run(_run())
+    assert pulled < sent / 2
@@ -0,0 +1,82 @@
+import asyncio
+import os
+from pathlib import Path
+from time import monotonic
+
+from fats import scheduler, uploads
+from fats.uploads import UPLOAD_SESSION_TTL_SECONDS, UploadSession, expire_uploads_schedule
+
+
+def _session(size: int) -> UploadSession:
+    return UploadSession("upload", size, Path("/nonexistent"), -1)
+
+
+def test_ranges_received_out_of_order_are_merged():
+    session = _session(100)
+    session.mark_received(50, 75)
+    session.mark_received(0, 25)
+    assert session.received == [(0, 25), (50, 75)]
+    assert session.received_bytes == 50
+
+    # Adjacent to both neighbours
+    session.mark_received(25, 50)
+    assert session.received == [(0, 75)]
+    assert not session.complete
+
+    session.mark_received(75, 100)
+    assert session.received == [(0, 100)]
+    assert session.complete
+
+
+def test_resent_and_overlapping_ranges_are_counted_once():
+    session = _session(100)
+    session.mark_received(10, 30)
+    session.mark_received(10, 30)
+    session.mark_received(20, 40)
+    session.mark_received(60, 70)
+    session.mark_received(0, 100)
+    assert session.received == [(0, 100)]
+    assert session.received_bytes == 100
+    assert session.complete
+
+
+def test_a_range_bridging_several_others_merges_them_all():
+    session = _session(100)
+    for start in (0, 20, 40, 60):
+        session.mark_received(start, start + 10)
+    session.mark_received(5, 65)
+    assert session.received == [(0, 70)]
+
+
+def test_status_reports_inclusive_ranges():
+    session = _session(100)
+    session.mark_received(0, 10)
+    session.mark_received(90, 100)
+    status = session.status()
+    assert status["received"] == [[0, 9], [90, 99]]
+    assert status["received_bytes"] == 20
+    assert status["complete"] is False
+
+
+def test_empty_upload_is_complete_straight_away():
+    assert _session(0).complete
+
+
+def test_stale_sessions_are_discarded_by_their_schedule(monkeypatch, tmp_path):
+    def _open(name: str) -> UploadSession:
+        path = tmp_path / name
+        session = UploadSession(name, 10, path, os.open(path, os.O_CREAT | os.O_RDWR))
+        monkeypatch.setitem(uploads._sessions, name, session)
+        return session
+
+    stale, writing, fresh = _open("stale"), _open("writing"), _open("fresh")
+    stale.touched = writing.touched = monotonic() - UPLOAD_SESSION_TTL_SECONDS - 1
+    writing.writers = 1
+
+    assert expire_uploads_schedule in scheduler._schedules
+    asyncio.run(expire_uploads_schedule.action())
+    assert set(uploads._sessions) == {"writing", "fresh"}
+    assert not stale.path.exists()
+    assert fresh.path.exists()
+    for session in (writing, fresh):
+        os.close(session.fd)
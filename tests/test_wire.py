@@ -0,0 +1,62 @@
+import msgpack
+import pytest
+
+from benchmarks.fatstacks_validation import make_surface
+from fatstacks.schema.app import App
+from fatstacks.schema.surface import Surface
+from fatstacks.validation import validate
+from fatstacks.wire import (
+    JSON_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    decode,
+    encode,
+    negotiate_media_type,
+)
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        (None, JSON_MEDIA_TYPE),
+        ("", JSON_MEDIA_TYPE),
+        ("application/msgpack", MSGPACK_MEDIA_TYPE),
+        ("application/x-msgpack", MSGPACK_MEDIA_TYPE),
+        ("application/vnd.msgpack; charset=binary", MSGPACK_MEDIA_TYPE),
+        # JSON wins ties, so MessagePack has to be asked for
+        ("*/*", JSON_MEDIA_TYPE),
+        ("application/*", JSON_MEDIA_TYPE),
+        ("application/json, application/msgpack", JSON_MEDIA_TYPE),
+        ("application/json;q=0.5, application/msgpack", MSGPACK_MEDIA_TYPE),
+        ("application/msgpack;q=0.9, */*;q=0.1", MSGPACK_MEDIA_TYPE),
+        ("application/json;q=0, */*", MSGPACK_MEDIA_TYPE),
+        # Clients that only accept other things still get JSON from */*
+        ("text/html, */*;q=0.8", JSON_MEDIA_TYPE),
+        ("text/html", None),
+        ("application/json;q=0", None),
+    ],
+)
+def test_media_type_is_negotiated_from_accept(accept, expected):
+    assert negotiate_media_type(accept) == expected
+
+
+def test_surface_survives_a_messagepack_round_trip():
+    surface = validate(Surface, make_surface(40))
+    body = encode(surface, MSGPACK_MEDIA_TYPE)
+    assert isinstance(msgpack.unpackb(body), dict)
+    assert decode(Surface, body, "application/x-msgpack") == surface
+    assert decode(Surface, encode(surface), JSON_MEDIA_TYPE) == surface
+
+
+def test_app_survives_a_messagepack_round_trip():
+    app = App(
+        id="docs",
+        name="Docs",
+        surfaceIds=["home", "detail"],
+        desiredRuntimeCapabilities=["authentication"],
+    )
+    assert decode(App, encode(app, MSGPACK_MEDIA_TYPE), MSGPACK_MEDIA_TYPE) == app
+
+
+def test_invalid_messagepack_is_a_value_error():
+    with pytest.raises(ValueError):
+        decode(App, b"\xc1", MSGPACK_MEDIA_TYPE)